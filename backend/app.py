@@ -1,79 +1,278 @@
 import os
-import csv
-import io
-from flask import Flask, request, jsonify, send_from_directory
+from functools import wraps
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load .env before the helper modules below read their settings
+load_dotenv()
+
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, make_response, send_file, stream_with_context
 from werkzeug.utils import secure_filename
-from pymongo import MongoClient
-from urllib.parse import quote_plus
-from flask_bcrypt import Bcrypt
+from pymongo.errors import DuplicateKeyError
 from flask_cors import CORS
 from bson import ObjectId # Used to handle Mongo's _id
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from mongo import mongo, pool_options_from_env
+from indexes import ensure_indexes, audit_indexes, IndexGuard
+from pagination import page_params, fetch_page, InvalidPageRequest, DEFAULT_PAGE_SIZE
+from streaming import iter_json_array, stream_batch_size
+from roster import import_roster, read_roster_rows, ROSTER_BATCH_SIZE
+from slots import free_mask, slot_times, first_free_slots
+from hashing import hash_password, check_password, needs_rehash, HashingBusy
+from doctor_cache import DoctorDirectory
+from doctor_stats import DoctorStatsCache, compute_doctor_stats
+from names import NameSync, versioned_set
+from rollup import DailyStats, activity, today_str, ensure_built as ensure_daily_stats
+from versions import ChangeVersions, student_key, doctor_key
+from json_provider import MongoJSONProvider
+from storage import store_upload, send_upload, upload_path, UPLOADS_CACHE_CONTROL
+from previews import schedule_preview, preview_path, PREVIEW_RETRY_AFTER
+from timeline import fetch_timeline, timeline_options
+from metrics import metrics, install as install_metrics
+from slow_queries import slow_query_report, log_stats as slow_query_log_stats, install as install_slow_query_log
+from events import bus, publish, iter_events, start_change_feed, TooManySubscribers, PHARMACY_QUEUE, LAB_REQUESTS
+
+# All routes live on this blueprint; create_app() builds the Flask app around it
+api = Blueprint('api', __name__)
+
+# --- 1. APP FACTORY ---
+# Nothing here touches the network: each worker creates its own MongoClient
+# on first use (see mongo.py), so the app can be imported in a gunicorn
+# master with --preload and forked safely. See gunicorn.conf.py.
+def create_app(config=None):
+    app = Flask(__name__)
+
+    # jsonify() encodes ObjectId / datetime / BSON types directly (see json_provider.py)
+    app.json = MongoJSONProvider(app)
+
+    # We'll use a secret key for sessions later (for JWT tokens)
+    app.secret_key = os.getenv('SECRET_KEY', 'default_dev_secret')
+
+    # --- CONFIG FOR UPLOADS ---
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), 'uploads'))
+
+    # Stream full (un-paged) list responses by default instead of only on ?stream=1
+    app.config['STREAM_LIST_RESPONSES'] = os.getenv('STREAM_LIST_RESPONSES', '0') == '1'
+
+    # Build missing indexes at startup (prepare_database)
+    app.config['ENSURE_INDEXES'] = os.getenv('ENSURE_INDEXES', '1') == '1'
+
+    if config:
+        app.config.update(config)
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # --- 2. DATABASE CONNECTION ---
+    if app.config.get('MONGO_URI'):
+        mongo.configure(app.config['MONGO_URI'], app.config.get('MONGO_DB_NAME', mongo.db_name), **pool_options_from_env())
+    elif not mongo.uri:
+        print("❌ ERROR: MONGO_URI not found in environment variables.")
+
+    # Init CORS to allow cross-origin requests (from React)
+    CORS(app)
+
+    app.register_blueprint(api)
+    # Latency / Mongo command counts per endpoint, exported on /metrics
+    install_metrics(app, mongo)
+    # Explain plans of commands slower than SLOW_QUERY_MS (see slow_queries.py)
+    install_slow_query_log(mongo, metrics.current_endpoint)
+    return app
+
+# One-time database setup, run before any request is served: once in the
+# gunicorn master (on_starting in gunicorn.conf.py), before app.run() below,
+# or on its own with `python app.py prepare`. Never inside a request, so no
+# request waits behind an index build or a rollup rebuild.
+def prepare_database(app):
+    if app.config['ENSURE_INDEXES']:
+        # Build the indexes every route below depends on (see indexes.py);
+        # raises if active_slot_unique can't be built
+        ensure_indexes(db)
+    # First run against an existing database: backfill the dashboard rollup
+    ensure_daily_stats(db)
+
+# Per-process background work started once a worker is up (gunicorn
+# post_worker_init): correct names stored before the rename fan-out
+def start_background_jobs():
+    name_sync.ensure_reconciled()
+
+# Password hashing runs in a bounded process pool (see hashing.py)
+@api.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    return jsonify({"error": "Server is busy, please try again in a moment."}), 503, {"Retry-After": "1"}
+
+# --- HEALTH CHECKS ---
+# Liveness: the process is serving requests (never touches Mongo)
+@api.route('/healthz')
+def liveness():
+    return jsonify({"status": "ok", "pid": os.getpid(), "mongoConnected": mongo.is_connected(),
+                    "pool": mongo.pool_stats.snapshot()}), 200
+
+# Readiness: Mongo answers a ping through this worker's pool
+@api.route('/readyz')
+def readiness():
+    try:
+        mongo.ping()
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e), "pool": mongo.pool_stats.snapshot()}), 503
+    return jsonify({"status": "ready", "pid": os.getpid(), "pool": mongo.pool_stats.snapshot()}), 200
+
+# Prometheus scrape target (see metrics.py); this worker's numbers only
+@api.route('/metrics')
+def prometheus_metrics():
+    pool = mongo.pool_stats.snapshot()
+    directory = doctor_directory.stats()
+    doctor_stats = doctor_stats_cache.stats()
+    gauges = [
+        ("mongo_pool_connections", "Open connections in this worker's MongoDB pool.",
+         {("open",): pool["open"], ("in_use",): pool["inUse"]}, ("state",)),
+        ("mongo_pool_checkout_failures", "Connection checkouts that failed or timed out.",
+         {(): pool["checkoutFailures"]}, ()),
+        ("cache_hits", "Cache hits since the worker started.",
+         {("doctor_directory",): directory["hits"], ("doctor_stats",): doctor_stats["hits"]}, ("cache",)),
+        ("cache_misses", "Cache misses since the worker started.",
+         {("doctor_directory",): directory["misses"], ("doctor_stats",): doctor_stats["misses"]}, ("cache",)),
+        ("sse_subscribers", "Open Server-Sent Events streams.",
+         {(channel,): n for channel, n in bus.stats().items()}, ("channel",)),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
-load_dotenv()
+# --- COLLECTIONS ---
+# Lazy handles: each call resolves against the current worker's client
+db = mongo.lazy_db()
 
-app = Flask(__name__)
+patients_collection = db.patients
+# NEW COLLECTION for doctors/staff:
+staff_users_collection = db.staff_users
+university_students_collection = db.university_students
+student_users_collection = db.student_users
+appointments_collection = db.appointments
+lab_reports_collection = db.lab_reports
+lab_requests_collection = db.lab_requests # NEW: For Doctor -> Lab Tech requests
+prescriptions_collection = db.prescriptions
+app_meta_collection = db.app_meta # Shared version stamps for per-worker caches
+lab_files_collection = db.lab_files # Reference counts for content-addressed uploads
 
-# --- 1. CONFIGURATION ---
+# Bookings are only safe while the unique slot index exists (see indexes.py)
+slot_index = IndexGuard(appointments_collection, "active_slot_unique")
 
-# We'll use a secret key for sessions later (for JWT tokens)
-app.secret_key = os.getenv('SECRET_KEY', 'default_dev_secret')
+# Cached doctor list shared by the doctor/slot routes (see doctor_cache.py).
+# Every write to a doctor must call doctor_directory.invalidate().
+doctor_directory = DoctorDirectory(staff_users_collection, app_meta_collection)
 
-# Init Bcrypt for password hashing
-bcrypt = Bcrypt(app)
+# Per-student / per-doctor change counters behind the history ETags (see versions.py).
+# Every write to appointments, prescriptions or lab data must bump them.
+change_versions = ChangeVersions(db.change_versions)
 
-# Init CORS to allow cross-origin requests (from React)
-# Init CORS to allow cross-origin requests (from React)
-CORS(app)
+# Pushes doctor / student renames into denormalized name fields (see names.py)
+name_sync = NameSync(db, change_versions)
 
-# --- CONFIG FOR UPLOADS ---
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Per-day dashboard counters; every booking, prescription and lab write
+# must record its deltas here (see rollup.py)
+daily_stats = DailyStats(db.daily_stats)
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER 
+# Doctor dashboard counters, keyed by the doctor's change version (see doctor_stats.py)
+doctor_stats_cache = DoctorStatsCache()
 
-# --- 2. DATABASE CONNECTION ---
-uri = os.getenv('MONGO_URI')
-if not uri:
-    print("❌ ERROR: MONGO_URI not found in environment variables.")
+# --- LIST RESPONSES ---
+# Shared by every list route. Plain GET returns the full array (what the
+# portals expect today); ?limit=N[&cursor=...] returns one keyset page as
+# {"items": [...], "nextCursor": "..."} (see pagination.py).
+# ?stream=1 sends the full array straight from the cursor (see streaming.py).
+def list_response(collection, query, sort):
+    try:
+        params = page_params(request.args)
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+
+    if params is None and wants_stream():
+        cursor = collection.find(query).sort(sort)
+        chunks = iter_json_array(cursor, current_app.json.dumps, stream_batch_size(request.args))
+        return Response(stream_with_context(chunks), mimetype='application/json'), 200
+
+    if params is None:
+        docs = list(collection.find(query).sort(sort))
+        next_cursor = None
+    else:
+        limit, cursor = params
+        try:
+            docs, next_cursor = fetch_page(collection, query, sort, limit, cursor)
+        except InvalidPageRequest as e:
+            return jsonify({"error": str(e)}), 400
+
+    if params is None:
+        return jsonify(docs), 200
+    return jsonify({"items": docs, "nextCursor": next_cursor}), 200
+
+# --- CONDITIONAL GET ---
+# Wraps a history route: answers 304 from the owner's change version alone
+# (no list query, no serialization) when the client's If-None-Match matches.
+def conditional(key_fn, arg):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            etag = change_versions.etag(key_fn(kwargs[arg]), request.full_path)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Let the browser keep the copy but always revalidate
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# --- BOOKKEEPING ---
+# Change-version bumps, rollup deltas and SSE events that follow a write.
+# The write itself has already succeeded, so a failure here is logged
+# instead of answering 500 (a retry would then hit the client's own record);
+# ETags move on with the next write and `python rollup.py rebuild` repairs
+# the counters.
+@contextmanager
+def bookkeeping(what):
+    try:
+        yield
+    except Exception as e:
+        print(f"[BOOKKEEPING FAILED] {what}: {e}")
 
+# --- LIVE QUEUES (SSE) ---
+# Opens a Server-Sent Events stream: a snapshot first, then incremental
+# events published by the write routes (see events.py).
+def event_stream(channel, snapshot):
+    start_change_feed(db)
+    try:
+        sub = bus.subscribe(channel)
+    except TooManySubscribers:
+        return jsonify({"error": "Too many live connections, please try again later."}), 503, {"Retry-After": "5"}
 
-try:
-    client = MongoClient(uri, serverSelectionTimeoutMS=5000) # Add timeout
-    client.admin.command('ping')
-    print("[SUCCESS] Connected to MongoDB.")
-    db = client.smarthealthconnect
-except Exception as e:
-    print(f"[CONNECTION FAILED] {e}")
-    client = None
-    db = None
+    def generate():
+        try:
+            yield from iter_events(sub, snapshot, current_app.json.dumps)
+        finally:
+            bus.unsubscribe(sub)
 
-if db is None:
-    print("CRITICAL: Failed to connect to MongoDB. Exiting.")
-    exit(1)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # nginx: send each event as it is written
+    })
 
-patients_collection = db.patients
-# NEW COLLECTION for doctors/staff:
-staff_users_collection = db.staff_users
-university_students_collection = db.university_students
-student_users_collection = db.student_users
-appointments_collection = db.appointments
-appointments_collection = db.appointments
-lab_reports_collection = db.lab_reports
-lab_requests_collection = db.lab_requests # NEW: For Doctor -> Lab Tech requests
-prescriptions_collection = db.prescriptions
+def wants_stream():
+    flag = request.args.get('stream')
+    if flag is None:
+        return current_app.config['STREAM_LIST_RESPONSES']
+    return flag.lower() in ('1', 'true', 'yes')
 
 # --- ADMIN API ROUTES ---
 
 # 1. SEED ADMIN (One-time use)
-@app.route('/api/admin/create-first-admin')
+@api.route('/api/admin/create-first-admin')
 def create_first_admin():
     if staff_users_collection.find_one({"role": "admin"}):
         return "Admin already exists."
 
-    hashed_password = bcrypt.generate_password_hash("admin123").decode('utf-8')
+    hashed_password = hash_password("admin123")
     
     staff_users_collection.insert_one({
         "email": "admin@svu.edu",
@@ -84,13 +283,13 @@ def create_first_admin():
     return "Admin created: admin@svu.edu / admin123"
 
 # 2. MANAGE DOCTORS (GET ALL / ADD NEW)
-@app.route('/api/admin/doctors', methods=['GET', 'POST'])
+@api.route('/api/admin/doctors', methods=['GET', 'POST'])
 def manage_doctors():
     if request.method == 'GET':
         doctors = []
-        for doc in staff_users_collection.find({"role": "doctor"}):
+        for doc in doctor_directory.all():
             doctors.append({
-                "id": str(doc['_id']),
+                "id": doc['id'],
                 "name": doc.get('name'),
                 "email": doc.get('email'),
                 "specialization": doc.get('specialization', 'General'),
@@ -109,7 +308,7 @@ def manage_doctors():
         if staff_users_collection.find_one({"email": email}):
             return jsonify({"error": "Email already exists"}), 400
 
-        hashed_password = bcrypt.generate_password_hash(data.get('password', 'password123')).decode('utf-8')
+        hashed_password = hash_password(data.get('password', 'password123'))
         
         staff_users_collection.insert_one({
             "email": email,
@@ -123,10 +322,11 @@ def manage_doctors():
             "eveningStart": data.get('eveningStart', '17:00'),
             "eveningEnd": data.get('eveningEnd', '21:00')
         })
+        doctor_directory.invalidate()
         return jsonify({"message": "Doctor created successfully"}), 201
 
 # 3. MANAGE SPECIFIC DOCTOR (UPDATE / DELETE)
-@app.route('/api/admin/doctor/<doctor_id>', methods=['PUT', 'DELETE'])
+@api.route('/api/admin/doctor/<doctor_id>', methods=['PUT', 'DELETE'])
 def manage_specific_doctor(doctor_id):
     if request.method == 'PUT':
         data = request.get_json()
@@ -145,18 +345,23 @@ def manage_specific_doctor(doctor_id):
         
         staff_users_collection.update_one(
             {"_id": ObjectId(doctor_id)},
-            {"$set": update_fields}
+            versioned_set(update_fields) # bumps nameVersion on a rename
         )
+        doctor_directory.invalidate()
+        if 'name' in update_fields:
+            # Copy the new name into appointments / prescriptions / lab requests
+            name_sync.schedule_doctor(doctor_id)
         return jsonify({"message": "Doctor updated successfully"}), 200
 
     if request.method == 'DELETE':
         # Optional: Check for future appointments before deleting?
         # For now, just delete functionality.
         staff_users_collection.delete_one({"_id": ObjectId(doctor_id)})
+        doctor_directory.invalidate()
         return jsonify({"message": "Doctor removed successfully"}), 200
 
 # 3b. MANAGE OTHER STAFF (Pharmacists, Lab Techs, etc.)
-@app.route('/api/admin/staff', methods=['GET', 'POST'])
+@api.route('/api/admin/staff', methods=['GET', 'POST'])
 def manage_staff():
     if request.method == 'GET':
         staff = []
@@ -177,7 +382,7 @@ def manage_staff():
         if staff_users_collection.find_one({"email": email}):
             return jsonify({"error": "Email already exists"}), 400
 
-        hashed_password = bcrypt.generate_password_hash(data.get('password', 'password123')).decode('utf-8')
+        hashed_password = hash_password(data.get('password', 'password123'))
         
         staff_users_collection.insert_one({
             "email": email,
@@ -185,9 +390,11 @@ def manage_staff():
             "password": hashed_password,
             "role": data.get('role', 'staff') # 'pharmacist', 'lab_tech', etc.
         })
+        if data.get('role') == 'doctor':
+            doctor_directory.invalidate()
         return jsonify({"message": "Staff member created successfully"}), 201
 
-@app.route('/api/admin/staff/<staff_id>', methods=['PUT', 'DELETE'])
+@api.route('/api/admin/staff/<staff_id>', methods=['PUT', 'DELETE'])
 def manage_specific_staff(staff_id):
     if request.method == 'PUT':
         data = request.get_json()
@@ -201,54 +408,90 @@ def manage_specific_staff(staff_id):
         
         staff_users_collection.update_one(
             {"_id": ObjectId(staff_id)},
-            {"$set": update_fields}
+            versioned_set(update_fields) # bumps nameVersion on a rename
         )
+        # Role or name changes can add/remove/rename a doctor
+        doctor_directory.invalidate()
+        if 'name' in update_fields:
+            name_sync.schedule_doctor(staff_id)
         return jsonify({"message": "Staff updated successfully"}), 200
 
     if request.method == 'DELETE':
         staff_users_collection.delete_one({"_id": ObjectId(staff_id)})
+        doctor_directory.invalidate()
         return jsonify({"message": "Staff removed successfully"}), 200
 
 # 4. VIEW ALL APPOINTMENTS
-@app.route('/api/admin/appointments', methods=['GET'])
+@api.route('/api/admin/appointments', methods=['GET'])
 def get_all_appointments():
-    all_appts = []
-    # Sort by Date DESC
-    for appt in appointments_collection.find().sort([("date", -1), ("time", -1)]):
-        appt['_id'] = str(appt['_id'])
-        
-        # Update Doctor Name dynamically
-        if 'doctorId' in appt:
-            try:
-                doctor = staff_users_collection.find_one({"_id": ObjectId(appt['doctorId'])})
-                if doctor:
-                    appt['doctorName'] = doctor.get('name', appt.get('doctorName'))
-            except:
-                pass # Keep original name if ID is invalid or not found
-
-        # Update Student Name dynamically
-        if 'studentId' in appt:
-            student = university_students_collection.find_one({"studentId": appt['studentId']})
-            if student:
-                appt['studentName'] = student.get('name', appt.get('studentName'))
-
-        all_appts.append(appt)
-    return jsonify(all_appts), 200
+    # Sort by Date DESC; stored names are kept current by name_sync
+    return list_response(appointments_collection, {}, [("date", -1), ("time", -1), ("_id", -1)])
+
+# The staff_users doctor with this id (name and nameVersion only), or None.
+def find_doctor(doctor_id):
+    if not isinstance(doctor_id, str) or not ObjectId.is_valid(doctor_id):
+        return None
+    return staff_users_collection.find_one({"_id": ObjectId(doctor_id), "role": "doctor"}, {"name": 1, "nameVersion": 1})
+
+# doctorName / studentName for a new appointment, prescription or lab
+# request, read from staff_users / university_students (one indexed
+# find_one each, never the names the client sent) and stamped with the
+# nameVersion they were read at. A rename fanned out in between is caught
+# by `python names.py reconcile`; later renames reach them through
+# name_sync, so list routes never look names up. `doctor` is find_doctor()'s
+# result (None when the id isn't a doctor).
+def stored_names(student_id, doctor):
+    names = {"studentName": "Unknown", "doctorName": "Unknown"}
+    student = university_students_collection.find_one({"studentId": student_id}, {"name": 1, "nameVersion": 1})
+    if student and student.get('name'):
+        names["studentName"] = student['name']
+        names["studentNameVersion"] = student.get('nameVersion', 0)
+    if doctor and doctor.get('name'):
+        names["doctorName"] = doctor['name']
+        names["doctorNameVersion"] = doctor.get('nameVersion', 0)
+    return names
 
 # 5. DELETE APPOINTMENT (ADMIN)
-@app.route('/api/admin/appointment/<appointment_id>', methods=['DELETE'])
+@api.route('/api/admin/appointment/<appointment_id>', methods=['DELETE'])
 def delete_appointment_admin(appointment_id):
-    result = appointments_collection.delete_one({"_id": ObjectId(appointment_id)})
-    if result.deleted_count == 1:
+    deleted = appointments_collection.find_one_and_delete(
+        {"_id": ObjectId(appointment_id)},
+        projection={"studentId": 1, "doctorId": 1, "date": 1, "status": 1}
+    )
+    if deleted:
+        with bookkeeping(f"delete appointment {appointment_id}"):
+            change_versions.bump(student_key(deleted.get('studentId')), doctor_key(deleted.get('doctorId')))
         return jsonify({"message": "Appointment deleted successfully"}), 200
     else:
         return jsonify({"error": "Appointment not found"}), 404
 
 
+# 6. INDEX AUDIT (missing / unused / redundant indexes)
+@api.route('/api/admin/indexes', methods=['GET'])
+def get_index_audit():
+    report = audit_indexes(db)
+    return jsonify(report), 200
+
+# 7. CACHE STATS (doctor directory hit/miss counters)
+@api.route('/api/admin/cache-stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({"doctorDirectory": doctor_directory.stats(), "doctorStats": doctor_stats_cache.stats()}), 200
+
+# 8. SLOW QUERIES (explain plans grouped by query shape, worst total time first)
+@api.route('/api/admin/slow-queries', methods=['GET'])
+def get_slow_queries():
+    try:
+        hours = float(request.args.get('hours', 24))
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "hours and limit must be numbers"}), 400
+    return jsonify({"log": slow_query_log_stats(), "shapes": slow_query_report(db, hours, limit)}), 200
+
+
 # --- 4. STAFF AUTHENTICATION API ROUTES ---
 
 # REGISTER a new staff member (Admin-only task)
-@app.route('/api/staff/register', methods=['POST'])
+@api.route('/api/staff/register', methods=['POST'])
 def staff_register():
     data = request.get_json()
     email = data['email']
@@ -259,7 +502,7 @@ def staff_register():
         return jsonify({"error": "Email already exists"}), 400
 
     # Hash the password
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    hashed_password = hash_password(data['password'])
     
     staff_users_collection.insert_one({
         "email": email,
@@ -267,11 +510,12 @@ def staff_register():
         "password": hashed_password,
         "role": "doctor" # We can set a default role
     })
+    doctor_directory.invalidate()
     
     return jsonify({"message": "Staff user created successfully"}), 201
 
 # LOGIN for staff
-@app.route('/api/staff/login', methods=['POST'])
+@api.route('/api/staff/login', methods=['POST'])
 def staff_login():
     data = request.get_json()
     email = data['email']
@@ -280,7 +524,8 @@ def staff_login():
     user = staff_users_collection.find_one({"email": email})
     
     # Check if user exists and password is correct
-    if user and bcrypt.check_password_hash(user['password'], password):
+    if user and check_password(user.get('password'), password):
+        rehash_if_needed(staff_users_collection, user, password)
         # We will add a JWT token here later
         return jsonify({
             "message": "Login successful",
@@ -296,8 +541,16 @@ def staff_login():
     else:
         return jsonify({"error": "Invalid email or password"}), 401
 
+# Upgrade a stored hash to the configured BCRYPT_LOG_ROUNDS after a successful login
+def rehash_if_needed(collection, user, password):
+    if needs_rehash(user['password']):
+        collection.update_one(
+            {"_id": user['_id'], "password": user['password']},
+            {"$set": {"password": hash_password(password)}}
+        )
+
 # UPDATE Availability (Doctor)
-@app.route('/api/doctor/availability', methods=['POST'])
+@api.route('/api/doctor/availability', methods=['POST'])
 def update_availability():
     data = request.get_json()
     doctor_id = data.get('doctorId')
@@ -308,32 +561,40 @@ def update_availability():
         {"_id": ObjectId(doctor_id)},
         {"$set": {"startTime": start_time, "endTime": end_time}}
     )
+    doctor_directory.invalidate()
     
     return jsonify({"message": "Availability updated successfully"}), 200
 
 # CANCEL Appointment
-@app.route('/api/appointments/cancel', methods=['POST'])
+@api.route('/api/appointments/cancel', methods=['POST'])
 def cancel_appointment():
     data = request.get_json()
     appointment_id = data.get('appointmentId')
     
-    appointments_collection.update_one(
+    # Dropping "active" frees the slot for rebooking
+    appt = appointments_collection.find_one_and_update(
         {"_id": ObjectId(appointment_id)},
-        {"$set": {"status": "Cancelled"}}
+        {"$set": {"status": "Cancelled", "cancelledAt": datetime.now()}, "$unset": {"active": ""}},
+        projection={"studentId": 1, "doctorId": 1, "date": 1, "status": 1}
     )
+    if appt:
+        with bookkeeping(f"cancel appointment {appointment_id}"):
+            change_versions.bump(student_key(appt.get('studentId')), doctor_key(appt.get('doctorId')))
+            if appt.get('status') != "Cancelled":
+                daily_stats.record((today_str(), activity("cancellations", appt.get('doctorId'))))
     
     return jsonify({"message": "Appointment cancelled successfully"}), 200
     
     # --- 5. TEMP ADMIN HELPER ---
 # We will use this ONE TIME to create our first doctor
-@app.route('/api/admin/create-first-doctor')
+@api.route('/api/admin/create-first-doctor')
 def create_first_doctor():
     # Check if a doctor already exists
     if staff_users_collection.find_one({"email": "dr.venkat@svu.edu"}):
         return "Doctor Venkat already exists."
 
     # Hash a password
-    hashed_password = bcrypt.generate_password_hash("password123").decode('utf-8')
+    hashed_password = hash_password("password123")
     
     # Insert the new doctor
     staff_users_collection.insert_one({
@@ -343,14 +604,15 @@ def create_first_doctor():
         "role": "doctor",
         "specialization": "Senior Doctor - General Medicine"
     })
+    doctor_directory.invalidate()
     return "Dr. Venkat created with password 'password123'."
 
-@app.route('/api/admin/create-first-pharmacist')
+@api.route('/api/admin/create-first-pharmacist')
 def create_first_pharmacist():
     if staff_users_collection.find_one({"email": "pharmacist.meena@svu.edu"}):
         return "Pharmacist already exists."
 
-    hashed_password = bcrypt.generate_password_hash("password123").decode('utf-8')
+    hashed_password = hash_password("password123")
     
     staff_users_collection.insert_one({
         "email": "pharmacist.meena@svu.edu",
@@ -360,12 +622,12 @@ def create_first_pharmacist():
     })
     return "Pharmacist Meena created with password 'password123'."
 
-@app.route('/api/admin/create-first-labtech')
+@api.route('/api/admin/create-first-labtech')
 def create_first_labtech():
     if staff_users_collection.find_one({"email": "labtech.ravi@svu.edu"}):
         return "Lab Tech already exists."
 
-    hashed_password = bcrypt.generate_password_hash("password123").decode('utf-8')
+    hashed_password = hash_password("password123")
     
     staff_users_collection.insert_one({
         "email": "labtech.ravi@svu.edu",
@@ -380,35 +642,19 @@ def create_first_labtech():
 # ... (All your existing Patient and Staff API routes are fine) ...
 
 # 2. ADMIN DASHBOARD STATS
-@app.route('/api/admin/stats', methods=['GET'])
+@api.route('/api/admin/stats', methods=['GET'])
 def get_admin_stats():
     # Total Users = Registered Students + All Staff (Doctors, Pharmacists, etc.)
-    student_count = student_users_collection.count_documents({})
-    staff_count = staff_users_collection.count_documents({})
+    # Collection metadata counts: no scan, exact unless the server crashed mid-write
+    student_count = student_users_collection.estimated_document_count()
+    staff_count = staff_users_collection.estimated_document_count()
     total_users = student_count + staff_count
 
     # Pending Appointments (Upcoming based on time)
-    # We need to filter for appointments that are in the future
-    all_appts = appointments_collection.find()
-    pending_count = 0
-    now = datetime.now()
-
-    for appt in all_appts:
-        try:
-            # Combine date and time strings to a datetime object
-            # Assumption: date is "YYYY-MM-DD", time is "HH:MM"
-            appt_dt_str = f"{appt['date']} {appt['time']}"
-            appt_dt = datetime.strptime(appt_dt_str, "%Y-%m-%d %H:%M")
-            
-            # Check if it's in the future and NOT cancelled
-            if appt_dt > now and appt.get('status') != 'Cancelled':
-                pending_count += 1
-        except Exception:
-            # Skip invalid dates
-            continue
+    pending_count = count_upcoming_appointments(datetime.now())
 
     # Total Doctors
-    total_doctors = staff_users_collection.count_documents({"role": "doctor"})
+    total_doctors = len(doctor_directory.all())
 
     return jsonify({
         "total_users": total_users,
@@ -416,10 +662,26 @@ def get_admin_stats():
         "total_doctors": total_doctors
     }), 200
 
+# Count future, non-cancelled appointments inside Mongo (exact, unlike the
+# daily_stats rollup). date is "YYYY-MM-DD" and time is "HH:MM" (zero
+# padded), so plain string comparison orders them chronologically and the
+# date_time index serves the range. The regexes keep malformed rows out.
+def count_upcoming_appointments(now):
+    today = now.strftime("%Y-%m-%d")
+    current_time = now.strftime("%H:%M")
+    return appointments_collection.count_documents({
+        "$or": [
+            {"date": {"$gt": today, "$regex": r"^\d{4}-\d{2}-\d{2}$"}},
+            {"date": today, "time": {"$gt": current_time}}
+        ],
+        "time": {"$regex": r"^\d{2}:\d{2}$"},
+        "status": {"$ne": "Cancelled"}
+    })
+
 # --- 6. STUDENT AUTHENTICATION API ROUTES ---
 
 # This route just checks if the student is in the university records
-@app.route('/api/student/verify', methods=['POST'])
+@api.route('/api/student/verify', methods=['POST'])
 def student_verify():
     data = request.get_json()
     student_id = data.get('studentId')
@@ -447,7 +709,7 @@ def student_verify():
     }), 200
 
 # This route creates the new login account after verification
-@app.route('/api/student/create-account', methods=['POST'])
+@api.route('/api/student/create-account', methods=['POST'])
 def student_create_account():
     data = request.get_json()
     student_id = data.get('studentId')
@@ -458,7 +720,7 @@ def student_create_account():
         return jsonify({"error": "Account already exists."}), 400
 
     # Hash the new password
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_password = hash_password(password)
 
     # Create the new user in the `student_users` collection
     student_users_collection.insert_one({
@@ -472,14 +734,10 @@ def student_create_account():
 # --- 7. ADMIN - MANAGE UNIVERSITY STUDENTS ---
 
 # GET ALL / ADD SINGLE STUDENT
-@app.route('/api/admin/university-students', methods=['GET', 'POST'])
+@api.route('/api/admin/university-students', methods=['GET', 'POST'])
 def manage_university_students():
     if request.method == 'GET':
-        students = []
-        for s in university_students_collection.find():
-            s['_id'] = str(s['_id'])
-            students.append(s)
-        return jsonify(students), 200
+        return list_response(university_students_collection, {}, [("_id", 1)])
 
     if request.method == 'POST':
         data = request.get_json()
@@ -497,7 +755,7 @@ def manage_university_students():
         return jsonify({"message": "Student added successfully"}), 201
 
 # BULK UPLOAD STUDENTS (CSV)
-@app.route('/api/admin/university-students/upload', methods=['POST'])
+@api.route('/api/admin/university-students/upload', methods=['POST'])
 def upload_university_students():
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -506,42 +764,27 @@ def upload_university_students():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if file:
-        try:
-            # Read CSV file
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_input = csv.DictReader(stream)
-            
-            count = 0
-            errors = []
-            
-            for row in csv_input:
-                # Expecting headers: studentId, name, phone
-                s_id = row.get('studentId')
-                name = row.get('name')
-                phone = row.get('phone')
-
-                if s_id and name and phone:
-                    # Update if exists, Insert if new (Upsert)
-                    university_students_collection.update_one(
-                        {"studentId": s_id},
-                        {"$set": {
-                            "name": name, 
-                            "registeredPhone": phone,
-                            "updatedAt": datetime.now()
-                        }},
-                        upsert=True
-                    )
-                    count += 1
-                else:
-                    errors.append(f"Skipped row: {row}")
-
-            return jsonify({"message": f"Processed {count} students successfully.", "errors": errors}), 200
-        except Exception as e:
-            return jsonify({"error": f"Failed to process CSV: {str(e)}"}), 500
+    try:
+        batch_size = int(request.form.get('batchSize', ROSTER_BATCH_SIZE))
+    except ValueError:
+        return jsonify({"error": "batchSize must be an integer"}), 400
+
+    try:
+        # Parse the upload as a stream and upsert in unordered bulk batches
+        result = import_roster(university_students_collection, read_roster_rows(file.stream), max(1, batch_size))
+        # Renamed students: copy the new names out in the background
+        name_sync.schedule_pending()
+        return jsonify({
+            "message": f"Processed {result['count']} students successfully.",
+            "errors": result['errors'],
+            "batches": result['batches'],
+            "rowsPerSecond": result['rowsPerSecond']
+        }), 200
+    except Exception as e:
+        return jsonify({"error": f"Failed to process CSV: {str(e)}"}), 500
 
 # DELETE STUDENT
-@app.route('/api/admin/university-students/<student_id>', methods=['DELETE'])
+@api.route('/api/admin/university-students/<student_id>', methods=['DELETE'])
 def delete_university_student(student_id):
     # 1. FIND the student first to get the correct ID
     student_to_delete = None
@@ -571,7 +814,7 @@ def delete_university_student(student_id):
     return jsonify({"message": "Student and associated account removed successfully"}), 200
 
 # --- 7. STUDENT LOGIN ROUTE ---
-@app.route('/api/student/login', methods=['POST'])
+@api.route('/api/student/login', methods=['POST'])
 def student_login():
     data = request.get_json()
     student_id = data.get('studentId')
@@ -581,7 +824,8 @@ def student_login():
     user = student_users_collection.find_one({"studentId": student_id})
     
     # Check password
-    if user and bcrypt.check_password_hash(user['password'], password):
+    if user and check_password(user.get('password'), password):
+        rehash_if_needed(student_users_collection, user, password)
         # We also want to get their real name from the university records
         # to show a nice "Welcome, Alice" message
         student_details = university_students_collection.find_one({"studentId": student_id})
@@ -599,7 +843,7 @@ def student_login():
         return jsonify({"error": "Invalid Student ID or Password"}), 401
     
 # --- 8. STUDENT PASSWORD RESET ---
-@app.route('/api/student/verify-reset', methods=['POST'])
+@api.route('/api/student/verify-reset', methods=['POST'])
 def student_verify_reset():
     data = request.get_json()
     student_id = data.get('studentId')
@@ -625,13 +869,13 @@ def student_verify_reset():
         "name": student['name']
     }), 200
 
-@app.route('/api/student/reset-password', methods=['POST'])
+@api.route('/api/student/reset-password', methods=['POST'])
 def student_reset_password():
     data = request.get_json()
     student_id = data.get('studentId')
     password = data.get('password')
 
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_password = hash_password(password)
     
     result = student_users_collection.update_one(
         {"studentId": student_id},
@@ -646,21 +890,21 @@ def student_reset_password():
     # --- 8. APPOINTMENT ROUTES ---
 
 # Get a list of all Doctors (for the dropdown menu)
-@app.route('/api/doctors', methods=['GET'])
+@api.route('/api/doctors', methods=['GET'])
 def get_doctors():
     doctors = []
-    # Find all users with role 'doctor'
-    for doc in staff_users_collection.find({"role": "doctor"}):
+    # All users with role 'doctor' (cached directory)
+    for doc in doctor_directory.all():
         doctors.append({
-            "id": str(doc['_id']),
-            "name": doc['name'],
+            "id": doc['id'],
+            "name": doc.get('name'),
             "email": doc.get('email'),
             "specialization": doc.get('specialization', 'General Physician') # Default if missing
         })
     return jsonify(doctors), 200
 
 # Book a new appointment
-@app.route('/api/appointments', methods=['POST'])
+@api.route('/api/appointments', methods=['POST'])
 def book_appointment():
     try:
         data = request.get_json()
@@ -675,31 +919,40 @@ def book_appointment():
             print("[BOOKING FAILED] Missing fields")
             return jsonify({"error": "Missing required fields"}), 400
 
-        # --- DOUBLE BOOKING PREVENTION CHECK ---
-        existing_appt = appointments_collection.find_one({
-            "doctorId": doctor_id,
-            "date": date,
-            "time": time
-        })
-        
-        if existing_appt:
-            print(f"[BOOKING FAILED] Slot occupied: Doc={doctor_id} Date={date} Time={time}")
-            return jsonify({"error": "This slot has already been booked! Please choose another."}), 409
-
         # Insert into DB
+        # --- DOUBLE BOOKING PREVENTION ---
+        # "active" marks a slot as taken; the unique partial index
+        # active_slot_unique (indexes.py) rejects a second active booking of
+        # the same doctor/date/time atomically, so no separate find_one.
+        # Without the index nothing would stop a double booking: refuse.
+        if not slot_index.present():
+            print("[BOOKING FAILED] active_slot_unique index is missing")
+            return jsonify({"error": "Booking is temporarily unavailable, please try again shortly."}), 503, {"Retry-After": "30"}
+        doctor = find_doctor(doctor_id)
+        if doctor is None:
+            print(f"[BOOKING FAILED] Unknown doctor: {doctor_id}")
+            return jsonify({"error": "Doctor not found"}), 400
+        doctor_id = str(doctor['_id']) # canonical form, used in the slot index and rollup keys
         new_appt = {
             "studentId": student_id,
-            "studentName": data.get('studentName', 'Unknown'),
             "doctorId": doctor_id,
-            "doctorName": data.get('doctorName', 'Unknown'),
+            **stored_names(student_id, doctor),
             "date": date,
             "time": time,
             "reason": data.get('reason', ''),
-            "status": "Scheduled"
+            "status": "Scheduled",
+            "active": True
         }
-        
-        result = appointments_collection.insert_one(new_appt)
+
+        try:
+            result = appointments_collection.insert_one(new_appt)
+        except DuplicateKeyError:
+            print(f"[BOOKING FAILED] Slot occupied: Doc={doctor_id} Date={date} Time={time}")
+            return jsonify({"error": "This slot has already been booked! Please choose another."}), 409
         print(f"[BOOKING SUCCESS] ID: {result.inserted_id}")
+        with bookkeeping(f"booking {result.inserted_id}"):
+            change_versions.bump(student_key(student_id), doctor_key(doctor_id))
+            daily_stats.record((today_str(), activity("bookings", doctor_id)))
         
         return jsonify({"message": "Appointment booked successfully!"}), 201
     except Exception as e:
@@ -709,32 +962,28 @@ def book_appointment():
         return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
 
 # Get appointments for a specific student (History)
-@app.route('/api/appointments/student/<student_id>', methods=['GET'])
+@api.route('/api/appointments/student/<student_id>', methods=['GET'])
+@conditional(student_key, 'student_id')
 def get_student_appointments(student_id):
-    my_appointments = []
     # Sort by Date DESC, then Time ASC (or DESC?)
     # "Recent dates at top" -> Date DESC. 
     # For same day, usually later time is "more recent" or earlier? 
     # Let's do Date DESC, Time DESC for consistent "Newest first" view
-    for appt in appointments_collection.find({"studentId": student_id}).sort([("date", -1), ("time", -1)]):
-        appt['_id'] = str(appt['_id'])
-        my_appointments.append(appt)
-    return jsonify(my_appointments), 200
+    return list_response(appointments_collection, {"studentId": student_id},
+                         [("date", -1), ("time", -1), ("_id", -1)])
 
 # Get appointments for a specific DOCTOR
-@app.route('/api/appointments/doctor/<doctor_id>', methods=['GET'])
+@api.route('/api/appointments/doctor/<doctor_id>', methods=['GET'])
+@conditional(doctor_key, 'doctor_id')
 def get_doctor_appointments(doctor_id):
-    doc_appointments = []
     # Sort by Date DESC, Time ASC (Upcoming first for future? but user asked for Recent "top" -> Descending)
     # Let's stick to true Descending (Latest date/time at top)
-    for appt in appointments_collection.find({"doctorId": doctor_id}).sort([("date", -1), ("time", -1)]):
-        appt['_id'] = str(appt['_id'])
-        doc_appointments.append(appt)
-    return jsonify(doc_appointments), 200
+    return list_response(appointments_collection, {"doctorId": doctor_id},
+                         [("date", -1), ("time", -1), ("_id", -1)])
 
 # --- 10. UNAVAILABILITY ROUTES (NEW) ---
 
-@app.route('/api/doctor/unavailable', methods=['POST'])
+@api.route('/api/doctor/unavailable', methods=['POST'])
 def set_unavailable_dates():
     data = request.get_json()
     doctor_id = data.get('doctorId')
@@ -743,30 +992,30 @@ def set_unavailable_dates():
     if not doctor_id or not date_str:
         return jsonify({"error": "Missing doctorId or date"}), 400
 
-    doctor = staff_users_collection.find_one({"_id": ObjectId(doctor_id)})
-    if not doctor:
-        return jsonify({"error": "Doctor not found"}), 404
-        
-    current_unavailable = doctor.get('unavailableDates', [])
-    
-    if date_str in current_unavailable:
+    # Toggle without reading first: the $pull only matches if the date is
+    # currently in the list, otherwise $addToSet adds it.
+    removed = staff_users_collection.update_one(
+        {"_id": ObjectId(doctor_id), "unavailableDates": date_str},
+        {"$pull": {"unavailableDates": date_str}}
+    )
+    if removed.matched_count:
         # Remove it (Toggle OFF)
-        staff_users_collection.update_one(
-            {"_id": ObjectId(doctor_id)},
-            {"$pull": {"unavailableDates": date_str}}
-        )
+        doctor_directory.invalidate()
         return jsonify({"message": "Date removed from unavailable list", "action": "removed"}), 200
-    else:
-        # Add it (Toggle ON)
-        staff_users_collection.update_one(
-            {"_id": ObjectId(doctor_id)},
-            {"$addToSet": {"unavailableDates": date_str}}
-        )
-        return jsonify({"message": "Date marked as unavailable", "action": "added"}), 200
 
-@app.route('/api/doctor/unavailable/<doctor_id>', methods=['GET'])
+    # Add it (Toggle ON)
+    added = staff_users_collection.update_one(
+        {"_id": ObjectId(doctor_id)},
+        {"$addToSet": {"unavailableDates": date_str}}
+    )
+    if not added.matched_count:
+        return jsonify({"error": "Doctor not found"}), 404
+    doctor_directory.invalidate()
+    return jsonify({"message": "Date marked as unavailable", "action": "added"}), 200
+
+@api.route('/api/doctor/unavailable/<doctor_id>', methods=['GET'])
 def get_unavailable_dates(doctor_id):
-    doctor = staff_users_collection.find_one({"_id": ObjectId(doctor_id)})
+    doctor = doctor_directory.get(doctor_id)
     if not doctor:
          return jsonify([]), 404
          
@@ -775,29 +1024,11 @@ def get_unavailable_dates(doctor_id):
 
 # --- 11. SLOT SCHEDULING ROUTES ---
 
-# Helper function to generate time slots
-def generate_slots(date_str, morning_start, morning_end, evening_start, evening_end):
-    slots = []
-    
-    # 1. MORNING SESSION
-    current_time = datetime.strptime(f"{date_str} {morning_start}", "%Y-%m-%d %H:%M")
-    end_time_morning = datetime.strptime(f"{date_str} {morning_end}", "%Y-%m-%d %H:%M")
-    
-    while current_time < end_time_morning:
-        slots.append(current_time.strftime("%H:%M"))
-        current_time += timedelta(minutes=15)
+# Limits for /api/slots/search
+MAX_SEARCH_DAYS = 31
+MAX_SEARCH_RESULTS = 100
 
-    # 2. EVENING SESSION
-    current_time = datetime.strptime(f"{date_str} {evening_start}", "%Y-%m-%d %H:%M")
-    end_time_evening = datetime.strptime(f"{date_str} {evening_end}", "%Y-%m-%d %H:%M")
-    
-    while current_time < end_time_evening:
-        slots.append(current_time.strftime("%H:%M"))
-        current_time += timedelta(minutes=15)
-        
-    return slots
-
-@app.route('/api/slots', methods=['POST'])
+@api.route('/api/slots', methods=['POST'])
 def get_available_slots():
     data = request.get_json()
     doctor_id = data.get('doctorId')
@@ -807,44 +1038,74 @@ def get_available_slots():
         return jsonify([]), 400
 
     # 0. Get Doctor's Details
-    doctor = staff_users_collection.find_one({"_id": ObjectId(doctor_id)})
+    doctor = doctor_directory.get(doctor_id)
     if not doctor:
         return jsonify([]), 404
-        
+
     # CHECK UNAVAILABILITY FIRST
-    unavailable_dates = doctor.get('unavailableDates', [])
-    if date_str in unavailable_dates:
+    if date_str in doctor.get('unavailableDates', []):
         return jsonify([]), 200
 
-    # Get dual session times (with defaults)
-    morning_start = doctor.get('morningStart', '09:00')
-    morning_end = doctor.get('morningEnd', '13:00')
-    evening_start = doctor.get('eveningStart', '17:00')
-    evening_end = doctor.get('eveningEnd', '21:00')
-
-    # 1. Generate all possible slots for that day (Morning + Evening)
-    all_slots = generate_slots(date_str, morning_start, morning_end, evening_start, evening_end)
-
-    # 2. Find booked appointments for this Doctor on this Date
+    # 1. Find booked appointments for this Doctor on this Date
     booked_cursor = appointments_collection.find({
         "doctorId": doctor_id,
         "date": date_str,
         "status": { "$ne": "Cancelled" } 
-    })
-    
-    booked_times = [appt['time'] for appt in booked_cursor]
+    }, {"time": 1})
+    booked_times = [appt.get('time') for appt in booked_cursor]
+
+    # 2. Available = session bitmap AND NOT booked bitmap (see slots.py)
+    mask, starts = free_mask(doctor, date_str, booked_times)
+    return jsonify(slot_times(mask, starts)), 200
+
+# Search free slots across doctors and dates in one request
+# Body: { doctorIds?: [...], specialization?, startDate?: "YYYY-MM-DD", days?: 7, limit?: 10 }
+@api.route('/api/slots/search', methods=['POST'])
+def search_available_slots():
+    data = request.get_json(silent=True) or {}
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
+
+    try:
+        start = datetime.strptime(data.get('startDate') or today, "%Y-%m-%d")
+        days = min(max(int(data.get('days', 7)), 1), MAX_SEARCH_DAYS)
+        limit = min(max(int(data.get('limit', 10)), 1), MAX_SEARCH_RESULTS)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid startDate, days or limit"}), 400
+
+    # Never offer dates in the past
+    start = max(start, datetime.strptime(today, "%Y-%m-%d"))
+    dates = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+    doctors = doctor_directory.all()
+    if data.get('doctorIds'):
+        wanted = {str(d) for d in data['doctorIds']}
+        doctors = [d for d in doctors if d['id'] in wanted]
+    if data.get('specialization'):
+        doctors = [d for d in doctors if d.get('specialization') == data['specialization']]
+    doctors.sort(key=lambda d: d.get('name') or '')
+    if not doctors:
+        return jsonify([]), 200
 
-    # 3. Filter: Available = All - Booked
-    available_slots = [time for time in all_slots if time not in booked_times]
+    # One query for every booking of these doctors in the whole range
+    booked = {}
+    for appt in appointments_collection.find({
+        "doctorId": {"$in": [d['id'] for d in doctors]},
+        "date": {"$gte": dates[0], "$lte": dates[-1]},
+        "status": {"$ne": "Cancelled"}
+    }, {"doctorId": 1, "date": 1, "time": 1}):
+        booked.setdefault((appt['doctorId'], appt['date']), []).append(appt.get('time'))
 
-    return jsonify(available_slots), 200
+    results = first_free_slots(doctors, dates, booked, limit,
+                               now_date=today, now_minutes=now.hour * 60 + now.minute)
+    return jsonify(results), 200
 
 # --- 10. PRESCRIPTION ROUTES ---
 
 prescriptions_collection = db.prescriptions
 
 # Create a new prescription
-@app.route('/api/prescriptions', methods=['POST'])
+@api.route('/api/prescriptions', methods=['POST'])
 def create_prescription():
     data = request.get_json()
     
@@ -856,9 +1117,8 @@ def create_prescription():
 
     prescription = {
         "studentId": data['studentId'],
-        "studentName": data.get('studentName', 'Unknown'), # Optional but helpful
         "doctorId": data['doctorId'],
-        "doctorName": data.get('doctorName', 'Unknown'),
+        **stored_names(data['studentId'], find_doctor(data['doctorId'])),
         "date": data['date'],
         "diagnosis": data.get('diagnosis', ''),
         "medications": data['medications'], # List of objects: { name, dosage, frequency, duration }
@@ -868,6 +1128,14 @@ def create_prescription():
     }
 
     result = prescriptions_collection.insert_one(prescription)
+    with bookkeeping(f"prescription {result.inserted_id}"):
+        change_versions.bump(student_key(prescription['studentId']))
+        daily_stats.record((today_str(), {
+            "prescriptionsIssued": 1,
+            "prescriptionsPending": 1 if prescription['status'] == "Pending" else 0
+        }))
+        if prescription['status'] == "Pending":
+            publish(PHARMACY_QUEUE, 'added', prescription)
     
     return jsonify({
         "message": "Prescription created successfully", 
@@ -875,64 +1143,65 @@ def create_prescription():
     }), 201
 
 # Get prescriptions for a student
-@app.route('/api/prescriptions/student/<student_id>', methods=['GET'])
+@api.route('/api/prescriptions/student/<student_id>', methods=['GET'])
+@conditional(student_key, 'student_id')
 def get_student_prescriptions(student_id):
-    prescriptions = []
     # Sort by date descending (newest first)
-    cursor = prescriptions_collection.find({"studentId": student_id}).sort("date", -1)
-    
-    for p in cursor:
-        p['_id'] = str(p['_id'])
-        prescriptions.append(p)
-        
-    return jsonify(prescriptions), 200
+    return list_response(prescriptions_collection, {"studentId": student_id}, [("date", -1), ("_id", -1)])
 
 # Get Pending Prescriptions for Pharmacy
-@app.route('/api/pharmacy/queue', methods=['GET'])
+@api.route('/api/pharmacy/queue', methods=['GET'])
 def get_pharmacy_queue():
-    pending = []
-    cursor = prescriptions_collection.find({"status": "Pending"}).sort("date", -1)
-    for p in cursor:
-        p['_id'] = str(p['_id'])
-        pending.append(p)
-    return jsonify(pending), 200
+    return list_response(prescriptions_collection, {"status": "Pending"}, [("date", -1), ("_id", -1)])
 
 # Get Pharmacy Stats (Pending Count, Dispensed Today Count)
-@app.route('/api/pharmacy/stats', methods=['GET'])
+@api.route('/api/pharmacy/stats', methods=['GET'])
 def get_pharmacy_stats():
-    pending_count = prescriptions_collection.count_documents({"status": "Pending"})
-    
-    today_start = datetime.now().strftime("%Y-%m-%d")
-    # Assuming we track dispensed date. If not, we rely on 'date' or updated_at. 
-    # For now, let's assume 'dispensedAt' is set when dispensing.
-    # If not set, we might need to rely on 'date' if dispensed same day.
-    # Safest is to check 'dispensedDate' field which we will set.
-    
-    dispensed_today_count = prescriptions_collection.count_documents({
-        "status": "Dispensed",
-        "dispensedDate": today_start
-    })
-    
-    return jsonify({
+    return jsonify(pharmacy_stats()), 200
+
+def pharmacy_stats():
+    # Sums of the daily_stats rollup, not counts over prescriptions (see rollup.py)
+    pending_count = daily_stats.totals(["prescriptionsPending"])["prescriptionsPending"]
+    dispensed_today_count = daily_stats.day(today_str()).get("prescriptionsDispensed", 0)
+
+    return {
         "pending": pending_count,
         "dispensedToday": dispensed_today_count
-    }), 200
+    }
+
+# Live pharmacy queue: replaces polling /api/pharmacy/queue + /api/pharmacy/stats
+@api.route('/api/pharmacy/queue/events', methods=['GET'])
+def pharmacy_queue_events():
+    def snapshot():
+        items = list(prescriptions_collection.find({"status": "Pending"}).sort([("date", -1), ("_id", -1)]))
+        return {"items": items, "stats": pharmacy_stats()}
+    return event_stream(PHARMACY_QUEUE, snapshot)
 
 # Dispense Prescription
-@app.route('/api/pharmacy/dispense/<prescription_id>', methods=['POST'])
+@api.route('/api/pharmacy/dispense/<prescription_id>', methods=['POST'])
 def dispense_prescription(prescription_id):
     try:
-        updated = prescriptions_collection.update_one(
+        dispensed_date = datetime.now().strftime("%Y-%m-%d")
+        updated = prescriptions_collection.find_one_and_update(
             {"_id": ObjectId(prescription_id)},
             {
                 "$set": {
                     "status": "Dispensed",
-                    "dispensedDate": datetime.now().strftime("%Y-%m-%d"),
+                    "dispensedDate": dispensed_date,
                     "dispensedAt": datetime.now()
                 }
-            }
+            },
+            projection={"studentId": 1, "status": 1}
         )
-        if updated.modified_count == 1:
+        if updated:
+            with bookkeeping(f"dispense {prescription_id}"):
+                change_versions.bump(student_key(updated.get('studentId')))
+                if updated.get('status') != "Dispensed":
+                    daily_stats.record((dispensed_date, {
+                        "prescriptionsDispensed": 1,
+                        "prescriptionsPending": -1 if updated.get('status') == "Pending" else 0
+                    }))
+                publish(PHARMACY_QUEUE, 'removed', {"_id": updated['_id'], "dispensedDate": dispensed_date})
             return jsonify({"message": "Prescription Dispensed Successfully"}), 200
         else:
             return jsonify({"error": "Prescription not found or already dispensed"}), 404
@@ -942,7 +1211,7 @@ def dispense_prescription(prescription_id):
 # --- 11. LAB REPORTS ROUTES ---
 
 # Upload a Lab Report (Lab Tech Only)
-@app.route('/api/lab/upload', methods=['POST'])
+@api.route('/api/lab/upload', methods=['POST'])
 def upload_lab_report():
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -956,16 +1225,12 @@ def upload_lab_report():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if file:
-        filename = secure_filename(file.filename)
-        # Add timestamp to filename to prevent duplicates
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_filename = f"{timestamp}_{filename}"
-        
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+    # Stream to disk while hashing; identical files are stored once (see storage.py)
+    stored = store_upload(file, current_app.config['UPLOAD_FOLDER'], lab_files_collection)
+    # Thumbnail / first-page preview is rendered in the background (see previews.py)
+    schedule_preview(upload_path(current_app.config['UPLOAD_FOLDER'], stored['filename']))
 
-        # Save metadata to DB
-        
+    # Save metadata to DB
     # Optional: Link to a Request ID if provided
     request_id = request.form.get('requestId')
     
@@ -973,9 +1238,13 @@ def upload_lab_report():
         "studentId": student_id,
         "labTechId": request.form.get('labTechId'),
         "testName": request.form.get('testName'),
-        "filename": unique_filename, # Corrected to unique_filename
+        "filename": stored['filename'], # "<sha256>.<ext>", served by /uploads/<filename>
+        "originalFilename": secure_filename(file.filename),
+        "contentHash": stored['contentHash'],
+        "size": stored['size'],
         "remarks": request.form.get('remarks', ''),
         "date": datetime.now().strftime("%Y-%m-%d"),
+        "createdAt": datetime.now(), # get_student_reports / timeline sort key
         "requestId": request_id # Link to request
     }
     
@@ -983,31 +1252,48 @@ def upload_lab_report():
     
     # If linked to a request, mark request as Completed and link report ID
     if request_id:
-        lab_requests_collection.update_one(
-            {"_id": ObjectId(request_id)},
-            {
-                "$set": {
-                    "status": "Completed", 
-                    "reportId": str(result.inserted_id),
-                    "completedAt": datetime.now()
-                }
-            }
+        completed = {
+            "status": "Completed",
+            "reportId": str(result.inserted_id),
+            "completedAt": datetime.now()
+        }
+        previous = lab_requests_collection.find_one_and_update(
+            {"_id": ObjectId(request_id)}, {"$set": completed}, projection={"status": 1}
         )
+        if previous:
+            with bookkeeping(f"lab request {request_id} completed"):
+                if previous.get('status') != "Completed":
+                    daily_stats.record((today_str(), {"labRequestsCompleted": 1}))
+                publish(LAB_REQUESTS, 'updated', dict(completed, _id=ObjectId(request_id)))
+    with bookkeeping(f"lab report {result.inserted_id}"):
+        change_versions.bump(student_key(student_id))
     
     return jsonify({"message": "Report uploaded successfully!"}), 201
 
 # Get Reports for a Student
-@app.route('/api/lab/reports/<student_id>', methods=['GET'])
+@api.route('/api/lab/reports/<student_id>', methods=['GET'])
+@conditional(student_key, 'student_id')
 def get_student_reports(student_id):
-    reports = []
-    for r in lab_reports_collection.find({"studentId": student_id}).sort("createdAt", -1):
-        r['_id'] = str(r['_id'])
-        reports.append(r)
-    return jsonify(reports), 200
+    return list_response(lab_reports_collection, {"studentId": student_id}, [("createdAt", -1), ("_id", -1)])
+
+# --- 11a. STUDENT TIMELINE ---
+
+# Appointments, prescriptions, lab requests and reports in one newest-first,
+# paginated list from a single aggregation (see timeline.py)
+@api.route('/api/students/<student_id>/timeline', methods=['GET'])
+@conditional(student_key, 'student_id')
+def get_student_timeline(student_id):
+    try:
+        options = timeline_options(request.args)
+        limit, cursor = page_params(request.args) or (DEFAULT_PAGE_SIZE, None)
+        items, next_cursor = fetch_timeline(db, student_id, limit, cursor, **options)
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": items, "nextCursor": next_cursor}), 200
 
 # --- 11b. LAB REQUEST ROUTES (DOCTOR -> LAB) ---
 
-@app.route('/api/lab/request', methods=['POST'])
+@api.route('/api/lab/request', methods=['POST'])
 def create_lab_request():
     data = request.get_json()
     
@@ -1017,9 +1303,8 @@ def create_lab_request():
         
     lab_request = {
         "studentId": data['studentId'],
-        "studentName": data.get('studentName', 'Unknown'),
         "doctorId": data['doctorId'],
-        "doctorName": data.get('doctorName', 'Unknown'),
+        **stored_names(data['studentId'], find_doctor(data['doctorId'])),
         "testType": data['testType'], # e.g. "Blood Test", "X-Ray"
         "notes": data.get('notes', ''),
         "date": datetime.now().strftime("%Y-%m-%d"),
@@ -1027,74 +1312,93 @@ def create_lab_request():
         "createdAt": datetime.now()
     }
     
-    lab_requests_collection.insert_one(lab_request)
+    result = lab_requests_collection.insert_one(lab_request)
+    with bookkeeping(f"lab request {result.inserted_id}"):
+        change_versions.bump(student_key(lab_request['studentId']))
+        daily_stats.record((today_str(), {"labRequests": 1}))
+        publish(LAB_REQUESTS, 'added', lab_request)
     return jsonify({"message": "Lab request sent successfully!"}), 201
 
-@app.route('/api/lab/requests', methods=['GET'])
+@api.route('/api/lab/requests', methods=['GET'])
 def get_all_lab_requests():
     # For Lab Tech View (Pending first)
-    requests = []
     # Sort Pending first, then by date desc
-    for req in lab_requests_collection.find().sort([("status", 1), ("createdAt", -1)]):
-        req['_id'] = str(req['_id'])
-        requests.append(req)
-    return jsonify(requests), 200
+    return list_response(lab_requests_collection, {}, [("status", 1), ("createdAt", -1), ("_id", -1)])
 
 # Get Lab Stats (Pending vs Completed)
-@app.route('/api/lab/stats', methods=['GET'])
+@api.route('/api/lab/stats', methods=['GET'])
 def get_lab_stats():
-    pending = lab_requests_collection.count_documents({"status": "Pending"})
-    completed = lab_requests_collection.count_documents({"status": "Completed"})
-    return jsonify({"pending": pending, "completed": completed}), 200
-
-@app.route('/api/lab/requests/student/<student_id>', methods=['GET'])
+    return jsonify(lab_stats()), 200
+
+def lab_stats():
+    # Sums of the daily_stats rollup, not counts over lab_requests (see rollup.py)
+    totals = daily_stats.totals(["labRequests", "labRequestsCompleted"])
+    return {"pending": totals["labRequests"] - totals["labRequestsCompleted"], "completed": totals["labRequestsCompleted"]}
+
+# Live lab queue: replaces polling /api/lab/requests + /api/lab/stats
+@api.route('/api/lab/requests/events', methods=['GET'])
+def lab_request_events():
+    def snapshot():
+        # Only the open queue; completed requests arrive as "updated" events
+        items = list(lab_requests_collection.find({"status": "Pending"}).sort([("createdAt", -1), ("_id", -1)]))
+        return {"items": items, "stats": lab_stats()}
+    return event_stream(LAB_REQUESTS, snapshot)
+
+@api.route('/api/lab/requests/student/<student_id>', methods=['GET'])
+@conditional(student_key, 'student_id')
 def get_student_lab_requests(student_id):
-    requests = []
     # Sort by date desc
-    for req in lab_requests_collection.find({"studentId": student_id}).sort("createdAt", -1):
-        req['_id'] = str(req['_id'])
-        requests.append(req)
-    return jsonify(requests), 200
+    return list_response(lab_requests_collection, {"studentId": student_id}, [("createdAt", -1), ("_id", -1)])
 
 # Get Doctor Stats (Queue, Completed Today, Total Unique Patients)
-@app.route('/api/doctor/stats/<doctor_id>', methods=['GET'])
+@api.route('/api/doctor/stats/<doctor_id>', methods=['GET'])
 def get_doctor_stats(doctor_id):
     today = datetime.now().strftime("%Y-%m-%d")
-    
-    # 1. Patients in Queue (Today's Pending/Scheduled)
-    queue_count = appointments_collection.count_documents({
-        "doctorId": doctor_id,
-        "date": today,
-        "status": {"$in": ["Scheduled", "Pending"]} 
-    })
-    
-    # 2. Completed Today
-    completed_today = appointments_collection.count_documents({
-        "doctorId": doctor_id,
-        "date": today,
-        "status": "Completed"
-    })
-    
-    # 3. Total Patients (Unique Student IDs across all time)
-    pipeline = [
-        {"$match": {"doctorId": doctor_id}},
-        {"$group": {"_id": "$studentId"}},
-        {"$count": "total"}
-    ]
-    cursor = list(appointments_collection.aggregate(pipeline))
-    total_patients = cursor[0]['total'] if cursor else 0
-    
-    return jsonify({
-        "queue": queue_count,
-        "completedToday": completed_today,
-        "totalPatients": total_patients
-    }), 200
+    # Queue, completed today and unique patients from two index-bounded
+    # aggregations, reused until the doctor's appointments change (checked
+    # every few seconds, see doctor_stats.py). Any route that changes a
+    # doctor's appointments must bump doctor_key.
+    stats = doctor_stats_cache.get(
+        doctor_id, today,
+        lambda: change_versions.get(doctor_key(doctor_id)),
+        lambda: compute_doctor_stats(appointments_collection, doctor_id, today))
+    return jsonify(stats), 200
 
 # Serve Uploaded Files
-@app.route('/uploads/<filename>')
+@api.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Hashed names live in ab/cd/ shards, older "<timestamp>_<name>" files at the top level.
+    # Range requests, ETag and immutable caching (or proxy offload) in storage.send_upload
+    return send_upload(current_app.config['UPLOAD_FOLDER'], filename)
+
+# Small preview of an upload (image thumbnail / first PDF page) for report lists
+@api.route('/uploads/<filename>/preview')
+def uploaded_file_preview(filename):
+    source = upload_path(current_app.config['UPLOAD_FOLDER'], filename)
+    if source is None or not os.path.isfile(source):
+        return jsonify({"error": "File not found"}), 404
+
+    preview = preview_path(source)
+    if not os.path.exists(preview):
+        # Background job hasn't run yet (or the file predates previews):
+        # queue it rather than rasterize on a request thread
+        if not schedule_preview(source):
+            return jsonify({"error": "No preview available for this file"}), 404
+        return jsonify({"status": "pending"}), 202, {"Retry-After": str(PREVIEW_RETRY_AFTER)}
+
+    response = send_file(preview, mimetype='image/jpeg', conditional=True)
+    response.headers['Cache-Control'] = UPLOADS_CACHE_CONTROL
+    return response
 
 # --- RUN THE APP ---
+# `gunicorn -c gunicorn.conf.py` (serves this app) / `python app.py`
+app = create_app()
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0')
+    import sys
+    prepare_database(app)
+    if sys.argv[1:] == ["prepare"]:
+        print("Database prepared.")
+    else:
+        start_background_jobs()
+        app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,398 @@
+"""
+Load test for the Flask API against a real MongoDB.
+
+Starts a throwaway mongod (if one is on PATH, or --mongod) on a temp data
+directory, or uses --mongo-uri / BENCH_MONGO_URI, seeds a fresh database,
+starts the API under gunicorn (gunicorn.conf.py, --server-workers x
+--server-threads) in its own process, so the load generator's threads
+don't share a GIL with the server, and drives concurrent request mixes
+modelled on real traffic:
+
+    registration  slot lookups, bookings, student logins, student history
+    pharmacy      queue / stats polling, new prescriptions, dispensing
+    reporting     admin appointment listing and dashboards, staff logins
+
+Reports throughput and p50/p95/p99 per endpoint and writes the results to
+benchmarks/results/<time>-<commit>.json; compare two runs with
+
+    python benchmarks/compare.py OLD.json NEW.json
+
+Examples:
+    python benchmarks/api_load.py                          # all scenarios
+    python benchmarks/api_load.py --scenario pharmacy --clients 32 --seconds 30
+    python benchmarks/api_load.py --scale medium --appointments 500000
+
+The database named by --db-name is dropped and reseeded with datagen.py
+(--scale small by default) unless --no-seed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+import contextlib
+import signal
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND)
+
+import datagen
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PASSWORD = "bench-password"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+# --- MongoDB ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_mongod(binary):
+    """
+    Run mongod on a temp dbpath and a free port as a single-node replica
+    set (the live queues' change streams need one); yields its URI.
+    """
+    dbpath = tempfile.mkdtemp(prefix='bench-mongod-')
+    port = _free_port()
+    proc = subprocess.Popen(
+        [binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--replSet', 'bench', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    uri = f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    try:
+        from pymongo import MongoClient
+        deadline = time.monotonic() + 30
+        initiated = False
+        while True:
+            try:
+                admin = MongoClient(uri, serverSelectionTimeoutMS=500).admin
+                if not initiated:
+                    admin.command('replSetInitiate', {"_id": "bench", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+                    initiated = True
+                if admin.command('hello').get('isWritablePrimary'):
+                    break
+            except Exception:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"mongod did not start ({binary})")
+            time.sleep(0.2)
+        yield uri
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+# --- API server ---
+
+@contextlib.contextmanager
+def api_server(args, uri):
+    """Run the app under gunicorn on a free port; yields its base URL."""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        MONGO_URI=uri,
+        MONGO_DB_NAME=args.db_name,
+        BCRYPT_LOG_ROUNDS=str(args.bcrypt_rounds),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.server_workers),
+        GUNICORN_THREADS=str(args.server_threads),
+    )
+    env.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='bench-uploads-'))
+    # The routes print() a lot; keep it out of the report but available
+    server_log = tempfile.NamedTemporaryFile(prefix='bench-server-', suffix='.log', delete=False)
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                            cwd=BACKEND, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120 # on_starting may build indexes / the rollup
+        while True:
+            try:
+                urllib.request.urlopen(base + '/readyz', timeout=2).read()
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"gunicorn did not start; see {server_log.name}")
+                time.sleep(0.2)
+        log(f"API: gunicorn on {base} ({args.server_workers} workers x {args.server_threads} threads), log {server_log.name}")
+        yield base
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        server_log.close()
+
+
+# --- Scenarios ---
+# Each operation returns (endpoint label, method, path, JSON body or None).
+
+def _day(rng, ahead=14):
+    return (datetime.now().date() + timedelta(days=rng.randint(0, ahead))).isoformat()
+
+
+def op_slots(ctx, rng):
+    return "POST /api/slots", "POST", "/api/slots", {"doctorId": rng.choice(ctx["doctorIds"]), "date": _day(rng)}
+
+
+def op_book(ctx, rng):
+    h, m = rng.choice([9, 10, 11, 12, 17, 18, 19]), rng.choice([0, 15, 30, 45])
+    return "POST /api/appointments", "POST", "/api/appointments", {
+        "doctorId": rng.choice(ctx["doctorIds"]), "studentId": rng.choice(ctx["studentIds"]),
+        "date": _day(rng), "time": f"{h:02d}:{m:02d}", "reason": "Load test"
+    }
+
+
+def op_student_login(ctx, rng):
+    return "POST /api/student/login", "POST", "/api/student/login", {"studentId": rng.choice(ctx["studentIds"]), "password": PASSWORD}
+
+
+def op_student_history(ctx, rng):
+    student_id = rng.choice(ctx["studentIds"])
+    return "GET /api/appointments/student/<id>", "GET", f"/api/appointments/student/{student_id}", None
+
+
+def op_pharmacy_queue(ctx, rng):
+    return "GET /api/pharmacy/queue", "GET", "/api/pharmacy/queue?limit=50", None
+
+
+def op_pharmacy_stats(ctx, rng):
+    return "GET /api/pharmacy/stats", "GET", "/api/pharmacy/stats", None
+
+
+def op_prescribe(ctx, rng):
+    return "POST /api/prescriptions", "POST", "/api/prescriptions", {
+        "studentId": rng.choice(ctx["studentIds"]), "doctorId": rng.choice(ctx["doctorIds"]),
+        "date": _day(rng, 0), "referToPharmacist": True,
+        "medications": [{"name": "Cetirizine", "dosage": "10mg", "frequency": "0-0-1", "duration": "5 days"}],
+    }
+
+
+def op_dispense(ctx, rng):
+    with ctx["lock"]:
+        prescription_id = ctx["pending"].pop() if ctx["pending"] else None
+    if prescription_id is None:
+        return op_pharmacy_queue(ctx, rng)
+    return "POST /api/pharmacy/dispense/<id>", "POST", f"/api/pharmacy/dispense/{prescription_id}", None
+
+
+def op_admin_appointments(ctx, rng):
+    return "GET /api/admin/appointments", "GET", "/api/admin/appointments?limit=100", None
+
+
+def op_admin_stats(ctx, rng):
+    return "GET /api/admin/stats", "GET", "/api/admin/stats", None
+
+
+def op_lab_stats(ctx, rng):
+    return "GET /api/lab/stats", "GET", "/api/lab/stats", None
+
+
+def op_doctor_stats(ctx, rng):
+    return "GET /api/doctor/stats/<id>", "GET", f"/api/doctor/stats/{rng.choice(ctx['doctorIds'])}", None
+
+
+def op_staff_login(ctx, rng):
+    return "POST /api/staff/login", "POST", "/api/staff/login", {"email": ctx["staffEmails"]["admin"], "password": PASSWORD}
+
+
+SCENARIOS = {
+    "registration": [(op_slots, 50), (op_book, 20), (op_student_login, 15), (op_student_history, 15)],
+    "pharmacy": [(op_pharmacy_queue, 40), (op_pharmacy_stats, 25), (op_prescribe, 20), (op_dispense, 15)],
+    "reporting": [(op_admin_appointments, 35), (op_admin_stats, 20), (op_lab_stats, 15), (op_doctor_stats, 20), (op_staff_login, 10)],
+}
+
+
+# --- Driver ---
+
+def client_loop(base, ops, weights, ctx, seed_value, stop, samples):
+    rng = random.Random(seed_value)
+    while not stop.is_set():
+        label, method, path, body = rng.choices(ops, weights)[0](ctx, rng)
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(base + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        samples.append((label, status, time.perf_counter() - started))
+
+
+def summarize(samples, seconds):
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    by_endpoint = {}
+    for label, status, latency in samples:
+        entry = by_endpoint.setdefault(label, {"latencies": [], "statuses": {}})
+        entry["latencies"].append(latency)
+        entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+
+    endpoints = {}
+    for label, entry in sorted(by_endpoint.items()):
+        lat = entry["latencies"]
+        endpoints[label] = {
+            "requests": len(lat),
+            "throughput": round(len(lat) / seconds, 1),
+            "errors": sum(n for s, n in entry["statuses"].items() if s.startswith('5')),
+            "statuses": entry["statuses"],
+            "p50_ms": ms(percentile(lat, 50)),
+            "p95_ms": ms(percentile(lat, 95)),
+            "p99_ms": ms(percentile(lat, 99)),
+        }
+    all_lat = [s[2] for s in samples]
+    return {
+        "requests": len(samples),
+        "throughput": round(len(samples) / seconds, 1),
+        "p50_ms": ms(percentile(all_lat, 50)),
+        "p95_ms": ms(percentile(all_lat, 95)),
+        "p99_ms": ms(percentile(all_lat, 99)),
+        "endpoints": endpoints,
+    }
+
+
+def run_scenario(name, base, ctx, args):
+    ops, weights = zip(*SCENARIOS[name])
+    samples = []
+    stop = threading.Event()
+    threads = [threading.Thread(target=client_loop, args=(base, ops, weights, ctx, args.seed * 1000 + i, stop, samples))
+               for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return summarize(samples, args.seconds)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_table(results):
+    for name, result in results.items():
+        print(f"\n== {name}: {result['throughput']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+        print(f"  {'endpoint':<40} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'5xx':>5}")
+        for label, e in result["endpoints"].items():
+            print(f"  {label:<40} {e['throughput']:>8} {e['p50_ms']:>8} {e['p95_ms']:>8} {e['p99_ms']:>8} {e['errors']:>5}")
+
+
+def run(args, uri):
+    from pymongo import MongoClient
+
+    db = MongoClient(uri)[args.db_name]
+    rng = random.Random(args.seed)
+    if args.no_seed:
+        ctx = {
+            "doctorIds": [str(d['_id']) for d in db.staff_users.find({"role": "doctor"}, {"_id": 1})],
+            "studentIds": db.student_users.distinct("studentId"),
+            "staffEmails": {"admin": db.staff_users.find_one({"role": "admin"}, {"email": 1})["email"]},
+        }
+    else:
+        log(f"Seeding {args.db_name}: {args.students} students, {args.doctors} doctors, "
+            f"{args.appointments} appointments, {args.prescriptions} prescriptions, {args.lab_requests} lab requests")
+        ctx = datagen.generate(db, args, uri, log=log)
+        log(f"Seeded in {ctx['loadSeconds']}s ({ctx['docsPerSecond']} docs/s)")
+    ctx["lock"] = threading.Lock()
+    ctx["pending"] = [str(p['_id']) for p in db.prescriptions.find({"status": "Pending"}, {"_id": 1})]
+    rng.shuffle(ctx["pending"])
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    results = {}
+    with api_server(args, uri) as base:
+        for name in scenarios:
+            log(f"Running {name}: {args.clients} clients for {args.seconds}s")
+            results[name] = run_scenario(name, base, ctx, args)
+
+    build = db.client.server_info()
+    report = {
+        "commit": git_commit(),
+        "startedAt": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "mongodb": build.get('version'),
+        "settings": {k: v for k, v in vars(args).items() if k not in ('mongo_uri', 'out')},
+        "scenarios": results,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['all'] + list(SCENARIOS), default='all')
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--server-workers', type=int, default=2, help="gunicorn workers serving the API")
+    parser.add_argument('--server-threads', type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI'))
+    parser.add_argument('--mongod', default=shutil.which('mongod'), help="mongod binary to start when no --mongo-uri is given")
+    parser.add_argument('--db-name', default='smarthealthconnect_bench')
+    parser.add_argument('--no-seed', action='store_true', help="reuse the data already in --db-name")
+    # Dataset size: a datagen.py --scale preset, optionally overridden per collection
+    parser.add_argument('--scale', choices=list(datagen.SCALES), default='small')
+    parser.add_argument('--students', type=int)
+    parser.add_argument('--doctors', type=int)
+    parser.add_argument('--appointments', type=int)
+    parser.add_argument('--prescriptions', type=int)
+    parser.add_argument('--lab-requests', type=int)
+    parser.add_argument('--history-days', type=int, default=365)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="parallel loader processes")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="cost of seeded passwords (logins measure the app, not bcrypt)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed for data and request mix")
+    parser.add_argument('--out', default=RESULTS_DIR)
+    args = datagen.apply_scale(parser.parse_args())
+    # Fixed for benchmarks: every student can log in, with a known password
+    args.activated, args.future_days, args.password, args.drop = 1.0, 30, PASSWORD, True
+
+    if args.mongo_uri:
+        report = run(args, args.mongo_uri)
+    elif args.mongod:
+        with local_mongod(args.mongod) as uri:
+            report = run(args, uri)
+    else:
+        parser.error("no mongod on PATH; pass --mongod or --mongo-uri (or set BENCH_MONGO_URI)")
+
+    print_table(report["scenarios"])
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare two api_load.py result files endpoint by endpoint.
+
+    python benchmarks/compare.py results/OLD.json results/NEW.json
+
+Prints throughput and p50/p95/p99 for both runs with the relative change
+(negative latency / positive throughput change = faster).
+"""
+import sys
+import json
+
+
+def change(old, new):
+    if not old or new is None:
+        return ""
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        exit(1)
+    with open(sys.argv[1]) as f:
+        old = json.load(f)
+    with open(sys.argv[2]) as f:
+        new = json.load(f)
+
+    print(f"old: {old.get('commit')} ({old.get('startedAt')})   new: {new.get('commit')} ({new.get('startedAt')})")
+    for name, new_result in new["scenarios"].items():
+        old_result = old["scenarios"].get(name)
+        if not old_result:
+            print(f"\n== {name}: not in old run")
+            continue
+        print(f"\n== {name}")
+        print(f"  {'endpoint':<40} {'metric':<10} {'old':>10} {'new':>10} {'change':>8}")
+        rows = [("(all)", old_result, new_result)]
+        rows += [(label, old_result["endpoints"].get(label, {}), e) for label, e in new_result["endpoints"].items()]
+        for label, o, n in rows:
+            for metric in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+                print(f"  {label:<40} {metric:<10} {str(o.get(metric)):>10} {str(n.get(metric)):>10} {change(o.get(metric), n.get(metric)):>8}")
+                label = ""
+
+
+if __name__ == "__main__":
+    main()
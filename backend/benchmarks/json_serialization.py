@@ -0,0 +1,103 @@
+"""
+Serialization benchmark: the old list-route path vs MongoJSONProvider.
+
+Builds N prescription-shaped documents (ObjectId _id, datetime fields,
+nested medication lists) and times
+  * old:  copy loop doc['_id'] = str(doc['_id']) + Flask's default jsonify
+  * new:  jsonify through MongoJSONProvider (orjson when installed)
+
+    python benchmarks/json_serialization.py [--docs 10000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def make_docs(n):
+    from bson import ObjectId
+    rng = random.Random(42)
+    base = datetime(2025, 1, 1)
+    docs = []
+    for i in range(n):
+        created = base + timedelta(minutes=rng.randint(0, 500000))
+        docs.append({
+            "_id": ObjectId(),
+            "studentId": f"S{rng.randint(1, 100000):06d}",
+            "studentName": f"Student {i}",
+            "doctorId": str(ObjectId()),
+            "doctorName": "Dr. Venkat Rao",
+            "date": created.strftime("%Y-%m-%d"),
+            "diagnosis": "Viral fever",
+            "medications": [
+                {"name": "Paracetamol", "dosage": "500mg", "frequency": "1-0-1", "duration": "5 days"},
+                {"name": "Cetirizine", "dosage": "10mg", "frequency": "0-0-1", "duration": "3 days"},
+            ],
+            "notes": "",
+            "status": rng.choice(["Pending", "Dispensed", "Private"]),
+            "createdAt": created,
+            "dispensedAt": created + timedelta(hours=2),
+        })
+    return docs
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from flask import Flask, jsonify
+    from json_provider import MongoJSONProvider, orjson
+
+    old_app = Flask("old")
+    new_app = Flask("new")
+    new_app.json = MongoJSONProvider(new_app)
+    source = make_docs(args.docs)
+
+    def old_path():
+        docs = [dict(d) for d in source] # fresh docs, as a cursor would yield
+        with old_app.app_context():
+            out = []
+            for d in docs:
+                d['_id'] = str(d['_id'])
+                out.append(d)
+            return jsonify(out).get_data()
+
+    def new_path():
+        docs = [dict(d) for d in source]
+        with new_app.app_context():
+            return jsonify(docs).get_data()
+
+    copy_only = timed(lambda: [dict(d) for d in source], args.repeat)
+    old_s = timed(old_path, args.repeat) - copy_only
+    new_s = timed(new_path, args.repeat) - copy_only
+    result = {
+        "docs": args.docs,
+        "encoder": "orjson" if orjson is not None else "json",
+        "old_ms": round(old_s * 1000, 2),
+        "new_ms": round(new_s * 1000, 2),
+        "old_docs_per_s": round(args.docs / old_s),
+        "new_docs_per_s": round(args.docs / new_s),
+        "speedup": round(old_s / new_s, 2),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Login-storm benchmark for the password hashing pool (hashing.py).
+
+Serves a minimal Flask app with a bcrypt-checking /login route and a cheap
+/ping route on a threaded local server, hammers /login from many clients
+and measures, at the same time, /ping latency from a few others. Run once
+with the pool and once inline to compare:
+
+    python benchmarks/login_storm.py                 # HASH_WORKERS from env
+    HASH_WORKERS=0 python benchmarks/login_storm.py  # inline hashing
+
+Options: --seconds, --login-clients, --ping-clients, --rounds
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_app(rounds):
+    from flask import Flask, jsonify, request
+    import hashing
+
+    app = Flask(__name__)
+    stored = hashing._hash("correct horse", rounds)
+
+    @app.errorhandler(hashing.HashingBusy)
+    def busy(e):
+        return jsonify({"error": "busy"}), 503
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        ok = hashing.check_password(stored, request.get_json().get('password'))
+        return jsonify({"ok": ok}), 200 if ok else 401
+
+    @app.route('/ping')
+    def ping():
+        return jsonify({"ok": True}), 200
+
+    return app
+
+
+def client_loop(url, body, stop, latencies, statuses):
+    data = json.dumps(body).encode() if body is not None else None
+    while not stop.is_set():
+        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--login-clients', type=int, default=32)
+    parser.add_argument('--ping-clients', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=int(os.getenv('BCRYPT_LOG_ROUNDS', '12')))
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import hashing
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, build_app(args.rounds), threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    stop = threading.Event()
+    login_lat, login_status = [], {}
+    ping_lat, ping_status = [], {}
+    threads = [threading.Thread(target=client_loop, args=(base + '/login', {"password": "correct horse"}, stop, login_lat, login_status))
+               for _ in range(args.login_clients)]
+    threads += [threading.Thread(target=client_loop, args=(base + '/ping', None, stop, ping_lat, ping_status))
+                for _ in range(args.ping_clients)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    server.shutdown()
+    hashing.pool.shutdown()
+
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    result = {
+        "hashWorkers": hashing.HASH_WORKERS,
+        "rounds": args.rounds,
+        "seconds": args.seconds,
+        "login": {
+            "throughput": round(login_status.get(200, 0) / args.seconds, 1),
+            "statuses": login_status,
+            "p50_ms": ms(percentile(login_lat, 50)),
+            "p99_ms": ms(percentile(login_lat, 99)),
+        },
+        "ping": {
+            "throughput": round(len(ping_lat) / args.seconds, 1),
+            "p50_ms": ms(percentile(ping_lat, 50)),
+            "p99_ms": ms(percentile(ping_lat, 99)),
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+Synthetic data generator for performance testing.
+
+Generates a realistic, referentially consistent dataset and loads it with
+unordered insert_many batches from several processes in parallel:
+
+  * university_students (roster) and activated student_users
+  * doctors with session times and unavailableDates, plus admin /
+    pharmacist / lab tech accounts
+  * appointments spread over past and future dates with a realistic
+    status mix (no two active bookings share a doctor slot)
+  * prescriptions with medication lists, lab requests and the lab reports
+    that completed them
+
+Every student, doctor and name referenced by a record exists. Contents
+(apart from ObjectIds) are deterministic for a given --seed and size,
+whatever --workers is.
+Afterwards the indexes are built and the daily_stats rollup is rebuilt.
+Uploaded report files are not created, so /uploads returns 404 for them.
+
+    python datagen.py --scale small --drop        # ~60k documents
+    python datagen.py --scale large --drop        # ~3.7M documents
+    python datagen.py --scale xl --drop           # ~10M documents
+    python datagen.py --students 50000 --appointments 500000 --drop
+
+Writes to MONGO_URI / MONGO_DB_NAME (.env) unless --mongo-uri / --db-name
+are given. Every account's password is --password (default password123).
+"""
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, date as date_cls
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bson import ObjectId
+
+SCALES = {
+    #          students, doctors, appointments, prescriptions, lab requests
+    "small": (5000, 20, 40000, 10000, 5000),
+    "medium": (20000, 60, 300000, 100000, 50000),
+    "large": (100000, 150, 2000000, 1000000, 300000),
+    "xl": (100000, 300, 6000000, 2500000, 700000),
+}
+
+BATCH_SIZE = int(os.getenv('DATAGEN_BATCH_SIZE', '5000'))
+CHUNK_SIZE = 50000 # documents per parallel task
+
+FIRST_NAMES = ["Aarav", "Aditi", "Akhil", "Anjali", "Arjun", "Bhavana", "Charan", "Deepika", "Divya", "Ganesh",
+               "Harika", "Harsha", "Kavya", "Keerthi", "Kiran", "Lakshmi", "Mahesh", "Meghana", "Naveen", "Nikhil",
+               "Pavan", "Pooja", "Praveen", "Priya", "Rahul", "Ramya", "Ravi", "Sai", "Sandeep", "Sravani",
+               "Srinivas", "Sneha", "Suresh", "Swathi", "Teja", "Uday", "Varun", "Vyshnavi", "Yamini", "Yashwanth"]
+LAST_NAMES = ["Reddy", "Naidu", "Rao", "Chowdary", "Sharma", "Kumar", "Varma", "Goud", "Raju", "Murthy",
+              "Prasad", "Shetty", "Iyer", "Pillai", "Nair", "Das", "Gupta", "Patel", "Singh", "Verma"]
+SPECIALIZATIONS = ["General Medicine", "Dermatology", "ENT", "Orthopedics", "Ophthalmology", "Psychiatry",
+                   "Gynecology", "Dental", "Physiotherapy"]
+REASONS = ["Fever", "Headache", "Cold and cough", "Stomach pain", "Skin rash", "Back pain", "Follow-up",
+           "Sports injury", "Eye irritation", "Anxiety", "Routine checkup", "Allergy"]
+DIAGNOSES = ["Viral fever", "Migraine", "Upper respiratory infection", "Gastritis", "Contact dermatitis",
+             "Muscle strain", "Conjunctivitis", "Seasonal allergy", "Sprain", "Vitamin D deficiency"]
+MEDICATIONS = [
+    ("Paracetamol", "500mg", "1-0-1"), ("Cetirizine", "10mg", "0-0-1"), ("Amoxicillin", "500mg", "1-1-1"),
+    ("Ibuprofen", "400mg", "1-0-1"), ("Pantoprazole", "40mg", "1-0-0"), ("Azithromycin", "500mg", "1-0-0"),
+    ("Vitamin D3", "60000IU", "weekly"), ("ORS", "1 sachet", "as needed"), ("Diclofenac gel", "apply", "1-0-1"),
+    ("Montelukast", "10mg", "0-0-1"),
+]
+LAB_TESTS = ["Complete Blood Count", "Blood Sugar", "Lipid Profile", "Thyroid Profile", "Urine Analysis",
+             "X-Ray Chest", "Liver Function Test", "Vitamin D", "Dengue NS1", "ECG"]
+SESSIONS = [("09:00", "13:00", "17:00", "20:00"), ("08:30", "12:30", "16:00", "19:00"), ("10:00", "14:00", "18:00", "21:00")]
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 28 # 4h morning + 3h evening of 15-minute slots
+
+
+def student_id(i):
+    return f"SVU{i:07d}"
+
+
+def person_name(i, salt=0):
+    rng = random.Random(i * 7919 + salt)
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _skewed(rng, n):
+    """Index in [0, n) with a long tail: a few students visit far more often than most."""
+    return min(n - 1, int(n * rng.random() ** 2))
+
+
+def _slot_time(session, slot):
+    # First 16 slots in the morning session, the rest in the evening one
+    start = session[0] if slot < 16 else session[2]
+    h, m = map(int, start.split(':'))
+    minutes = h * 60 + m + (slot if slot < 16 else slot - 16) * SLOT_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# --- Per-chunk generators (run in worker processes) ---
+
+def gen_students(plan, start, count, rng):
+    roster, accounts = [], []
+    now = datetime.now()
+    for i in range(start, start + count):
+        s_id = student_id(i)
+        roster.append({"studentId": s_id, "name": person_name(i), "registeredPhone": f"9{rng.randrange(10**9):09d}",
+                       "addedAt": now})
+        if rng.random() < plan["activatedRatio"]:
+            accounts.append({"studentId": s_id, "password": plan["passwordHash"]})
+    return {"university_students": roster, "student_users": accounts}
+
+
+def gen_appointments(plan, start, count, rng):
+    doctors = plan["doctors"]
+    n_doctors = len(doctors)
+    first_day = date_cls.fromisoformat(plan["firstDay"])
+    today = plan["today"]
+    capacity = n_doctors * plan["days"] * SLOTS_PER_DAY
+    stride = capacity // plan["appointments"]
+    docs = []
+    for k in range(start, start + count):
+        # Spread bookings evenly over the slot grid; a distinct position per k
+        # keeps every (doctor, date, time) unique
+        pos = k * stride + rng.randrange(stride)
+        doctor = doctors[pos % n_doctors]
+        day_index, slot = divmod(pos // n_doctors, SLOTS_PER_DAY)
+        day = (first_day + timedelta(days=day_index)).isoformat()
+        s_index = _skewed(rng, plan["students"])
+
+        r = rng.random()
+        if day < today:
+            status = "Completed" if r < 0.8 else ("Cancelled" if r < 0.92 else "Scheduled")
+        else:
+            status = "Cancelled" if r < 0.1 else "Scheduled"
+        appt = {
+            "studentId": student_id(s_index), "studentName": person_name(s_index),
+            "doctorId": doctor["id"], "doctorName": doctor["name"],
+            "date": day, "time": _slot_time(doctor["session"], slot),
+            "reason": rng.choice(REASONS), "status": status,
+        }
+        if status == "Cancelled":
+            appt["cancelledAt"] = datetime.fromisoformat(day) - timedelta(hours=rng.randint(1, 72))
+        else:
+            appt["active"] = True
+        docs.append(appt)
+    return {"appointments": docs}
+
+
+def _past_datetime(plan, rng):
+    return plan["now"] - timedelta(days=rng.randrange(plan["historyDays"]), minutes=rng.randrange(9 * 60))
+
+
+def gen_prescriptions(plan, start, count, rng):
+    doctors = plan["doctors"]
+    docs = []
+    for _ in range(count):
+        doctor = rng.choice(doctors)
+        s_index = _skewed(rng, plan["students"])
+        created = _past_datetime(plan, rng)
+        recent = plan["now"] - created < timedelta(days=3)
+        r = rng.random()
+        status = "Private" if r < 0.2 else ("Pending" if recent and r < 0.6 else "Dispensed")
+        doc = {
+            "studentId": student_id(s_index), "studentName": person_name(s_index),
+            "doctorId": doctor["id"], "doctorName": doctor["name"],
+            "date": created.strftime("%Y-%m-%d"), "diagnosis": rng.choice(DIAGNOSES),
+            "medications": [
+                {"name": name, "dosage": dosage, "frequency": freq, "duration": f"{rng.choice([3, 5, 7, 10])} days"}
+                for name, dosage, freq in rng.sample(MEDICATIONS, rng.randint(1, 4))
+            ],
+            "notes": "", "status": status, "createdAt": created,
+        }
+        if status == "Dispensed":
+            dispensed = created + timedelta(minutes=rng.randint(5, 240))
+            doc["dispensedAt"] = dispensed
+            doc["dispensedDate"] = dispensed.strftime("%Y-%m-%d")
+        docs.append(doc)
+    return {"prescriptions": docs}
+
+
+def gen_lab(plan, start, count, rng):
+    doctors = plan["doctors"]
+    lab_techs = plan["labTechIds"]
+    requests, reports = [], []
+    for _ in range(count):
+        doctor = rng.choice(doctors)
+        s_index = _skewed(rng, plan["students"])
+        created = _past_datetime(plan, rng)
+        test = rng.choice(LAB_TESTS)
+        request = {
+            "_id": ObjectId(), "studentId": student_id(s_index), "studentName": person_name(s_index),
+            "doctorId": doctor["id"], "doctorName": doctor["name"], "testType": test, "notes": "",
+            "date": created.strftime("%Y-%m-%d"), "status": "Pending", "createdAt": created,
+        }
+        recent = plan["now"] - created < timedelta(days=2)
+        if not recent or rng.random() < 0.5:
+            completed = created + timedelta(hours=rng.randint(1, 48))
+            content_hash = "%064x" % rng.getrandbits(256)
+            report = {
+                "_id": ObjectId(), "studentId": request["studentId"], "labTechId": rng.choice(lab_techs),
+                "testName": test, "filename": content_hash + ".pdf", "originalFilename": f"{test.replace(' ', '_')}.pdf",
+                "contentHash": content_hash, "size": rng.randint(50_000, 2_000_000), "remarks": "",
+                "date": completed.strftime("%Y-%m-%d"), "createdAt": completed, "requestId": str(request["_id"]),
+            }
+            request.update(status="Completed", reportId=str(report["_id"]), completedAt=completed)
+            reports.append(report)
+        requests.append(request)
+    return {"lab_requests": requests, "lab_reports": reports}
+
+
+GENERATORS = {
+    "students": gen_students,
+    "appointments": gen_appointments,
+    "prescriptions": gen_prescriptions,
+    "lab": gen_lab,
+}
+
+_db = None
+
+
+def _init_worker(uri, db_name):
+    global _db
+    from pymongo import MongoClient
+    _db = MongoClient(uri)[db_name]
+
+
+def run_chunk(kind, plan, chunk_no, start, count):
+    """Generate one chunk and insert it. Returns {collection: documents inserted}."""
+    # Seeded per chunk, so output doesn't depend on which worker runs it
+    rng = random.Random(f"{plan['seed']}:{kind}:{chunk_no}")
+    inserted = {}
+    for coll_name, docs in GENERATORS[kind](plan, start, count, rng).items():
+        for i in range(0, len(docs), BATCH_SIZE):
+            _db[coll_name].insert_many(docs[i:i + BATCH_SIZE], ordered=False, bypass_document_validation=True)
+        inserted[coll_name] = len(docs)
+    return inserted
+
+
+# --- Driver ---
+
+def make_staff(db, args, password_hash, rng):
+    first_day = date_cls.today()
+    doctors = []
+    for i in range(args.doctors):
+        session = SESSIONS[i % len(SESSIONS)]
+        unavailable = sorted({(first_day + timedelta(days=rng.randint(1, args.future_days))).isoformat()
+                              for _ in range(rng.randint(0, 3))})
+        doctors.append({
+            "email": f"doctor{i}@svu.test", "name": f"Dr. {person_name(i, salt=1)}", "password": password_hash,
+            "role": "doctor", "specialization": SPECIALIZATIONS[i % len(SPECIALIZATIONS)],
+            "morningStart": session[0], "morningEnd": session[1],
+            "eveningStart": session[2], "eveningEnd": session[3],
+            "unavailableDates": unavailable,
+        })
+    staff = [{"email": "admin@svu.test", "name": "Admin", "password": password_hash, "role": "admin"}]
+    staff += [{"email": f"pharmacist{i}@svu.test", "name": f"{person_name(i, salt=2)}", "password": password_hash,
+               "role": "pharmacist"} for i in range(max(1, args.doctors // 10))]
+    lab_techs = [{"email": f"labtech{i}@svu.test", "name": f"{person_name(i, salt=3)}", "password": password_hash,
+                  "role": "lab_tech"} for i in range(max(1, args.doctors // 10))]
+    db.staff_users.insert_many(doctors + staff + lab_techs)
+    return doctors, lab_techs
+
+
+def _chunks(total):
+    return [(n, start, min(CHUNK_SIZE, total - start)) for n, start in enumerate(range(0, total, CHUNK_SIZE))]
+
+
+def generate(db, args, uri, log=print):
+    """Load a dataset into `db` as described by `args`. Returns ids callers can drive requests with."""
+    import bcrypt
+    from indexes import ensure_indexes
+    from rollup import rebuild
+    from doctor_cache import VERSION_DOC_ID
+    from names import META_DOC_ID as NAMES_DOC_ID
+
+    rng = random.Random(args.seed)
+    existing = [c for c in ("university_students", "appointments", "staff_users") if db[c].estimated_document_count()]
+    if existing and not args.drop:
+        raise SystemExit(f"{db.name} already has data in {', '.join(existing)}; pass --drop to replace it")
+    if args.drop:
+        for name in db.list_collection_names():
+            if not name.startswith('system.'):
+                db.drop_collection(name)
+
+    password_hash = bcrypt.hashpw(args.password.encode(), bcrypt.gensalt(args.bcrypt_rounds)).decode()
+    doctors, lab_techs = make_staff(db, args, password_hash, rng)
+
+    days = args.history_days + args.future_days
+    capacity = len(doctors) * days * SLOTS_PER_DAY
+    if args.appointments > capacity:
+        raise SystemExit(f"{args.appointments} appointments don't fit in {capacity} doctor slots; "
+                         f"raise --doctors or --history-days")
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    plan = {
+        "seed": args.seed,
+        "students": args.students,
+        "appointments": max(1, args.appointments),
+        "activatedRatio": args.activated,
+        "passwordHash": password_hash,
+        "doctors": [{"id": str(d["_id"]), "name": d["name"],
+                     "session": (d["morningStart"], d["morningEnd"], d["eveningStart"], d["eveningEnd"])} for d in doctors],
+        "labTechIds": [str(t["_id"]) for t in lab_techs],
+        "firstDay": (now.date() - timedelta(days=args.history_days)).isoformat(),
+        "today": now.date().isoformat(),
+        "now": now,
+        "days": days,
+        "historyDays": args.history_days,
+    }
+
+    tasks = [("students", chunk) for chunk in _chunks(args.students)]
+    tasks += [("appointments", chunk) for chunk in _chunks(args.appointments)]
+    tasks += [("prescriptions", chunk) for chunk in _chunks(args.prescriptions)]
+    tasks += [("lab", chunk) for chunk in _chunks(args.lab_requests)]
+
+    totals = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(uri, db.name)) as pool:
+        futures = [pool.submit(run_chunk, kind, plan, *chunk) for kind, chunk in tasks]
+        for done, future in enumerate(as_completed(futures), start=1):
+            for coll_name, n in future.result().items():
+                totals[coll_name] = totals.get(coll_name, 0) + n
+            elapsed = time.perf_counter() - started
+            inserted = sum(totals.values())
+            log(f"  [{done}/{len(futures)}] {inserted} documents, {inserted / elapsed:,.0f} docs/s")
+    load_seconds = time.perf_counter() - started
+
+    log("Building indexes...")
+    ensure_indexes(db)
+    log("Rebuilding daily_stats...")
+    rebuild(db)
+    # Workers with a cached doctor directory must reload it
+    db.app_meta.update_one({"_id": VERSION_DOC_ID}, {"$inc": {"version": 1}}, upsert=True)
+    # Generated names are already in sync: skip the first-start reconcile
+    db.app_meta.update_one({"_id": NAMES_DOC_ID},
+                           {"$set": {"startedAt": now, "reconciledAt": now, "updated": 0}}, upsert=True)
+
+    totals["staff_users"] = db.staff_users.estimated_document_count()
+    return {
+        "documents": totals,
+        "loadSeconds": round(load_seconds, 1),
+        "docsPerSecond": round(sum(totals.values()) / load_seconds) if load_seconds else None,
+        "doctorIds": [d["id"] for d in plan["doctors"]],
+        "studentIds": db.student_users.distinct("studentId"),
+        "staffEmails": {"admin": "admin@svu.test", "pharmacist": "pharmacist0@svu.test", "lab_tech": "labtech0@svu.test"},
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--students', type=int)
+    parser.add_argument('--doctors', type=int)
+    parser.add_argument('--appointments', type=int)
+    parser.add_argument('--prescriptions', type=int)
+    parser.add_argument('--lab-requests', type=int)
+    parser.add_argument('--activated', type=float, default=0.6, help="share of students with a login account")
+    parser.add_argument('--history-days', type=int, default=730)
+    parser.add_argument('--future-days', type=int, default=30)
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--bcrypt-rounds', type=int, default=int(os.getenv('BCRYPT_LOG_ROUNDS', '12')))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--drop', action='store_true', help="replace existing data in the target database")
+    parser.add_argument('--mongo-uri')
+    parser.add_argument('--db-name')
+    return parser
+
+
+def apply_scale(args):
+    """Fill unset sizes from --scale."""
+    students, doctors, appointments, prescriptions, lab_requests = SCALES[args.scale]
+    for name, default in (("students", students), ("doctors", doctors), ("appointments", appointments),
+                          ("prescriptions", prescriptions), ("lab_requests", lab_requests)):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    return args
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    args = apply_scale(build_parser().parse_args())
+    uri = args.mongo_uri or os.getenv('MONGO_URI')
+    if not uri:
+        print("No MONGO_URI found")
+        exit(1)
+    db = MongoClient(uri)[args.db_name or os.getenv('MONGO_DB_NAME', 'smarthealthconnect')]
+
+    print(f"Generating into {db.name}: {args.students} students, {args.doctors} doctors, {args.appointments} appointments, "
+          f"{args.prescriptions} prescriptions, {args.lab_requests} lab requests ({args.workers} workers)")
+    summary = generate(db, args, uri)
+    for coll_name, n in sorted(summary["documents"].items()):
+        print(f"  {coll_name}: {n}")
+    print(f"Loaded in {summary['loadSeconds']}s ({summary['docsPerSecond']} docs/s)")
@@ -0,0 +1,102 @@
+"""
+In-process cache of the doctor directory (staff_users with role "doctor").
+
+The doctor list changes a few times a semester but is read by the doctor
+dropdowns, slot lookups and availability routes on every request. Each
+worker keeps the whole directory in memory, keyed by id, and refreshes it:
+
+  * after DOCTOR_CACHE_TTL seconds (default 300), unconditionally;
+  * when the shared version stamp in app_meta changes. Every write path
+    bumps the stamp through invalidate(), and each worker compares it at
+    most every DOCTOR_CACHE_CHECK_INTERVAL seconds (default 2). A write in
+    one gunicorn worker therefore reaches all the others within that
+    interval.
+"""
+import os
+import time
+import threading
+
+DOCTOR_CACHE_TTL = float(os.getenv('DOCTOR_CACHE_TTL', '300'))
+DOCTOR_CACHE_CHECK_INTERVAL = float(os.getenv('DOCTOR_CACHE_CHECK_INTERVAL', '2'))
+
+VERSION_DOC_ID = "doctor_directory"
+
+# Everything routes need from a doctor; never the password hash.
+DOCTOR_FIELDS = {
+    "name": 1, "nameVersion": 1, "email": 1, "role": 1, "specialization": 1,
+    "morningStart": 1, "morningEnd": 1, "eveningStart": 1, "eveningEnd": 1,
+    "startTime": 1, "endTime": 1, "unavailableDates": 1,
+}
+
+
+class DoctorDirectory:
+    def __init__(self, staff_collection, meta_collection, ttl=DOCTOR_CACHE_TTL, check_interval=DOCTOR_CACHE_CHECK_INTERVAL):
+        self.staff = staff_collection
+        self.meta = meta_collection
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._doctors = None   # id -> doctor dict, in staff_users order
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _read_version(self):
+        doc = self.meta.find_one({"_id": VERSION_DOC_ID}, {"version": 1})
+        return doc.get("version", 0) if doc else 0
+
+    def _reload(self, version):
+        doctors = {}
+        for doc in self.staff.find({"role": "doctor"}, DOCTOR_FIELDS):
+            doc['id'] = str(doc.pop('_id'))
+            doctors[doc['id']] = doc
+        self._doctors = doctors
+        self._version = version
+        self._loaded_at = self._checked_at = time.monotonic()
+        self.reloads += 1
+
+    def _fresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._doctors is not None and now - self._loaded_at < self.ttl:
+                if now - self._checked_at < self.check_interval:
+                    self.hits += 1
+                    return self._doctors
+                version = self._read_version()
+                self._checked_at = now
+                if version == self._version:
+                    self.hits += 1
+                    return self._doctors
+            else:
+                # Read the stamp before the data: a write racing with the
+                # reload bumps it again and triggers the next reload.
+                version = self._read_version()
+            self.misses += 1
+            self._reload(version)
+            return self._doctors
+
+    def all(self):
+        return list(self._fresh().values())
+
+    def get(self, doctor_id):
+        return self._fresh().get(str(doctor_id))
+
+    def invalidate(self):
+        """Call after any write to a doctor. Bumps the shared stamp so every worker reloads."""
+        self.meta.update_one({"_id": VERSION_DOC_ID}, {"$inc": {"version": 1}}, upsert=True)
+        with self._lock:
+            self._doctors = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else None,
+            "size": len(self._doctors) if self._doctors is not None else 0,
+            "version": self._version,
+        }
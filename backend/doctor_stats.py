@@ -0,0 +1,108 @@
+"""
+Doctor dashboard counters.
+
+get_doctor_stats needs today's queue, today's completed count and the
+number of distinct patients the doctor has ever seen:
+
+  * today's counts read only today's appointments, through the
+    "doctor_date_time" index;
+  * distinct patients are one index key per student: the match + sort on
+    (doctorId, studentId) lets the $group run as a DISTINCT_SCAN over
+    "doctor_student_date_status" and $count folds it into one number, so
+    neither appointment documents nor a per-visit array are ever built.
+
+Results are cached per worker for DOCTOR_STATS_TTL seconds (default 60),
+keyed by (doctor, day). Booking, cancellation and deletion bump the
+doctor's change version (versions.py); a cached entry reads that version
+at most once per DOCTOR_STATS_CHECK_INTERVAL seconds (default 5) and is
+dropped when it moved, so a hit normally costs no round trip and a change
+shows up in every worker within the interval.
+"""
+import os
+import time
+import threading
+
+DOCTOR_STATS_TTL = float(os.getenv('DOCTOR_STATS_TTL', '60'))
+DOCTOR_STATS_CHECK_INTERVAL = float(os.getenv('DOCTOR_STATS_CHECK_INTERVAL', '5'))
+DOCTOR_STATS_MAX_ENTRIES = 1024
+
+QUEUE_STATUSES = ["Scheduled", "Pending"]
+
+
+def today_pipeline(doctor_id, today):
+    return [
+        {"$match": {"doctorId": doctor_id, "date": today}},
+        {"$group": {"_id": "$status", "n": {"$sum": 1}}},
+    ]
+
+
+def patients_pipeline(doctor_id):
+    return [
+        {"$match": {"doctorId": doctor_id}},
+        # Sorted like the index so $group can skip to each next studentId
+        {"$sort": {"doctorId": 1, "studentId": 1}},
+        {"$group": {"_id": "$studentId"}},
+        {"$count": "total"},
+    ]
+
+
+def compute_doctor_stats(collection, doctor_id, today):
+    by_status = {row['_id']: row['n'] for row in collection.aggregate(today_pipeline(doctor_id, today))}
+    patients = next(collection.aggregate(patients_pipeline(doctor_id)), None)
+    return {
+        "queue": sum(by_status.get(s, 0) for s in QUEUE_STATUSES),
+        "completedToday": by_status.get("Completed", 0),
+        "totalPatients": patients['total'] if patients else 0,
+    }
+
+
+class DoctorStatsCache:
+    def __init__(self, ttl=DOCTOR_STATS_TTL, check_interval=DOCTOR_STATS_CHECK_INTERVAL, max_entries=DOCTOR_STATS_MAX_ENTRIES):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {} # doctor_id -> [day, version, stats, stored_at, checked_at]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doctor_id, day, read_version, compute):
+        """
+        Cached stats for doctor_id on `day` while fresh; else compute().
+        read_version() returns the doctor's change version; it is only
+        called when the entry is due a check, or before computing.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(doctor_id)
+            fresh = entry is not None and entry[0] == day and now - entry[3] < self.ttl
+            if fresh and now - entry[4] < self.check_interval:
+                self.hits += 1
+                return entry[2]
+
+        version = read_version()
+        with self._lock:
+            if fresh and entry[1] == version:
+                entry[4] = now
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # The version is read before computing: a change racing with it
+        # moves the version again and retires this entry at the next check
+        stats = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries and doctor_id not in self._entries:
+                self._entries.clear()
+            self._entries[doctor_id] = [day, version, stats, now, now]
+        return stats
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / total, 3) if total else None,
+                "size": len(self._entries),
+            }
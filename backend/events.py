@@ -0,0 +1,237 @@
+"""
+Live pharmacy / lab queues over Server-Sent Events.
+
+Instead of polling the queue and stats routes, the pharmacist and lab tech
+screens open an EventSource on /api/pharmacy/queue/events or
+/api/lab/requests/events. Each connection first gets a "snapshot" event
+(the current queue plus counts, one query), then incremental events:
+
+    pharmacy:  added   {prescription}            (new Pending prescription)
+               removed {_id, dispensedDate}      (dispensed)
+    lab:       added   {lab request}             (new request)
+               updated {_id, status, reportId, completedAt}  (report uploaded;
+                                                  drops out of the queue)
+
+The snapshot holds only what is still queued (Pending prescriptions,
+Pending lab requests), so reconnecting never re-downloads the history.
+
+Events are keyed by _id so clients can apply them idempotently. A client
+that falls too far behind gets a fresh snapshot instead of the backlog.
+
+Where events come from (EVENTS_SOURCE):
+  * "local" (default): the write routes publish to this process's bus.
+    Only clients connected to the same process see them, so it only works
+    with a single worker (threads are fine); gunicorn.conf.py switches the
+    default to "changestream" and refuses "local" when workers > 1.
+  * "changestream": one thread per process watches the prescriptions and
+    lab_requests change streams (needs a replica set; a single-node one is
+    enough) and publishes every change, whichever worker made it.
+
+Other settings: EVENTS_HEARTBEAT (seconds between keep-alive comments,
+default 15), EVENTS_MAX_AGE (seconds before the server ends a stream and
+the browser reconnects, default 300), EVENTS_MAX_SUBSCRIBERS (open streams
+per process, default GUNICORN_THREADS - 2), EVENTS_QUEUE_SIZE (buffered
+events per client, default 256).
+
+Each open stream holds a request thread for up to EVENTS_MAX_AGE, so the
+subscriber cap must stay below the worker's thread count; past it clients
+get a 503 and retry, instead of the streams starving the normal routes.
+"""
+import os
+import time
+import queue
+import threading
+
+EVENTS_SOURCE = os.getenv('EVENTS_SOURCE', 'local').lower()
+EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', '15'))
+EVENTS_MAX_AGE = float(os.getenv('EVENTS_MAX_AGE', '300'))
+# Leave threads free for the rest of the API (gthread: one thread per open stream)
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', str(max(1, int(os.getenv('GUNICORN_THREADS', '8')) - 2))))
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '256'))
+
+PHARMACY_QUEUE = 'pharmacy'
+LAB_REQUESTS = 'lab'
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscriber:
+    def __init__(self, channel):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow client: drop the backlog, it will be re-sent a snapshot
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        self.overflowed = False
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class EventBus:
+    """In-process publish/subscribe; one per worker."""
+
+    def __init__(self, max_subscribers=EVENTS_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        with self._lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= self.max_subscribers:
+                raise TooManySubscribers()
+            sub = Subscriber(channel)
+            self._subscribers.setdefault(channel, set()).add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.get(sub.channel, set()).discard(sub)
+
+    def publish(self, channel, event, data):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for sub in subs:
+            sub.put((event, data))
+
+    def stats(self):
+        with self._lock:
+            return {channel: len(subs) for channel, subs in self._subscribers.items()}
+
+
+bus = EventBus()
+
+
+def publish(channel, event, data):
+    """Called by the write routes; a no-op when change streams feed the bus."""
+    if EVENTS_SOURCE != 'changestream':
+        bus.publish(channel, event, data)
+
+
+def sse_format(event, payload):
+    """One SSE message; `payload` is already-serialized JSON (no newlines)."""
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def iter_events(sub, snapshot, dumps, heartbeat=EVENTS_HEARTBEAT, max_age=EVENTS_MAX_AGE):
+    """
+    Yield SSE messages for one subscriber until max_age, starting with a snapshot.
+
+    The subscriber must already be registered, so nothing published while the
+    snapshot query runs is lost (it may be repeated, which is harmless).
+    """
+    deadline = time.monotonic() + max_age
+    yield "retry: 2000\n\n"
+    yield sse_format('snapshot', dumps(snapshot()))
+    while time.monotonic() < deadline:
+        if sub.overflowed:
+            sub.drain()
+            yield sse_format('snapshot', dumps(snapshot()))
+            continue
+        item = sub.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.1)))
+        if item is None:
+            # Comment line: keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            continue
+        event, data = item
+        yield sse_format(event, dumps(data))
+
+
+# --- Change stream feeder (EVENTS_SOURCE=changestream) ---
+
+_feeder_lock = threading.Lock()
+_feeder_pid = None
+
+
+def _prescription_event(change):
+    op = change['operationType']
+    if op == 'insert':
+        doc = change['fullDocument']
+        if doc.get('status') == 'Pending':
+            return 'added', doc
+    elif op == 'update':
+        fields = change['updateDescription']['updatedFields']
+        if fields.get('status') == 'Dispensed':
+            return 'removed', {"_id": change['documentKey']['_id'], "dispensedDate": fields.get('dispensedDate')}
+    return None
+
+
+def _lab_request_event(change):
+    op = change['operationType']
+    if op == 'insert':
+        return 'added', change['fullDocument']
+    elif op == 'update':
+        fields = change['updateDescription']['updatedFields']
+        if 'status' in fields:
+            return 'updated', dict(fields, _id=change['documentKey']['_id'])
+    return None
+
+
+_FEEDS = {
+    'prescriptions': (PHARMACY_QUEUE, _prescription_event),
+    'lab_requests': (LAB_REQUESTS, _lab_request_event),
+}
+
+
+def _watch(db):
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": list(_FEEDS)},
+        "operationType": {"$in": ["insert", "update"]}
+    }}]
+    resume_token = None
+    while True:
+        try:
+            with db.watch(pipeline, resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    channel, to_event = _FEEDS[change['ns']['coll']]
+                    event = to_event(change)
+                    if event:
+                        bus.publish(channel, *event)
+        except Exception as e:
+            print(f"[EVENTS WARNING] change stream stopped: {e}; retrying in 5s")
+            time.sleep(5)
+
+
+def check_change_feed(client):
+    """
+    Raise unless `client`'s server can open change streams (replica set or
+    mongos) when EVENTS_SOURCE=changestream; a standalone mongod would
+    leave the feeder retrying forever while no event is ever delivered.
+    """
+    if EVENTS_SOURCE != 'changestream':
+        return
+    hello = client.admin.command('hello')
+    if not hello.get('setName') and hello.get('msg') != 'isdbgrid':
+        raise RuntimeError("EVENTS_SOURCE=changestream needs a replica set (a single-node one is enough) "
+                           "but MongoDB is a standalone server; start mongod with --replSet and run "
+                           "rs.initiate(), or use GUNICORN_WORKERS=1 with EVENTS_SOURCE=local")
+
+
+def start_change_feed(db):
+    """Start this process's change stream thread once (EVENTS_SOURCE=changestream)."""
+    global _feeder_pid
+    if EVENTS_SOURCE != 'changestream':
+        return
+    with _feeder_lock:
+        if _feeder_pid == os.getpid():
+            return
+        threading.Thread(target=_watch, args=(db,), name='events-change-stream', daemon=True).start()
+        _feeder_pid = os.getpid()
@@ -0,0 +1,69 @@
+"""
+gunicorn settings:  gunicorn -c gunicorn.conf.py
+
+Environment: GUNICORN_BIND (default 0.0.0.0:5000), GUNICORN_WORKERS (2),
+GUNICORN_THREADS (8), GUNICORN_PRELOAD (1). Each worker gets its own
+MongoClient sized by MONGO_MAX_POOL_SIZE etc. (see mongo.py), so the total
+connections to Mongo are at most workers * maxPoolSize.
+
+Live queues (events.py): each open SSE stream holds one of the worker's
+threads, so EVENTS_MAX_SUBSCRIBERS must be below GUNICORN_THREADS, and
+GUNICORN_THREADS must be at least 2. With more than one worker, events
+must come from the change stream (EVENTS_SOURCE=changestream, the default
+here), which needs MongoDB to run as a replica set; startup fails against
+a standalone mongod. "local" would only reach clients on the worker that
+made the write.
+"""
+import os
+from dotenv import load_dotenv
+
+# Read .env now so the checks below see the same settings the app will
+load_dotenv()
+
+# app.py builds the app at import; 'app:create_app()' would build a second one
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_class = 'gthread'
+# Import the app once in the master; safe because nothing connects at import
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# hashing.py splits the CPUs between the workers' bcrypt pools
+os.environ.setdefault('GUNICORN_WORKERS', str(workers))
+
+# Live queue settings (events.py reads them when the app is imported)
+if workers > 1:
+    os.environ.setdefault('EVENTS_SOURCE', 'changestream')
+    if os.environ['EVENTS_SOURCE'].lower() != 'changestream':
+        raise RuntimeError("EVENTS_SOURCE=local needs GUNICORN_WORKERS=1 (or use EVENTS_SOURCE=changestream)")
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+if threads < 2:
+    raise RuntimeError("GUNICORN_THREADS must be at least 2: live streams may hold all but one thread")
+if int(os.getenv('EVENTS_MAX_SUBSCRIBERS', max(1, threads - 2))) >= threads:
+    raise RuntimeError("EVENTS_MAX_SUBSCRIBERS must be below GUNICORN_THREADS, or live streams can take every thread")
+
+
+def on_starting(server):
+    # Index builds and the first daily_stats backfill run once, in the
+    # master, before any worker takes requests (app.prepare_database)
+    from app import app, prepare_database
+    from mongo import mongo
+    from events import check_change_feed
+    check_change_feed(mongo.client)
+    prepare_database(app)
+    # The workers must not inherit this client (post_fork drops it anyway)
+    mongo.reset()
+
+
+def post_fork(server, worker):
+    # Never reuse a client or process pool created before the fork
+    from mongo import mongo
+    from hashing import pool
+    mongo.reset()
+    pool.shutdown()
+
+
+def post_worker_init(worker):
+    from app import start_background_jobs
+    start_background_jobs()
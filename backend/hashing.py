@@ -0,0 +1,128 @@
+"""
+Password hashing off the request thread.
+
+bcrypt is deliberately CPU-heavy; doing it inline in a request lets a burst
+of logins occupy every worker. Hashes and checks run in a small process
+pool instead (not bound by the GIL), with a bounded queue: when the pool is
+saturated new auth requests fail fast with HashingBusy (503) instead of
+piling up behind each other.
+
+Settings (environment):
+    BCRYPT_LOG_ROUNDS  cost factor for new hashes (default 12). Logins with a
+                       hash of a different cost are transparently rehashed.
+    HASH_WORKERS       pool processes per app process (default: CPU count
+                       divided by GUNICORN_WORKERS, at least 1; 0 = hash inline)
+    HASH_QUEUE_SIZE    jobs allowed to wait for a free process (default 64)
+    HASH_TIMEOUT       seconds to wait for a result (default 10)
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+# Every gunicorn worker has its own pool; together they should fill the CPUs, not multiply them
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // int(os.getenv('GUNICORN_WORKERS', '1'))))))
+HASH_QUEUE_SIZE = int(os.getenv('HASH_QUEUE_SIZE', '64'))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', '10'))
+
+# bcrypt only looks at the first 72 bytes; older bcrypt releases truncated
+# silently, newer ones raise, so truncate explicitly to keep old hashes valid.
+_BCRYPT_MAX_BYTES = 72
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _to_bytes(password):
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    return password[:_BCRYPT_MAX_BYTES]
+
+
+# --- Functions executed inside the pool processes ---
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return bcrypt.checkpw(_to_bytes(password), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Malformed stored hash
+        return False
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class HashingPool:
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # One pool per process: a pool inherited through fork() is unusable.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Never fork() the app process itself: it runs request and
+                # pymongo monitor threads, and a child could inherit a held lock
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = HashingPool()
+
+
+def hash_password(password):
+    return pool.run(_hash, password, BCRYPT_LOG_ROUNDS)
+
+
+def check_password(pw_hash, password):
+    if not pw_hash or password is None:
+        return False
+    return pool.run(_check, pw_hash, password)
+
+
+def hash_cost(pw_hash):
+    # "$2b$12$..." -> 12
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(pw_hash):
+    return hash_cost(pw_hash) != BCRYPT_LOG_ROUNDS
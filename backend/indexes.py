@@ -0,0 +1,289 @@
+"""
+Index registry for the SmartHealthConnect collections.
+
+Every index the API relies on is declared in INDEXES below, next to the
+route(s) whose filter/sort it serves. `ensure_indexes(db)` is called when
+app.py starts; `python indexes.py audit` reports what is missing, unused
+or redundant on a live database (uses $indexStats).
+
+Usage:
+    python indexes.py apply              # create everything in the registry
+    python indexes.py apply --rebuild    # also rebuild changed "required" indexes
+    python indexes.py audit              # report missing / unused / redundant indexes
+
+Indexes marked "required" enforce an invariant rather than speed up a
+query (active_slot_unique is the only guard against double booking), so
+ensure_indexes raises instead of warning when one can't be built, and
+never drops one to rebuild it unless asked to (--rebuild). Routes that
+rely on one check it with IndexGuard and refuse to write without it.
+"""
+import os
+import sys
+import time
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# createIndexes error codes for "an index with this name exists with other keys/options"
+_INDEX_CONFLICT_CODES = (85, 86)
+
+# collection name -> list of index specs
+# Each spec: name, keys (list of (field, direction)), plus optional IndexModel kwargs.
+# List indexes end in _id so keyset pagination (pagination.py) never needs an in-memory sort.
+INDEXES = {
+    "appointments": [
+        # book_appointment / get_available_slots: {doctorId, date, time}
+        # get_doctor_appointments: {doctorId} sorted by date, time DESC (reverse scan)
+        {"name": "doctor_date_time", "keys": [("doctorId", ASCENDING), ("date", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)]},
+        # get_student_appointments: {studentId} sorted by date, time DESC
+        {"name": "student_date_time", "keys": [("studentId", ASCENDING), ("date", DESCENDING), ("time", DESCENDING), ("_id", DESCENDING)]},
+        # book_appointment: at most one non-cancelled booking per slot.
+        # Partial indexes can't express status != "Cancelled", so bookings
+        # carry active: true until cancelled.
+        {"name": "active_slot_unique", "keys": [("doctorId", ASCENDING), ("date", ASCENDING), ("time", ASCENDING)],
+         "unique": True, "partialFilterExpression": {"active": True}, "required": True},
+        # get_all_appointments: full listing sorted by date, time DESC
+        {"name": "date_time", "keys": [("date", DESCENDING), ("time", DESCENDING), ("_id", DESCENDING)]},
+        # get_doctor_stats: distinct patients as a DISTINCT_SCAN (no document fetches)
+        {"name": "doctor_student_date_status", "keys": [("doctorId", ASCENDING), ("studentId", ASCENDING), ("date", ASCENDING), ("status", ASCENDING)]},
+    ],
+    "staff_users": [
+        # staff_login / duplicate-email checks on every create route
+        {"name": "email", "keys": [("email", ASCENDING)]},
+        # doctor listings: {role: "doctor"}
+        {"name": "role", "keys": [("role", ASCENDING)]},
+        # names.py sync_pending: renames not yet copied out
+        {"name": "nameSyncPending", "keys": [("nameSyncPending", ASCENDING)], "partialFilterExpression": {"nameSyncPending": True}},
+    ],
+    "university_students": [
+        # student_verify / roster upserts / name lookups
+        {"name": "studentId", "keys": [("studentId", ASCENDING)], "unique": True},
+        # names.py sync_pending: renames not yet copied out
+        {"name": "nameSyncPending", "keys": [("nameSyncPending", ASCENDING)], "partialFilterExpression": {"nameSyncPending": True}},
+    ],
+    "student_users": [
+        # student_login / account activation checks
+        {"name": "studentId", "keys": [("studentId", ASCENDING)], "unique": True},
+    ],
+    "prescriptions": [
+        # get_student_prescriptions: {studentId} sorted by date DESC
+        {"name": "student_date", "keys": [("studentId", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]},
+        # student timeline (timeline.py): {studentId} sorted by createdAt DESC
+        {"name": "student_createdAt", "keys": [("studentId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]},
+        # name fan-out (names.py): {doctorId}
+        {"name": "doctorId", "keys": [("doctorId", ASCENDING)]},
+        # get_pharmacy_queue: {status: "Pending"} sorted by date DESC
+        {"name": "status_date", "keys": [("status", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "lab_reports": [
+        # get_student_reports: {studentId} sorted by createdAt DESC
+        {"name": "student_createdAt", "keys": [("studentId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "lab_requests": [
+        # get_all_lab_requests: sorted by status, createdAt DESC
+        # lab_request_events snapshot: {status: "Pending"} sorted by createdAt DESC
+        {"name": "status_createdAt", "keys": [("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]},
+        # get_student_lab_requests: {studentId} sorted by createdAt DESC
+        {"name": "student_createdAt", "keys": [("studentId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]},
+        # name fan-out (names.py): {doctorId}
+        {"name": "doctorId", "keys": [("doctorId", ASCENDING)]},
+    ],
+}
+
+# Indexes the registry used to declare; dropped so writes stop maintaining them
+RETIRED_INDEXES = {
+    # get_pharmacy_stats now reads the daily_stats rollup (rollup.py)
+    "prescriptions": ["status_dispensedDate"],
+}
+
+_INDEX_OPTIONS = ("unique", "partialFilterExpression", "sparse", "expireAfterSeconds")
+
+
+def _index_model(spec):
+    options = {k: spec[k] for k in _INDEX_OPTIONS if k in spec}
+    return IndexModel(spec["keys"], name=spec["name"], **options)
+
+
+class IndexBuildError(RuntimeError):
+    pass
+
+
+def _backfill_active_slots(db):
+    # Bookings made before active_slot_unique existed have no "active" flag.
+    result = db.appointments.update_many(
+        {"status": {"$ne": "Cancelled"}, "active": {"$exists": False}},
+        {"$set": {"active": True}}
+    )
+    print(f"[INDEX BACKFILL] appointments.active set on {result.modified_count} bookings")
+
+    # Slots double-booked before the index existed: the earliest booking
+    # keeps the slot, the others stay listed but no longer hold it.
+    duplicates = db.appointments.aggregate([
+        {"$match": {"active": True}},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"doctorId": "$doctorId", "date": "$date", "time": "$time"},
+                    "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    released = 0
+    for group in duplicates:
+        result = db.appointments.update_many({"_id": {"$in": group["ids"][1:]}}, {"$unset": {"active": ""}})
+        released += result.modified_count
+    if released:
+        print(f"[INDEX BACKFILL] appointments.active cleared on {released} double-booked appointments")
+
+
+# Data fixes that must run once before an index can be built. They only run
+# while the index is missing, so startup doesn't rescan the collection.
+BACKFILLS = {
+    ("appointments", "active_slot_unique"): _backfill_active_slots,
+}
+
+
+def ensure_indexes(db, rebuild_required=False):
+    """
+    Create every registered index. Safe to call on every startup (createIndexes is idempotent).
+
+    Raises IndexBuildError if a "required" index can't be built, or exists
+    with another definition and rebuild_required is False.
+    """
+    for coll_name, specs in INDEXES.items():
+        existing = set(db[coll_name].index_information())
+        for spec in specs:
+            backfill = BACKFILLS.get((coll_name, spec["name"]))
+            if backfill and spec["name"] not in existing:
+                backfill(db)
+            # One call per index so a single conflict (e.g. duplicates blocking a
+            # unique index) doesn't stop the rest from being built.
+            try:
+                db[coll_name].create_indexes([_index_model(spec)])
+            except OperationFailure as e:
+                required = spec.get("required")
+                if e.code in _INDEX_CONFLICT_CODES and required and not rebuild_required:
+                    # Dropping it would leave the invariant unguarded until the rebuild ends
+                    raise IndexBuildError(f"{coll_name}.{spec['name']} exists with another definition; "
+                                          f"run `python indexes.py apply --rebuild` during a quiet period") from e
+                if e.code in _INDEX_CONFLICT_CODES:
+                    # The registry changed this index's definition: rebuild it.
+                    try:
+                        db[coll_name].drop_index(spec['name'])
+                        db[coll_name].create_indexes([_index_model(spec)])
+                        print(f"[INDEX REBUILT] {coll_name}.{spec['name']}")
+                        continue
+                    except OperationFailure as e2:
+                        e = e2
+                if required:
+                    raise IndexBuildError(f"{coll_name}.{spec['name']}: {e}") from e
+                print(f"[INDEX WARNING] {coll_name}.{spec['name']}: {e}")
+
+    for coll_name, names in RETIRED_INDEXES.items():
+        existing = set(db[coll_name].index_information())
+        for name in names:
+            if name in existing:
+                db[coll_name].drop_index(name)
+                print(f"[INDEX DROPPED] {coll_name}.{name} (retired)")
+
+
+class IndexGuard:
+    """
+    Per-process "does this index exist?" check for routes that must not
+    write without it. A positive answer is cached for `ttl` seconds; a
+    negative one is re-checked on every call.
+    """
+
+    def __init__(self, collection, name, ttl=30):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self._checked_at = None
+        self._pid = None
+
+    def present(self):
+        now = time.monotonic()
+        if self._pid == os.getpid() and self._checked_at is not None and now - self._checked_at < self.ttl:
+            return True
+        if self.name in self.collection.index_information():
+            self._checked_at, self._pid = now, os.getpid()
+            return True
+        self._checked_at = None
+        return False
+
+
+def _is_prefix(short, long):
+    return len(short) < len(long) and long[:len(short)] == short
+
+
+def audit_indexes(db):
+    """
+    Compare the live indexes against the registry.
+
+    Returns a dict per collection with:
+      missing    - registered but not present
+      unused     - present but never used since the last mongod restart ($indexStats ops == 0)
+      redundant  - key pattern is a prefix of another index on the same collection
+      unregistered - present on the server but not declared in INDEXES
+    """
+    report = {}
+    for coll_name, specs in INDEXES.items():
+        coll = db[coll_name]
+        live = coll.index_information()
+        usage = {s["name"]: s["accesses"]["ops"] for s in coll.aggregate([{"$indexStats": {}}])}
+
+        registered = {spec["name"] for spec in specs}
+        keys_by_name = {name: [tuple(k) for k in info["key"]] for name, info in live.items()}
+
+        redundant = []
+        for name, keys in keys_by_name.items():
+            info = live[name]
+            # Unique / partial indexes enforce something; never call them redundant.
+            if name == "_id_" or info.get("unique") or info.get("partialFilterExpression"):
+                continue
+            covering = [other for other, other_keys in keys_by_name.items()
+                        if other != name and _is_prefix(keys, other_keys)]
+            if covering:
+                redundant.append({"index": name, "coveredBy": covering})
+
+        report[coll_name] = {
+            "missing": sorted(registered - set(live)),
+            "unused": sorted(name for name, ops in usage.items() if ops == 0 and name != "_id_"),
+            "redundant": redundant,
+            "unregistered": sorted(set(live) - registered - {"_id_"}),
+            "usage": usage,
+        }
+    return report
+
+
+def print_audit(report):
+    for coll_name, r in report.items():
+        print(f"--- {coll_name} ---")
+        for name, ops in sorted(r["usage"].items()):
+            print(f"  {name}: {ops} ops")
+        for name in r["missing"]:
+            print(f"  MISSING: {name}")
+        for name in r["unused"]:
+            print(f"  UNUSED: {name}")
+        for item in r["redundant"]:
+            print(f"  REDUNDANT: {item['index']} (prefix of {', '.join(item['coveredBy'])})")
+        for name in r["unregistered"]:
+            print(f"  UNREGISTERED: {name}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from mongo import mongo
+
+    if not mongo.uri:
+        print("No MONGO_URI found")
+        exit(1)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "audit"
+    db = mongo.db # MONGO_DB_NAME, like the app
+
+    if command == "apply":
+        ensure_indexes(db, rebuild_required="--rebuild" in sys.argv[2:])
+        print("Indexes applied.")
+    elif command == "audit":
+        print_audit(audit_indexes(db))
+    else:
+        print(__doc__)
+        exit(1)
@@ -0,0 +1,70 @@
+"""
+Flask JSON provider that understands Mongo documents.
+
+Routes can jsonify documents straight from PyMongo: ObjectId becomes its
+hex string, datetimes become ISO 8601 (naive values are treated as UTC,
+as Flask's own encoder did), and Decimal128 / bytes / nested SON encode
+without a per-document copy loop. orjson does the encoding when it is
+installed; otherwise the stdlib json module is used with the same
+conversions, so the output is the same either way.
+"""
+import json
+import base64
+from datetime import datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId, Decimal128, DBRef, Timestamp
+
+try:
+    import orjson
+except ImportError: # optional speed-up
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, DBRef):
+        return str(obj.id)
+    if isinstance(obj, Timestamp):
+        return obj.time
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode('ascii')
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _default_stdlib(obj):
+    # Same datetime format orjson produces with OPT_NAIVE_UTC
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return _default(obj)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+        kwargs.setdefault('default', _default_stdlib)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def dumps_bytes(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        return self.dumps(obj).encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,221 @@
+"""
+Per-request metrics in Prometheus text format, served on /metrics.
+
+  http_request_duration_seconds{endpoint,method,status}   histogram
+  http_request_mongo_commands{endpoint}                    histogram: commands per request
+  http_request_mongo_seconds{endpoint}                     histogram: database time per request
+  mongo_commands_total{endpoint,collection,command}        counter
+  mongo_command_seconds_total{endpoint,collection,command} counter
+  mongo_command_failures_total{endpoint,collection,command}
+
+"endpoint" is the Flask URL rule (e.g. /api/doctor/stats/<doctor_id>), so
+all requests to one route share a series. Database work is attributed to
+the request that ran it through a pymongo CommandListener; commands issued
+outside a request (background threads, CLIs) are labelled "background".
+A route whose commands-per-request histogram spreads to the right issues
+more queries the more data it returns.
+
+A request is measured until the server closes its response, so streamed
+bodies count in full: their duration and the getMore commands run while
+they are sent belong to the route. Each process keeps its own numbers,
+so with several gunicorn workers scrape each worker (or run one worker
+with threads) to see everything.
+"""
+import time
+import threading
+from flask import request
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+BACKGROUND = "background"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {} # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        row = self.series.get(labels)
+        if row is None:
+            row = self.series[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(LATENCY_BUCKETS)
+        self.request_commands = Histogram(COMMAND_COUNT_BUCKETS)
+        self.request_db_seconds = Histogram(LATENCY_BUCKETS)
+        self.commands = {}  # (endpoint, collection, command) -> [count, seconds, failures]
+        self._local = threading.local()
+
+    # --- request scope (same thread as the view and the response body) ---
+
+    def start_request(self):
+        rule = request.url_rule
+        # Kept here: the request context is gone by the time the response is closed
+        self._local.endpoint = rule.rule if rule is not None else "unmatched"
+        self._local.method = request.method
+        self._local.started = time.perf_counter()
+        self._local.commands = 0
+        self._local.db_seconds = 0.0
+
+    def current_endpoint(self):
+        if getattr(self._local, 'started', None) is None:
+            return BACKGROUND
+        return self._local.endpoint
+
+    def finish_request(self, status):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return
+        endpoint = self._local.endpoint
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.request_duration.observe((endpoint, self._local.method, str(status)), elapsed)
+            self.request_commands.observe((endpoint,), self._local.commands)
+            self.request_db_seconds.observe((endpoint,), self._local.db_seconds)
+        self._local.started = None
+
+    # --- commands (called from the listener, in the thread running the command) ---
+
+    def record_command(self, endpoint, collection, command, seconds, failed=False):
+        if getattr(self._local, 'started', None) is not None:
+            self._local.commands += 1
+            self._local.db_seconds += seconds
+        with self._lock:
+            row = self.commands.setdefault((endpoint, collection, command), [0, 0.0, 0])
+            row[0] += 1
+            row[1] += seconds
+            if failed:
+                row[2] += 1
+
+    # --- exposition ---
+
+    def _histogram_lines(self, name, help_text, label_names, histogram):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, row in sorted(histogram.series.items()):
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, row):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {row[-1]}")
+            lines.append(f"{name}_sum{_labels(label_names, labels)} {_number(row[-2])}")
+            lines.append(f"{name}_count{_labels(label_names, labels)} {row[-1]}")
+        return lines
+
+    def render(self, gauges=()):
+        """
+        Prometheus text exposition. `gauges`: iterable of
+        (name, help, {labels tuple or (): value}, label names) added as gauges.
+        """
+        with self._lock:
+            lines = self._histogram_lines("http_request_duration_seconds", "Request latency by Flask endpoint.",
+                                          ("endpoint", "method", "status"), self.request_duration)
+            lines += self._histogram_lines("http_request_mongo_commands", "MongoDB commands issued per request.",
+                                           ("endpoint",), self.request_commands)
+            lines += self._histogram_lines("http_request_mongo_seconds", "MongoDB time per request.",
+                                           ("endpoint",), self.request_db_seconds)
+            names = ("endpoint", "collection", "command")
+            for index, metric, help_text in ((0, "mongo_commands_total", "MongoDB commands by endpoint and collection."),
+                                             (1, "mongo_command_seconds_total", "MongoDB command time by endpoint and collection."),
+                                             (2, "mongo_command_failures_total", "Failed MongoDB commands.")):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for labels, row in sorted(self.commands.items()):
+                    lines.append(f"{metric}{_labels(names, labels)} {_number(row[index])}")
+
+        for name, help_text, values, label_names in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for labels, value in values.items():
+                if value is not None:
+                    lines.append(f"{name}{_labels(label_names, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every command and charges it to the current request's endpoint."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._local = threading.local()
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def started(self, event):
+        command = event.command
+        target = command.get(event.command_name)
+        collection = target if isinstance(target, str) else command.get('collection', '-')
+        self._pending()[(event.connection_id, event.request_id)] = (self.metrics.current_endpoint(), collection)
+
+    def _finish(self, event, failed):
+        endpoint, collection = self._pending().pop((event.connection_id, event.request_id), (BACKGROUND, '-'))
+        self.metrics.record_command(endpoint, collection, event.command_name, event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+metrics = Metrics()
+_listener = CommandMetrics(metrics)
+_listener_installed = False
+
+
+def install(app, mongo):
+    """Time every request of `app` and count the commands `mongo`'s client runs for it."""
+    global _listener_installed
+    if not _listener_installed:
+        # Must be registered before the (lazy) client is created
+        mongo.add_listener(_listener)
+        _listener_installed = True
+
+    @app.before_request
+    def _start_timer():
+        metrics.start_request()
+
+    @app.after_request
+    def _stop_timer(response):
+        # Not yet: a streamed body runs its queries after this returns
+        status = response.status_code
+        response.call_on_close(lambda: metrics.finish_request(status))
+        return response
+
+    @app.teardown_request
+    def _abandon_timer(exc):
+        # Unhandled exception: after_request never ran
+        if exc is not None:
+            metrics.finish_request(500)
@@ -0,0 +1,188 @@
+"""
+Lazy, fork-safe MongoDB access.
+
+Nothing connects at import time. The MongoClient is created on first use
+in each process and recreated if the process id changes, so a client made
+in a gunicorn master (--preload) is never shared with forked workers.
+Module-level collection handles are proxies that resolve against the
+current process's client on every call.
+
+Pool settings (environment):
+    MONGO_URI
+    MONGO_DB_NAME                     (default "smarthealthconnect")
+    MONGO_MAX_POOL_SIZE               -> maxPoolSize
+    MONGO_MIN_POOL_SIZE               -> minPoolSize
+    MONGO_WAIT_QUEUE_TIMEOUT_MS       -> waitQueueTimeoutMS
+    MONGO_SERVER_SELECTION_TIMEOUT_MS -> serverSelectionTimeoutMS (default 5000)
+"""
+import os
+import threading
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.monitoring import ConnectionPoolListener
+
+_POOL_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+}
+
+
+def pool_options_from_env():
+    options = {'serverSelectionTimeoutMS': 5000}
+    for env_name, option in _POOL_OPTIONS.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = int(value)
+    return options
+
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters for this process (readiness / metrics)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checked_in = 0
+            self.checkout_failed = 0
+            self.pools_cleared = 0
+
+    def _inc(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def pool_cleared(self, event): self._inc('pools_cleared')
+    def connection_created(self, event): self._inc('created')
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): self._inc('closed')
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): self._inc('checkout_failed')
+    def connection_checked_out(self, event): self._inc('checked_out')
+    def connection_checked_in(self, event): self._inc('checked_in')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open": self.created - self.closed,
+                "inUse": self.checked_out - self.checked_in,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checked_out,
+                "checkoutFailures": self.checkout_failed,
+                "poolsCleared": self.pools_cleared,
+            }
+
+
+class Mongo:
+    def __init__(self, uri=None, db_name=None, **options):
+        self.uri = uri
+        self.db_name = db_name
+        self.options = options
+        self.pool_stats = PoolStats()
+        self.event_listeners = [self.pool_stats]
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    def configure(self, uri=None, db_name=None, **options):
+        """Settings for clients created from now on (call before first use)."""
+        with self._lock:
+            self.uri = uri
+            self.db_name = db_name
+            self.options = options
+            self._client = None
+
+    def add_listener(self, listener):
+        """Register a pymongo event listener for clients created from now on."""
+        self.event_listeners.append(listener)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                if not self.uri:
+                    raise RuntimeError("MONGO_URI is not configured")
+                # A client inherited through fork() is dropped, not closed:
+                # its sockets and monitor threads belong to the parent.
+                self.pool_stats.reset()
+                self._client = MongoClient(
+                    self.uri,
+                    connect=False, # first operation connects, not construction
+                    event_listeners=self.event_listeners,
+                    **self.options
+                )
+                self._pid = os.getpid()
+            return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def is_connected(self):
+        return self._client is not None and self._pid == os.getpid()
+
+    def reset(self):
+        """Forget the current client (gunicorn post_fork hook, tests)."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def lazy_db(self):
+        return LazyDatabase(self)
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection; resolves it per call in the current process."""
+
+    def __init__(self, mongo, name):
+        self._mongo = mongo
+        self.name = name
+
+    @property
+    def real(self):
+        return self._mongo.db[self.name]
+
+    def __getattr__(self, attr):
+        return getattr(self.real, attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+class LazyDatabase:
+    """Stands in for a pymongo Database: db.<name> / db[name] give LazyCollections."""
+
+    def __init__(self, mongo):
+        self._mongo = mongo
+
+    def __getitem__(self, name):
+        return LazyCollection(self._mongo, name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        # Database methods (command, list_collection_names, ...) run on the real database
+        if hasattr(Database, name):
+            return getattr(self._mongo.db, name)
+        return LazyCollection(self._mongo, name)
+
+
+mongo = Mongo(os.getenv('MONGO_URI'), os.getenv('MONGO_DB_NAME', 'smarthealthconnect'), **pool_options_from_env())
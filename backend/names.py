@@ -0,0 +1,196 @@
+"""
+Keeping denormalized doctor / student names current.
+
+Appointments, prescriptions and lab requests store doctorName and
+studentName so list routes can return them without lookups. Renames are
+pushed into those copies instead of being re-resolved on every read:
+
+  * The source record (staff_users for doctors, university_students for
+    students) carries nameVersion, bumped whenever the name actually
+    changes (versioned_set), nameSyncedVersion, the last version copied
+    out, and nameSyncPending: true while a rename hasn't been copied yet
+    (partial index, so finding pending renames never scans). New records
+    start in sync: nothing has copied their name yet.
+  * After a rename, a background thread runs one update_many per
+    denormalized collection, setting the new name together with
+    doctorNameVersion / studentNameVersion. The filter only matches
+    copies older than that version that hold a different name, so a slow
+    or repeated fan-out can never overwrite a newer name, and copies that
+    are already right (with or without a version) are left alone.
+  * Change versions (versions.py) of everyone whose records changed are
+    bumped, so their history ETags and caches move on.
+
+A fan-out lost to a crash, or a record written with a name read just
+before a rename (see app.stored_names), is caught by
+
+    python names.py reconcile          # sources with unsynced renames
+    python names.py reconcile --all    # every doctor and student
+
+The --all pass also runs once by itself on each database
+(ensure_reconciled), to fix names stored before the fan-out existed.
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from versions import student_key, doctor_key
+
+DENORMALIZED_COLLECTIONS = ("appointments", "prescriptions", "lab_requests")
+
+META_DOC_ID = "names"
+
+
+def versioned_set(fields):
+    """
+    Update pipeline: $set `fields` and bump nameVersion if "name" changes.
+
+    Values are wrapped in $literal so user input starting with "$" is
+    stored as text, not read as a field path.
+    """
+    stage = {k: {"$literal": v} for k, v in fields.items()}
+    if "name" in fields:
+        version = {"$ifNull": ["$nameVersion", 0]}
+        renamed = {"$ne": ["$name", {"$literal": fields["name"]}]}
+        new_version = {"$cond": [renamed, {"$add": [version, 1]}, version]}
+        # Upserted just now: no copies of the name exist yet
+        created = {"$eq": [{"$type": "$name"}, "missing"]}
+        stage["nameVersion"] = new_version
+        stage["nameSyncedVersion"] = {"$cond": [created, new_version, "$nameSyncedVersion"]}
+        stage["nameSyncPending"] = {"$cond": [created, "$$REMOVE", {"$cond": [renamed, True, "$nameSyncPending"]}]}
+    return [{"$set": stage}]
+
+
+def _mark_synced(version):
+    # Clear nameSyncPending unless another rename landed meanwhile
+    return [
+        {"$set": {"nameSyncedVersion": {"$max": [{"$ifNull": ["$nameSyncedVersion", 0]}, version]}}},
+        {"$set": {"nameSyncPending": {"$cond": [
+            {"$gt": [{"$ifNull": ["$nameVersion", 0]}, "$nameSyncedVersion"]}, True, "$$REMOVE"]}}},
+    ]
+
+
+class NameSync:
+    def __init__(self, db, change_versions, workers=1):
+        self.db = db
+        self.change_versions = change_versions
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    # --- fan-out ---
+
+    def _fan_out(self, id_field, ref_id, name_field, name, version, other_id_field):
+        """Copy `name` into every stale record referencing `ref_id`. Returns (modified, other ids)."""
+        stale = {id_field: ref_id, f"{name_field}Version": {"$not": {"$gte": version}}, name_field: {"$ne": name}}
+        modified = 0
+        others = set()
+        for coll_name in DENORMALIZED_COLLECTIONS:
+            collection = self.db[coll_name]
+            others.update(v for v in collection.distinct(other_id_field, stale) if v)
+            result = collection.update_many(stale, {"$set": {name_field: name, f"{name_field}Version": version}})
+            modified += result.modified_count
+        return modified, others
+
+    def sync_doctor(self, doctor):
+        """doctor: staff_users document (or its id). Returns the number of records updated."""
+        if not isinstance(doctor, dict):
+            doctor = self.db.staff_users.find_one({"_id": ObjectId(doctor)}, {"name": 1, "nameVersion": 1})
+        if not doctor or not doctor.get('name'):
+            return 0
+        version = doctor.get('nameVersion', 0)
+        doctor_id = str(doctor['_id'])
+        modified, student_ids = self._fan_out("doctorId", doctor_id, "doctorName", doctor['name'], version, "studentId")
+        self.db.staff_users.update_one({"_id": doctor['_id']}, _mark_synced(version))
+        if modified:
+            self.change_versions.bump(doctor_key(doctor_id), *[student_key(s) for s in student_ids])
+        return modified
+
+    def sync_student(self, student):
+        """student: university_students document (or its studentId). Returns the number of records updated."""
+        if not isinstance(student, dict):
+            student = self.db.university_students.find_one({"studentId": student}, {"studentId": 1, "name": 1, "nameVersion": 1})
+        if not student or not student.get('name'):
+            return 0
+        version = student.get('nameVersion', 0)
+        modified, doctor_ids = self._fan_out("studentId", student['studentId'], "studentName", student['name'], version, "doctorId")
+        self.db.university_students.update_one({"_id": student['_id']}, _mark_synced(version))
+        if modified:
+            self.change_versions.bump(student_key(student['studentId']), *[doctor_key(d) for d in doctor_ids])
+        return modified
+
+    def sync_pending(self, everyone=False):
+        """Fan out every unsynced rename (or every name, with everyone=True). Returns records updated."""
+        query = {} if everyone else {"nameSyncPending": True}
+        modified = 0
+        for doctor in self.db.staff_users.find(dict(query, role="doctor"), {"name": 1, "nameVersion": 1}):
+            modified += self.sync_doctor(doctor)
+        for student in self.db.university_students.find(query, {"studentId": 1, "name": 1, "nameVersion": 1}):
+            modified += self.sync_student(student)
+        return modified
+
+    def ensure_reconciled(self):
+        """
+        Run the full reconcile once per database, in the background: names
+        stored before the fan-out existed were only corrected on read.
+        """
+        try:
+            self.db.app_meta.insert_one({"_id": META_DOC_ID, "startedAt": datetime.now()})
+        except DuplicateKeyError:
+            return # done, or another worker is on it
+        self._get_executor().submit(self._reconcile_once)
+
+    def _reconcile_once(self):
+        try:
+            updated = self.sync_pending(everyone=True)
+        except Exception as e:
+            # Let the next worker start try again
+            self.db.app_meta.delete_one({"_id": META_DOC_ID})
+            print(f"[NAME SYNC FAILED] first reconcile: {e}")
+            return
+        self.db.app_meta.update_one({"_id": META_DOC_ID}, {"$set": {"reconciledAt": datetime.now(), "updated": updated}})
+        print(f"[NAME SYNC] first reconcile: {updated} records updated")
+
+    # --- background ---
+
+    def _get_executor(self):
+        with self._lock:
+            # Threads don't survive fork(); start a fresh pool in each worker
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='names')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[NAME SYNC FAILED] {fn.__name__}{args}: {e}")
+
+    def schedule_doctor(self, doctor_id):
+        self._get_executor().submit(self._run, self.sync_doctor, doctor_id)
+
+    def schedule_pending(self):
+        self._get_executor().submit(self._run, self.sync_pending)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from mongo import mongo
+    from versions import ChangeVersions
+
+    if not mongo.uri:
+        print("No MONGO_URI found")
+        exit(1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "reconcile":
+        sync = NameSync(mongo.db, ChangeVersions(mongo.db.change_versions))
+        updated = sync.sync_pending(everyone="--all" in sys.argv[2:])
+        print(f"Names reconciled: {updated} records updated")
+    else:
+        print(__doc__)
+        exit(1)
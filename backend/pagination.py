@@ -0,0 +1,99 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A page is requested with ?limit=N and continued with ?cursor=<token>, where
+the token is the opaque value returned as "nextCursor" on the previous page.
+The cursor holds the sort-key values of the last document returned, so the
+next page is an index seek to "everything after this row" plus a bounded
+read, no matter how deep the client has paged (no skip()).
+"""
+import os
+import base64
+from bson import json_util
+
+DEFAULT_PAGE_SIZE = int(os.getenv('PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '500'))
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+def page_params(args):
+    """Read limit/cursor from the query string. Returns None when the client didn't ask for paging."""
+    if 'limit' not in args and 'cursor' not in args:
+        return None
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise InvalidPageRequest("limit must be an integer")
+    if limit < 1:
+        raise InvalidPageRequest("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE), args.get('cursor') or None
+
+
+def with_id_tiebreak(sort):
+    """Append _id so the sort is a total order (needed for a stable keyset)."""
+    if any(key == "_id" for key, _ in sort):
+        return list(sort)
+    return list(sort) + [("_id", sort[-1][1] if sort else 1)]
+
+
+def encode_cursor(doc, sort):
+    values = [doc.get(key) for key, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, sort):
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        raise InvalidPageRequest("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise InvalidPageRequest("Invalid cursor")
+    return values
+
+
+def _after(key, direction, value):
+    # Conditions matching rows that sort strictly after `value` on `key`.
+    # Missing/null values sort lowest in Mongo, so they come last in DESC
+    # order and first in ASC order.
+    if direction < 0:
+        if value is None:
+            return []
+        if key == "_id":
+            return [{key: {"$lt": value}}]
+        return [{key: {"$lt": value}}, {key: None}]
+    if value is None:
+        return [{key: {"$ne": None}}]
+    return [{key: {"$gt": value}}]
+
+
+def keyset_filter(sort, values):
+    """Filter for rows after `values` in `sort` order: (k1 > v1) OR (k1 == v1 AND k2 > v2) OR ..."""
+    branches = []
+    for i, (key, direction) in enumerate(sort):
+        after = _after(key, direction, values[i])
+        if not after:
+            continue
+        clauses = [{k: values[j]} for j, (k, _) in enumerate(sort[:i])]
+        clauses.append(after[0] if len(after) == 1 else {"$or": after})
+        branches.append(clauses[0] if len(clauses) == 1 else {"$and": clauses})
+    return {"$or": branches} if branches else None
+
+
+def fetch_page(collection, query, sort, limit, cursor=None, projection=None):
+    """Returns (docs, next_cursor). next_cursor is None on the last page."""
+    sort = with_id_tiebreak(sort)
+    if cursor:
+        after = keyset_filter(sort, decode_cursor(cursor, sort))
+        if after is None:
+            return [], None
+        query = {"$and": [query, after]} if query else after
+
+    # Read one extra row to know whether there is a next page.
+    docs = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1], sort)
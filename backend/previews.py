@@ -0,0 +1,138 @@
+"""
+Preview images for lab report uploads.
+
+Report lists only need a small picture of each upload, not the full scan.
+After upload_lab_report stores a file, a background thread writes a
+downscaled JPEG next to it ("<stored file>.preview.jpg"):
+
+  * images (jpg/png/gif/bmp/webp/tiff) via Pillow
+  * PDFs: first page rasterized with poppler's pdftoppm
+
+/uploads/<filename>/preview serves the cached preview. If the background
+job hasn't run yet (or the file predates it), the route queues it and
+answers 202 with Retry-After instead of rendering on a request thread.
+Both tools are optional; without them there are simply no previews.
+
+Settings: PREVIEW_SIZE (longest edge in px, default 320),
+PREVIEW_WORKERS (background threads per process, default 1),
+PREVIEW_RETRY_AFTER (seconds clients wait before asking again, default 2).
+"""
+import os
+import shutil
+import threading
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError: # optional: image previews
+    Image = None
+
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', '320'))
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', '1'))
+PREVIEW_RETRY_AFTER = int(os.getenv('PREVIEW_RETRY_AFTER', '2'))
+PREVIEW_SUFFIX = '.preview.jpg'
+PDFTOPPM = shutil.which('pdftoppm')
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_queued = set()  # source paths waiting for / being rendered in this process
+_failed = set()  # source paths whose preview could not be rendered
+
+
+def preview_path(source_path):
+    return source_path + PREVIEW_SUFFIX
+
+
+def can_preview(source_path):
+    ext = os.path.splitext(source_path)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return Image is not None
+    if ext == '.pdf':
+        return PDFTOPPM is not None
+    return False
+
+
+def _image_preview(source_path, out_path):
+    with Image.open(source_path) as img:
+        # JPEG decoders can downscale while decoding; much cheaper for large scans
+        img.draft('RGB', (PREVIEW_SIZE, PREVIEW_SIZE))
+        img.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+        img.convert('RGB').save(out_path, 'JPEG', quality=80, optimize=True)
+
+
+def _pdf_preview(source_path, out_path):
+    out_base = out_path[:-len('.jpg')]
+    subprocess.run(
+        [PDFTOPPM, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(PREVIEW_SIZE), source_path, out_base],
+        check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def generate_preview(source_path):
+    """Write the preview for source_path if possible. Returns its path, or None."""
+    target = preview_path(source_path)
+    if os.path.exists(target):
+        return target
+    if not can_preview(source_path) or not os.path.isfile(source_path):
+        return None
+
+    # Render to a temp name and rename, so readers never see a half-written file
+    fd, tmp = tempfile.mkstemp(suffix='.jpg', dir=os.path.dirname(source_path))
+    os.close(fd)
+    try:
+        if os.path.splitext(source_path)[1].lower() == '.pdf':
+            _pdf_preview(source_path, tmp)
+        else:
+            _image_preview(source_path, tmp)
+        os.replace(tmp, target)
+        return target
+    except Exception as e:
+        print(f"[PREVIEW FAILED] {source_path}: {e}")
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        # Threads don't survive fork(); start a fresh pool in each worker
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix='preview')
+            _executor_pid = os.getpid()
+            _queued.clear() # the parent's jobs don't run here
+        return _executor
+
+
+def _generate_queued(source_path):
+    try:
+        if generate_preview(source_path) is None:
+            with _lock:
+                _failed.add(source_path)
+    finally:
+        with _lock:
+            _queued.discard(source_path)
+
+
+def schedule_preview(source_path):
+    """
+    Queue preview generation in the background. Returns False if the file
+    can't be previewed (unsupported, or rendering it already failed).
+    """
+    if not can_preview(source_path):
+        return False
+    executor = _get_executor()
+    with _lock:
+        if source_path in _failed:
+            return False
+        if source_path in _queued:
+            return True
+        _queued.add(source_path)
+    executor.submit(_generate_queued, source_path)
+    return True
@@ -0,0 +1,216 @@
+"""
+Daily rollup counters for the admin, pharmacy and lab dashboards.
+
+One small document per day in daily_stats ("_id": "YYYY-MM-DD") that the
+write routes keep current with $inc, so the stats routes add up O(days)
+documents instead of counting O(records):
+
+  counted on the day it happened
+    bookings, cancellations             appointments booked / cancelled
+    doctors.<doctorId>.bookings, .cancellations   (valid ObjectId ids only)
+    prescriptionsIssued                 all new prescriptions
+    prescriptionsPending                +1 new Pending, -1 when dispensed
+    prescriptionsDispensed
+    labRequests, labRequestsCompleted
+
+So the pending pharmacy queue is the sum of prescriptionsPending.
+
+The counters are approximate: they are updated after the record is
+written (a failure in between is logged, not retried), and deleting or
+editing records outside the app leaves them stale. Routes that need an
+exact answer count the records themselves. Run
+
+    python rollup.py rebuild
+
+to recompute them from history (it is also built automatically the first
+time the app starts against a database without one). The rebuild can run
+while the app is serving: it reads the current counters, counts history up
+to that moment, and applies the difference with $inc, so increments made
+while it runs are kept.
+"""
+import sys
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+
+META_DOC_ID = "daily_stats"
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def today_str(now=None):
+    return (now or datetime.now()).strftime(DAY_FORMAT)
+
+
+def doctor_field(doctor_id, name):
+    return f"doctors.{doctor_id}.{name}"
+
+
+def activity(name, doctor_id=None):
+    """
+    Fields for one booking/cancellation: the day's total and the doctor's
+    own count. doctor_id becomes part of a field path, so anything but an
+    ObjectId string only counts towards the total.
+    """
+    fields = {name: 1}
+    if isinstance(doctor_id, str) and ObjectId.is_valid(doctor_id):
+        fields[doctor_field(str(ObjectId(doctor_id)), name)] = 1
+    return fields
+
+
+class DailyStats:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def record(self, *entries):
+        """Apply (day, {field: delta}) entries; one round trip for all of them."""
+        changes = {}
+        for day, fields in entries:
+            for field, n in fields.items():
+                _add(changes, day, field, n)
+        ops = [
+            UpdateOne({"_id": day}, {"$inc": fields}, upsert=True)
+            for day, fields in changes.items() if day and fields
+        ]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+
+    def totals(self, fields, query=None):
+        """Sum `fields` over the days matching `query` (all days by default)."""
+        group = {"_id": None}
+        for field in fields:
+            group[field] = {"$sum": f"${field}"}
+        result = next(self.collection.aggregate([{"$match": query or {}}, {"$group": group}]), None)
+        return {field: (result or {}).get(field, 0) for field in fields}
+
+    def day(self, day):
+        return self.collection.find_one({"_id": day}) or {"_id": day}
+
+
+# --- Rebuild from history ---
+
+def _day_of(field, fallback="$_id"):
+    """Aggregation expression: the YYYY-MM-DD day of a datetime field (ObjectId time if absent)."""
+    return {"$dateToString": {"format": DAY_FORMAT, "date": {"$ifNull": [f"${field}", {"$toDate": fallback}]}}}
+
+
+def _add(counters, day, field, n):
+    if day and n:
+        fields = counters.setdefault(day, {})
+        fields[field] = fields.get(field, 0) + n
+
+
+def _count_by(collection, match, day_expr, extra_key=None):
+    key = {"day": day_expr}
+    if extra_key:
+        key["extra"] = extra_key
+    return collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": key, "n": {"$sum": 1}}},
+    ])
+
+
+def _created_before(cutoff, field="createdAt"):
+    """Records created before `cutoff` (by `field`, or the ObjectId time when it is absent)."""
+    oid = ObjectId.from_datetime(cutoff.astimezone(timezone.utc))
+    return {"$or": [{field: {"$lt": cutoff}}, {field: {"$exists": False}, "_id": {"$lt": oid}}]}
+
+
+def _done_before(cutoff, field):
+    """Changes made before `cutoff`; older records without `field` count as done."""
+    return {"$or": [{field: {"$lt": cutoff}}, {field: {"$exists": False}}]}
+
+
+def compute_from_history(db, cutoff):
+    """Counters as the write paths would have produced them for everything before `cutoff`."""
+    counters = {}
+
+    # Bookings have no timestamp; ObjectId creation time is the booking time
+    for row in _count_by(db.appointments, _created_before(cutoff), _day_of("createdAt"), "$doctorId"):
+        for field, n in activity("bookings", row['_id'].get('extra')).items():
+            _add(counters, row['_id']['day'], field, n * row['n'])
+    # Older cancellations have no cancelledAt; the appointment date stands in
+    cancel_day = {"$ifNull": [{"$dateToString": {"format": DAY_FORMAT, "date": "$cancelledAt"}}, "$date"]}
+    cancelled = {"$and": [{"status": "Cancelled"}, _done_before(cutoff, "cancelledAt")]}
+    for row in _count_by(db.appointments, cancelled, cancel_day, "$doctorId"):
+        for field, n in activity("cancellations", row['_id'].get('extra')).items():
+            _add(counters, row['_id']['day'], field, n * row['n'])
+
+    issued = _created_before(cutoff)
+    for row in _count_by(db.prescriptions, issued, _day_of("createdAt")):
+        _add(counters, row['_id']['day'], "prescriptionsIssued", row['n'])
+    # Dispensed ones netted out (+1 issued, -1 dispensed); only the queue at `cutoff` remains
+    pending = {"$and": [issued, {"$or": [{"status": "Pending"}, {"status": "Dispensed", "dispensedAt": {"$gte": cutoff}}]}]}
+    for row in _count_by(db.prescriptions, pending, _day_of("createdAt")):
+        _add(counters, row['_id']['day'], "prescriptionsPending", row['n'])
+    dispensed = {"$and": [{"status": "Dispensed"}, _done_before(cutoff, "dispensedAt")]}
+    for row in _count_by(db.prescriptions, dispensed, "$dispensedDate"):
+        _add(counters, row['_id']['day'], "prescriptionsDispensed", row['n'])
+
+    for row in _count_by(db.lab_requests, _created_before(cutoff), _day_of("createdAt")):
+        _add(counters, row['_id']['day'], "labRequests", row['n'])
+    completed = {"$and": [{"status": "Completed"}, _done_before(cutoff, "completedAt")]}
+    for row in _count_by(db.lab_requests, completed, _day_of("completedAt")):
+        _add(counters, row['_id']['day'], "labRequestsCompleted", row['n'])
+
+    return counters
+
+
+def _flatten(doc, prefix=""):
+    """{"doctors": {"x": {"bookings": 1}}} -> {"doctors.x.bookings": 1} (counters only)."""
+    fields = {}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            fields.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            fields[prefix + key] = value
+    return fields
+
+
+def rebuild(db):
+    """
+    Recompute daily_stats from history. Returns the number of days.
+
+    The current counters are read first and history is counted up to that
+    moment; each day then gets $inc of the difference, so increments that
+    routes make in the meantime land on top instead of being overwritten.
+    """
+    current = {doc.pop("_id"): _flatten(doc) for doc in db.daily_stats.find()}
+    cutoff = datetime.now()
+    counters = compute_from_history(db, cutoff)
+
+    ops = []
+    for day in sorted(set(current) | set(counters)):
+        old, new = current.get(day, {}), counters.get(day, {})
+        delta = {field: new.get(field, 0) - old.get(field, 0) for field in set(old) | set(new)}
+        delta = {field: n for field, n in delta.items() if n}
+        if delta:
+            ops.append(UpdateOne({"_id": day}, {"$inc": delta}, upsert=True))
+    if ops:
+        db.daily_stats.bulk_write(ops, ordered=False)
+    db.app_meta.update_one({"_id": META_DOC_ID}, {"$set": {"builtAt": datetime.now(), "days": len(counters)}}, upsert=True)
+    return len(counters)
+
+
+def ensure_built(db):
+    """Build the rollup once for a database that doesn't have one yet."""
+    if db.app_meta.find_one({"_id": META_DOC_ID}) is None:
+        days = rebuild(db)
+        print(f"[ROLLUP] daily_stats built from history ({days} days)")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from mongo import mongo
+
+    if not mongo.uri:
+        print("No MONGO_URI found")
+        exit(1)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild":
+        print(f"daily_stats rebuilt: {rebuild(mongo.db)} days")
+    else:
+        print(__doc__)
+        exit(1)
@@ -0,0 +1,89 @@
+"""
+Bulk import for the university roster CSV (studentId, name, phone).
+
+The upload is parsed as a stream and written with unordered bulk_write
+batches of UpdateOne upserts, so a 40k-row semester roster is a few dozen
+round trips instead of 40k, and memory stays at one batch.
+"""
+import os
+import csv
+import codecs
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from names import versioned_set
+
+ROSTER_BATCH_SIZE = int(os.getenv('ROSTER_BATCH_SIZE', '1000'))
+
+
+def read_roster_rows(binary_stream):
+    """Iterate CSV rows from an uploaded file without reading it all into memory."""
+    text = codecs.getreader('utf-8-sig')(binary_stream)
+    return csv.DictReader(text)
+
+
+def _flush(collection, batch_no, ops, row_refs, errors):
+    """Write one batch. Returns the number of rows that were written."""
+    if not ops:
+        return 0
+    try:
+        collection.bulk_write(ops, ordered=False)
+        return len(ops)
+    except BulkWriteError as bwe:
+        write_errors = bwe.details.get('writeErrors', [])
+        for err in write_errors:
+            line_no, s_id = row_refs[err['index']]
+            errors.append(f"Batch {batch_no}: row {line_no} (studentId {s_id}): {err.get('errmsg')}")
+        return len(ops) - len(write_errors)
+
+
+def import_roster(collection, rows, batch_size=ROSTER_BATCH_SIZE):
+    """
+    Upsert roster rows by studentId.
+
+    Returns {"count", "errors", "batches", "seconds", "rowsPerSecond"}.
+    """
+    count = 0
+    errors = []
+    batches = 0
+    ops, row_refs = [], []
+    started = time.perf_counter()
+
+    # Row numbers are CSV line numbers (header is line 1)
+    for line_no, row in enumerate(rows, start=2):
+        # Expecting headers: studentId, name, phone
+        s_id = row.get('studentId')
+        name = row.get('name')
+        phone = row.get('phone')
+
+        if not (s_id and name and phone):
+            errors.append(f"Skipped row: {row}")
+            continue
+
+        # Update if exists, Insert if new (Upsert); a changed name bumps
+        # nameVersion so the rename reaches denormalized copies (names.py)
+        ops.append(UpdateOne(
+            {"studentId": s_id},
+            versioned_set({"name": name, "registeredPhone": phone, "updatedAt": datetime.now()}),
+            upsert=True
+        ))
+        row_refs.append((line_no, s_id))
+
+        if len(ops) >= batch_size:
+            batches += 1
+            count += _flush(collection, batches, ops, row_refs, errors)
+            ops, row_refs = [], []
+
+    if ops:
+        batches += 1
+        count += _flush(collection, batches, ops, row_refs, errors)
+
+    seconds = time.perf_counter() - started
+    return {
+        "count": count,
+        "errors": errors,
+        "batches": batches,
+        "seconds": round(seconds, 3),
+        "rowsPerSecond": round(count / seconds, 1) if seconds > 0 else count,
+    }
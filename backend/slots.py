@@ -0,0 +1,130 @@
+"""
+Per-doctor, per-day slot bitmaps.
+
+A day is 96 quarter-hour buckets; bit b of an int stands for the slot that
+starts in bucket b (minutes b*15 .. b*15+14). A doctor's bookable day is
+the bitmap of their morning + evening sessions, booked slots are a second
+bitmap, and "what is free" is one AND-NOT instead of a list scan.
+"""
+from functools import lru_cache
+
+SLOT_MINUTES = 15
+MINUTES_PER_DAY = 24 * 60
+
+DEFAULT_SESSIONS = {
+    "morningStart": "09:00",
+    "morningEnd": "13:00",
+    "eveningStart": "17:00",
+    "eveningEnd": "21:00",
+}
+
+
+def to_minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def to_hhmm(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+@lru_cache(maxsize=1024)
+def day_template(morning_start, morning_end, evening_start, evening_end):
+    """
+    Bitmap of the slots a doctor offers, plus bucket -> slot start minute.
+
+    Slots step 15 minutes from each session start up to (not including) the
+    session end, like the old generate_slots(); a session that doesn't start
+    on a quarter hour still maps one slot per bucket.
+    """
+    mask = 0
+    starts = {}
+    for start, end in ((morning_start, morning_end), (evening_start, evening_end)):
+        t, end_min = to_minutes(start), min(to_minutes(end), MINUTES_PER_DAY)
+        while t < end_min:
+            bucket = t // SLOT_MINUTES
+            mask |= 1 << bucket
+            starts[bucket] = t
+            t += SLOT_MINUTES
+    return mask, starts
+
+
+def doctor_template(doctor):
+    return day_template(*(doctor.get(k) or v for k, v in DEFAULT_SESSIONS.items()))
+
+
+def booked_mask(times, starts):
+    """Bitmap of booked slot times; times that aren't one of the doctor's slots are ignored."""
+    mask = 0
+    for time in times:
+        try:
+            minutes = to_minutes(time)
+        except (ValueError, AttributeError):
+            continue
+        bucket = minutes // SLOT_MINUTES
+        if starts.get(bucket) == minutes:
+            mask |= 1 << bucket
+    return mask
+
+
+def iter_buckets(mask):
+    """Set bits of mask in ascending (chronological) order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def free_mask(doctor, date_str, booked_times, not_after_minutes=None):
+    """
+    Free-slot bitmap for one doctor on one date, and the bucket -> minute map.
+
+    not_after_minutes drops slots starting at or before that minute (used
+    for "today" so already-passed slots aren't offered).
+    """
+    if date_str in (doctor.get('unavailableDates') or []):
+        return 0, {}
+    mask, starts = doctor_template(doctor)
+    mask &= ~booked_mask(booked_times, starts)
+    if not_after_minutes is not None:
+        cutoff = not_after_minutes // SLOT_MINUTES
+        mask &= ~((1 << cutoff) - 1)
+        if mask >> cutoff & 1 and starts[cutoff] <= not_after_minutes:
+            mask &= ~(1 << cutoff)
+    return mask, starts
+
+
+def slot_times(mask, starts):
+    return [to_hhmm(starts[b]) for b in iter_buckets(mask)]
+
+
+def first_free_slots(doctors, dates, booked, limit, now_date=None, now_minutes=None):
+    """
+    First `limit` free slots across `doctors` over `dates` (ascending "YYYY-MM-DD").
+
+    booked maps (doctorId, date) -> list of booked times. Results are in
+    chronological order; doctors free at the same time keep the given order.
+    """
+    results = []
+    for date_str in dates:
+        cutoff = now_minutes if date_str == now_date else None
+        per_doctor = []
+        union = 0
+        for doctor in doctors:
+            mask, starts = free_mask(doctor, date_str, booked.get((doctor['id'], date_str), ()), cutoff)
+            if mask:
+                per_doctor.append((doctor, mask, starts))
+                union |= mask
+        for bucket in iter_buckets(union):
+            for doctor, mask, starts in per_doctor:
+                if mask >> bucket & 1:
+                    results.append({
+                        "date": date_str,
+                        "time": to_hhmm(starts[bucket]),
+                        "doctorId": doctor['id'],
+                        "doctorName": doctor.get('name'),
+                        "specialization": doctor.get('specialization', 'General Physician')
+                    })
+                    if len(results) >= limit:
+                        return results
+    return results
@@ -0,0 +1,317 @@
+"""
+Slow-query log with explain plans.
+
+A pymongo CommandListener watches every find / aggregate / count /
+distinct / findAndModify the app runs. When one takes longer than
+SLOW_QUERY_MS, its filter, sort and projection (or pipeline) are handed to
+a background thread, which re-runs the command under
+explain("executionStats") and stores a plan summary in the capped
+slow_queries collection:
+
+    {"at", "durationMs", "endpoint", "collection", "command", "shape",
+     "filter", "sort", "projection", "pipeline",
+     "plan": {"summary": "IXSCAN status_date_id" | "COLLSCAN" | ...,
+              "stages", "indexes", "collscan", "blockingSort"},
+     "docsExamined", "keysExamined", "nReturned"}
+
+"shape" is the command with every literal replaced by "?", so
+{"status": "Pending"} and {"status": "Dispensed"} group together in
+GET /api/admin/slow-queries (see slow_query_report).
+
+Explain runs the query a second time, so each shape is explained at most
+once per SLOW_QUERY_EXPLAIN_INTERVAL seconds; slow runs in between are
+logged with the last plan seen. Commands are dropped rather than queued
+when SLOW_QUERY_MAX_PENDING explains are already waiting. SLOW_QUERY_MS=0
+turns the log off.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from bson import json_util
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '60'))
+SLOW_QUERY_MAX_PENDING = int(os.getenv('SLOW_QUERY_MAX_PENDING', '100'))
+SLOW_QUERY_LOG_BYTES = int(os.getenv('SLOW_QUERY_LOG_BYTES', str(16 * 1024 * 1024)))
+
+SLOW_QUERIES = "slow_queries"
+
+# command -> fields worth keeping (and re-sending to explain)
+EXPLAINABLE = {
+    "find": ("filter", "sort", "projection", "limit", "skip", "hint", "collation"),
+    "aggregate": ("pipeline", "hint", "collation"),
+    "count": ("query", "limit", "skip", "hint", "collation"),
+    "distinct": ("key", "query", "collation"),
+    "findAndModify": ("query", "sort", "fields", "update", "remove", "new", "upsert", "collation"),
+}
+
+_SKIPPED_DATABASES = ("admin", "config", "local")
+
+
+def query_shape(value):
+    """`value` with every literal replaced by "?" (operators and field names kept)."""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if any(isinstance(v, dict) for v in value):
+            return [query_shape(v) for v in value] # $and / $or branches, pipeline stages
+        return "?"
+    return "?"
+
+
+def _shape_key(command_name, collection, fields):
+    if command_name == "find":
+        # Sort directions and projected fields are part of the shape, not literals
+        shape = {"filter": query_shape(fields.get("filter", {})), "sort": fields.get("sort"), "projection": fields.get("projection")}
+    elif command_name == "aggregate":
+        shape = {"pipeline": query_shape(fields.get("pipeline", []))}
+    elif command_name == "findAndModify":
+        shape = {"query": query_shape(fields.get("query", {})), "sort": fields.get("sort")}
+    else:
+        shape = {k: query_shape(v) for k, v in fields.items() if k in ("key", "query")}
+    return f"{collection}.{command_name} {json_util.dumps(shape, sort_keys=False)}"
+
+
+def _walk_plan(stage, stages, indexes):
+    if not isinstance(stage, dict):
+        return
+    name = stage.get("stage")
+    if name:
+        stages.append(name)
+        if stage.get("indexName"):
+            indexes.append(stage["indexName"])
+    for child in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        _walk_plan(stage.get(child), stages, indexes)
+    for child in stage.get("inputStages", ()):
+        _walk_plan(child, stages, indexes)
+
+
+def _find_section(explain, key):
+    """First `key` sub-document anywhere in an explain result (aggregate nests them under stages / $cursor)."""
+    if isinstance(explain, dict):
+        if isinstance(explain.get(key), dict):
+            return explain[key]
+        children = explain.values()
+    elif isinstance(explain, list):
+        children = explain
+    else:
+        return None
+    for child in children:
+        found = _find_section(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def summarize_explain(explain):
+    """Plan type, indexes used and examined / returned counts from an explain("executionStats") result."""
+    planner = _find_section(explain, "queryPlanner") or {}
+    stats = _find_section(explain, "executionStats") or {}
+    stages, indexes = [], []
+    _walk_plan(planner.get("winningPlan"), stages, indexes)
+
+    if "COLLSCAN" in stages:
+        summary = "COLLSCAN"
+    elif indexes:
+        summary = "IXSCAN " + ", ".join(dict.fromkeys(indexes))
+    else:
+        summary = stages[-1] if stages else "UNKNOWN"
+    return {
+        "plan": {
+            "summary": summary,
+            "stages": stages,
+            "indexes": list(dict.fromkeys(indexes)),
+            "collscan": "COLLSCAN" in stages,
+            "blockingSort": "SORT" in stages, # sorted in memory, no index for the sort
+        },
+        "docsExamined": stats.get("totalDocsExamined"),
+        "keysExamined": stats.get("totalKeysExamined"),
+        "nReturned": stats.get("nReturned"),
+    }
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self, mongo, threshold_ms=SLOW_QUERY_MS, endpoint=None):
+        self.mongo = mongo
+        self.threshold_ms = threshold_ms
+        self.endpoint = endpoint or (lambda: None)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._explained = {} # shape -> (monotonic time, plan summary)
+        self._collection_ready = None # pid that created / found the capped collection
+        self.logged = 0
+        self.dropped = 0
+
+    # --- listener (runs in the thread issuing the command) ---
+
+    def _started_commands(self):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            started = self._local.started = {}
+        return started
+
+    def started(self, event):
+        fields = EXPLAINABLE.get(event.command_name)
+        if fields is None or event.database_name in _SKIPPED_DATABASES:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str) or collection == SLOW_QUERIES:
+            return
+        kept = {k: command[k] for k in fields if k in command}
+        if event.command_name == "aggregate" and any("$out" in s or "$merge" in s for s in kept.get("pipeline", ())):
+            return # explain would not run the write; nothing useful to compare
+        self._started_commands()[(event.connection_id, event.request_id)] = (
+            event.database_name, collection, kept, self.endpoint())
+
+    def succeeded(self, event):
+        started = self._started_commands().pop((event.connection_id, event.request_id), None)
+        if started is None or event.duration_micros < self.threshold_ms * 1000:
+            return
+        database_name, collection, fields, endpoint = started
+        self._submit(event.command_name, database_name, collection, fields, endpoint, event.duration_micros / 1000)
+
+    def failed(self, event):
+        self._started_commands().pop((event.connection_id, event.request_id), None)
+
+    # --- background ---
+
+    def _get_executor(self):
+        # Threads don't survive fork(); start a fresh pool in each worker
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-queries')
+            self._pid = os.getpid()
+            self._pending = 0
+            self._explained = {}
+        return self._executor
+
+    def _submit(self, command_name, database_name, collection, fields, endpoint, duration_ms):
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= SLOW_QUERY_MAX_PENDING:
+                self.dropped += 1
+                return
+            self._pending += 1
+        executor.submit(self._record, command_name, database_name, collection, fields, endpoint, duration_ms, datetime.now())
+
+    def _explain(self, database, command_name, collection, fields):
+        command = {command_name: collection, **fields}
+        if command_name == "aggregate":
+            command["cursor"] = {}
+        return database.command("explain", command, verbosity="executionStats")
+
+    def _ensure_collection(self, database):
+        if self._collection_ready == os.getpid():
+            return
+        try:
+            database.create_collection(SLOW_QUERIES, capped=True, size=SLOW_QUERY_LOG_BYTES)
+        except CollectionInvalid:
+            pass # already there
+        except OperationFailure as e:
+            if e.code != 48: # NamespaceExists: another worker created it first
+                raise
+        self._collection_ready = os.getpid()
+
+    def _record(self, command_name, database_name, collection, fields, endpoint, duration_ms, at):
+        try:
+            database = self.mongo.client[database_name]
+            shape = _shape_key(command_name, collection, fields)
+
+            now = time.monotonic()
+            last = self._explained.get(shape)
+            if last is not None and now - last[0] < SLOW_QUERY_EXPLAIN_INTERVAL:
+                summary = last[1]
+            else:
+                summary = summarize_explain(self._explain(database, command_name, collection, fields))
+                self._explained[shape] = (now, summary)
+
+            doc = {
+                "at": at,
+                "durationMs": round(duration_ms, 3),
+                "endpoint": endpoint,
+                "collection": collection,
+                "command": command_name,
+                "shape": shape,
+                **summary,
+            }
+            # Stored as extended JSON text: filters and pipelines hold "$" keys
+            for source, target in (("filter", "filter"), ("query", "filter"), ("sort", "sort"),
+                                   ("projection", "projection"), ("fields", "projection"), ("pipeline", "pipeline")):
+                if source in fields:
+                    doc[target] = json_util.dumps(fields[source])
+
+            self._ensure_collection(database)
+            database[SLOW_QUERIES].insert_one(doc)
+            self.logged += 1
+        except PyMongoError as e:
+            print(f"[SLOW QUERY LOG FAILED] {collection}.{command_name}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        return {"thresholdMs": self.threshold_ms, "logged": self.logged, "dropped": self.dropped, "pending": self._pending}
+
+
+def slow_query_report(db, hours=24, limit=50):
+    """slow_queries grouped by shape, worst total time first."""
+    since = datetime.now() - timedelta(hours=hours)
+    pipeline = [
+        {"$match": {"at": {"$gte": since}}},
+        {"$sort": {"at": 1}}, # so $last picks the newest plan
+        {"$group": {
+            "_id": "$shape",
+            "collection": {"$first": "$collection"},
+            "command": {"$first": "$command"},
+            "endpoints": {"$addToSet": "$endpoint"},
+            "count": {"$sum": 1},
+            "totalMs": {"$sum": "$durationMs"},
+            "avgMs": {"$avg": "$durationMs"},
+            "maxMs": {"$max": "$durationMs"},
+            "plan": {"$last": "$plan"},
+            "collscans": {"$sum": {"$cond": ["$plan.collscan", 1, 0]}},
+            "avgDocsExamined": {"$avg": "$docsExamined"},
+            "avgKeysExamined": {"$avg": "$keysExamined"},
+            "avgReturned": {"$avg": "$nReturned"},
+            "lastSeen": {"$last": "$at"},
+            "example": {"$last": {"filter": "$filter", "sort": "$sort", "projection": "$projection", "pipeline": "$pipeline"}},
+        }},
+        {"$set": {
+            "shape": "$_id",
+            # How many documents were read for each one returned; ~1 is ideal
+            "examinedPerReturned": {"$cond": [
+                {"$gt": ["$avgReturned", 0]},
+                {"$divide": [{"$ifNull": ["$avgDocsExamined", 0]}, "$avgReturned"]},
+                None,
+            ]},
+        }},
+        {"$unset": "_id"},
+        {"$sort": {"totalMs": -1}},
+        {"$limit": limit},
+    ]
+    return list(db[SLOW_QUERIES].aggregate(pipeline))
+
+
+_log = None
+
+
+def install(mongo, endpoint=None):
+    """Start logging slow commands from `mongo`'s client. Returns the SlowQueryLog, or None when disabled."""
+    global _log
+    if _log is None and SLOW_QUERY_MS > 0:
+        _log = SlowQueryLog(mongo, endpoint=endpoint)
+        # Must be registered before the (lazy) client is created
+        mongo.add_listener(_log)
+    return _log
+
+
+def log_stats():
+    """Counters of this worker's slow-query log (None when disabled)."""
+    return _log.stats() if _log is not None else None
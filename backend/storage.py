@@ -0,0 +1,143 @@
+"""
+Content-addressed storage for lab report uploads.
+
+Uploads are streamed to a temp file in chunks while being SHA-256 hashed,
+then moved to a two-level fan-out under the upload folder:
+
+    uploads/ab/cd/abcd1234...<64 hex>.pdf
+
+so no directory grows past a few hundred entries. Identical content is
+stored once; lab_files keeps a reference count per stored file (one per
+lab report pointing at it). Lab reports are never deleted today, so the
+counts only go up: they record how many reports share each file, for a
+future cleanup, and nothing reclaims files yet. Files uploaded before this
+scheme, named "<timestamp>_<name>" directly in uploads/, are still served
+from there.
+
+send_upload() serves either kind with Range support, a strong ETag and
+immutable caching (stored names never change content). With
+UPLOADS_SENDFILE=x-accel (nginx) or x-sendfile (Apache/lighttpd) the
+worker only checks the file exists and the front proxy sends the bytes.
+"""
+import os
+import re
+import hashlib
+import tempfile
+import mimetypes
+from datetime import datetime
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Proxy offload for /uploads: "" (Flask sends the file), "x-accel" or "x-sendfile"
+UPLOADS_SENDFILE = os.getenv('UPLOADS_SENDFILE', '').lower()
+# nginx "internal" location that maps to the upload folder (used with x-accel)
+UPLOADS_ACCEL_PREFIX = os.getenv('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+# Stored files are never rewritten in place, so the browser may cache them
+# forever; "private" because they are medical records that shared caches
+# (proxies, CDNs) must not keep
+UPLOADS_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# "<sha256 hex>" + optional extension, e.g. "9f86d0...0a08.pdf"
+HASHED_NAME = re.compile(r'^([0-9a-f]{64})(\.[A-Za-z0-9]{1,10})?$')
+
+
+def shard_relpath(stored_name):
+    """Path of a hashed file relative to the upload folder, e.g. 'ab/cd/abcd...pdf'."""
+    return f"{stored_name[0:2]}/{stored_name[2:4]}/{stored_name}"
+
+
+def upload_relpath(filename):
+    """Where a stored filename lives: sharded for hashed names, flat for legacy ones."""
+    if HASHED_NAME.match(filename):
+        return shard_relpath(filename)
+    return filename
+
+
+def _extension(original_name):
+    ext = os.path.splitext(secure_filename(original_name or ''))[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,10}', ext) else ''
+
+
+def store_upload(file_storage, upload_folder, files_collection):
+    """
+    Save an uploaded FileStorage under its content hash and take a reference on it.
+
+    Returns {"filename", "contentHash", "size", "deduplicated"}.
+    """
+    tmp_dir = os.path.join(upload_folder, '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        content_hash = digest.hexdigest()
+        stored_name = content_hash + _extension(file_storage.filename)
+        final_path = os.path.join(upload_folder, shard_relpath(stored_name))
+
+        # Reference first, file second: if Mongo fails nothing is left on
+        # disk without a record (the temp file is removed below)
+        files_collection.update_one(
+            {"_id": stored_name},
+            {"$inc": {"refCount": 1},
+             "$setOnInsert": {"contentHash": content_hash, "size": size, "createdAt": datetime.now()}},
+            upsert=True
+        )
+        deduplicated = os.path.exists(final_path)
+        try:
+            if deduplicated:
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+        except OSError:
+            files_collection.update_one({"_id": stored_name}, {"$inc": {"refCount": -1}})
+            raise
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {"filename": stored_name, "contentHash": content_hash, "size": size, "deduplicated": deduplicated}
+
+
+def upload_path(upload_folder, filename):
+    """Absolute path of a stored upload, or None if the name escapes the upload folder."""
+    return safe_join(upload_folder, upload_relpath(filename))
+
+
+def send_upload(upload_folder, filename):
+    relpath = upload_relpath(filename)
+    path = safe_join(upload_folder, relpath)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    hashed = HASHED_NAME.match(filename)
+    if UPLOADS_SENDFILE in ('x-accel', 'x-sendfile'):
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        if UPLOADS_SENDFILE == 'x-accel':
+            response.headers['X-Accel-Redirect'] = UPLOADS_ACCEL_PREFIX.rstrip('/') + '/' + relpath
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        if hashed:
+            response.set_etag(hashed.group(1))
+    else:
+        # conditional=True gives Range / If-Range / If-None-Match handling;
+        # hashed files use their content hash as the (strong) ETag.
+        response = send_file(path, conditional=True, etag=hashed.group(1) if hashed else True)
+    response.headers['Cache-Control'] = UPLOADS_CACHE_CONTROL
+    return response
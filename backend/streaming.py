@@ -0,0 +1,48 @@
+"""
+Streaming JSON array responses.
+
+Serializes documents straight from a PyMongo cursor as they arrive, one
+cursor batch at a time, instead of building the whole list and calling
+jsonify. Worker memory stays at roughly one batch and the first bytes go
+out as soon as the first batch is read.
+"""
+import os
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+MAX_STREAM_BATCH_SIZE = 10000
+
+
+def stream_batch_size(args):
+    try:
+        size = int(args.get('batchSize', STREAM_BATCH_SIZE))
+    except ValueError:
+        size = STREAM_BATCH_SIZE
+    return max(1, min(size, MAX_STREAM_BATCH_SIZE))
+
+
+def _batches(cursor, size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_json_array(cursor, dumps, batch_size=STREAM_BATCH_SIZE):
+    """
+    Yield a JSON array chunk by chunk.
+
+    `dumps` serializes a list of documents.
+    """
+    cursor = cursor.batch_size(batch_size)
+    first = True
+    yield "["
+    for batch in _batches(cursor, batch_size):
+        # One encoder call per batch; strip the list's brackets
+        chunk = dumps(batch)[1:-1]
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]"
@@ -0,0 +1,115 @@
+"""
+Shared fixtures. Database tests run against a real, disposable MongoDB:
+
+    MONGO_TEST_URI=mongodb://localhost:27017 python -m pytest tests
+
+Without MONGO_TEST_URI a throwaway mongod is started on a temp directory
+if one is on PATH; otherwise those tests are skipped. The tests clear the
+collections they use, so never point MONGO_TEST_URI at real data.
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import contextlib
+import pytest
+from pymongo import MongoClient, monitoring
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND)
+
+TEST_DB_NAME = 'smarthealthconnect_test'
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Names of the commands the calling thread sends inside counting() (other threads are ignored)."""
+
+    def __init__(self):
+        self._thread = None
+        self.commands = []
+
+    @contextlib.contextmanager
+    def counting(self):
+        self.commands = []
+        self._thread = threading.get_ident()
+        try:
+            yield self
+        finally:
+            self._thread = None
+
+    def started(self, event):
+        if self._thread == threading.get_ident():
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Registered globally, before app.py creates its client, so it sees every command
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def mongo_uri():
+    uri = os.getenv('MONGO_TEST_URI')
+    if uri:
+        yield uri
+        return
+    binary = shutil.which('mongod')
+    if not binary:
+        pytest.skip("no MongoDB: set MONGO_TEST_URI or put mongod on PATH")
+    dbpath = tempfile.mkdtemp(prefix='test-mongod-')
+    port = _free_port()
+    proc = subprocess.Popen([binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    uri = f"mongodb://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                MongoClient(uri, serverSelectionTimeoutMS=500).admin.command('ping')
+                break
+            except Exception:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    pytest.skip(f"mongod did not start ({binary})")
+                time.sleep(0.2)
+        yield uri
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@pytest.fixture
+def test_db(mongo_uri):
+    """An empty database on the test server, dropped afterwards."""
+    client = MongoClient(mongo_uri)
+    client.drop_database(TEST_DB_NAME)
+    yield client[TEST_DB_NAME]
+    client.drop_database(TEST_DB_NAME)
+    client.close()
+
+
+@pytest.fixture
+def app_module(mongo_uri):
+    """app.py imported against the test server, with its collections emptied."""
+    os.environ['MONGO_URI'] = mongo_uri
+    os.environ['MONGO_DB_NAME'] = TEST_DB_NAME
+    import app
+    for name in ('appointments', 'staff_users', 'university_students'):
+        app.db[name].delete_many({})
+    return app
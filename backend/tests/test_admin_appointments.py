@@ -0,0 +1,60 @@
+"""
+GET /api/admin/appointments must cost the same number of database commands
+however many rows it returns (it used to run two find_one per row).
+"""
+from datetime import date, timedelta
+from bson import ObjectId
+from conftest import command_counter
+
+DOCTORS = [ObjectId() for _ in range(7)]
+
+
+def seed(db, start, n):
+    db.staff_users.insert_many([{"_id": d, "name": f"Doctor {i}", "role": "doctor"}
+                                for i, d in enumerate(DOCTORS) if not db.staff_users.find_one({"_id": d})])
+    db.university_students.insert_many([{"studentId": f"S{i:05d}", "name": f"Student {i}"} for i in range(start, start + n)])
+    first_day = date(2024, 1, 1)
+    db.appointments.insert_many([{
+        "studentId": f"S{i:05d}",
+        "doctorId": str(DOCTORS[i % len(DOCTORS)]),
+        "studentName": f"Student {i}",
+        "doctorName": f"Doctor {i % len(DOCTORS)}",
+        "date": (first_day + timedelta(days=i // 20)).isoformat(),
+        "time": f"{9 + i % 8:02d}:{(i % 4) * 15:02d}",
+        "reason": "Checkup",
+        "status": "Scheduled",
+    } for i in range(start, start + n)])
+
+
+def list_appointments(client):
+    with command_counter.counting():
+        response = client.get('/api/admin/appointments')
+    assert response.status_code == 200
+    # getMore only continues the same cursor (further batches of one result set)
+    return response.get_json(), [c for c in command_counter.commands if c != 'getMore']
+
+
+def test_command_count_does_not_grow_with_rows(app_module):
+    client = app_module.app.test_client()
+    client.get('/api/admin/appointments') # first-request setup, if any, is not counted
+
+    seed(app_module.db, 0, 10)
+    small, small_commands = list_appointments(client)
+
+    seed(app_module.db, 10, 990)
+    large, large_commands = list_appointments(client)
+
+    assert len(small) == 10
+    assert len(large) == 1000
+    assert small_commands == large_commands
+    assert len(large_commands) <= 3
+
+
+def test_rows_carry_names(app_module):
+    client = app_module.app.test_client()
+    seed(app_module.db, 0, 3)
+
+    rows, _ = list_appointments(client)
+
+    assert sorted(row["studentName"] for row in rows) == ["Student 0", "Student 1", "Student 2"]
+    assert {row["doctorName"] for row in rows} == {"Doctor 0", "Doctor 1", "Doctor 2"}
@@ -0,0 +1,85 @@
+"""
+Roster CSV import (roster.import_roster): streamed rows, unordered
+bulk_write batches, per-row errors, and throughput in rows per second,
+the number to watch when changing the import.
+
+The batching / error-format tests use a recording collection and run
+anywhere; the throughput test needs the test MongoDB (see conftest.py).
+"""
+import io
+import os
+import pytest
+from pymongo.errors import BulkWriteError
+from roster import import_roster, read_roster_rows
+
+THROUGHPUT_ROWS = int(os.getenv('ROSTER_TEST_ROWS', '20000'))
+# Opt-in floor (rows/s) for dedicated benchmark machines; off by default
+MIN_ROWS_PER_SECOND = float(os.getenv('ROSTER_MIN_ROWS_PER_SECOND', '0'))
+
+
+def roster_csv(rows):
+    lines = ["studentId,name,phone"] + [",".join(row) for row in rows]
+    return io.BytesIO("\n".join(lines).encode('utf-8'))
+
+
+def students(n):
+    return [(f"S{i:06d}", f"Student {i}", f"05{i:08d}") for i in range(n)]
+
+
+class RecordingCollection:
+    """Keeps each bulk_write batch; rejects rows whose studentId is in `reject`, like a server-side write error."""
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.batches = []
+
+    def bulk_write(self, ops, ordered=True):
+        assert ordered is False
+        self.batches.append(ops)
+        errors = [{"index": i, "code": 121, "errmsg": "Document failed validation"}
+                  for i, op in enumerate(ops) if op._filter["studentId"] in self.reject]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nUpserted": len(ops) - len(errors)})
+
+
+def test_rows_are_written_in_batches():
+    collection = RecordingCollection()
+
+    result = import_roster(collection, read_roster_rows(roster_csv(students(2500))), batch_size=1000)
+
+    assert result["batches"] == 3
+    assert [len(batch) for batch in collection.batches] == [1000, 1000, 500]
+    assert result["count"] == 2500
+    assert result["errors"] == []
+
+
+def test_bad_rows_are_reported_per_row():
+    collection = RecordingCollection(reject={"S000025"})
+    rows = students(30)
+    rows[4] = ("S000004", "Student 4", "") # missing phone: skipped before writing
+
+    result = import_roster(collection, read_roster_rows(roster_csv(rows)), batch_size=10)
+
+    assert result["batches"] == 3
+    assert result["count"] == 28
+    assert len(result["errors"]) == 2
+    assert result["errors"][0].startswith("Skipped row:") and "S000004" in result["errors"][0]
+    # CSV line numbers: header is line 1, rows[25] is line 27, in the third batch
+    assert result["errors"][1] == "Batch 3: row 27 (studentId S000025): Document failed validation"
+
+
+def test_rows_per_second(test_db):
+    from indexes import ensure_indexes
+    ensure_indexes(test_db) # unique studentId, as in production
+    rows = students(THROUGHPUT_ROWS)
+
+    first = import_roster(test_db.university_students, read_roster_rows(roster_csv(rows)))
+    again = import_roster(test_db.university_students, read_roster_rows(roster_csv(rows))) # all updates
+
+    print(f"\nroster import: {first['rowsPerSecond']} rows/s (insert), {again['rowsPerSecond']} rows/s (update)")
+    for result in (first, again):
+        assert result["count"] == THROUGHPUT_ROWS
+        assert result["errors"] == []
+        assert result["rowsPerSecond"] > 0
+        assert result["rowsPerSecond"] >= MIN_ROWS_PER_SECOND
+    assert test_db.university_students.count_documents({}) == THROUGHPUT_ROWS
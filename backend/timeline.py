@@ -0,0 +1,197 @@
+"""
+A student's medical timeline: appointments, prescriptions, lab requests and
+lab reports merged into one newest-first list by a single aggregation
+($unionWith, MongoDB 4.4+), paged with the same opaque cursors as the
+other list routes (see pagination.py).
+
+Every item keeps its own fields plus
+    "type": "appointment" | "prescription" | "labRequest" | "labReport"
+    "at":   "YYYY-MM-DDTHH:MM:SS.mmmZ" sort key, in UTC
+            (appointments: date + time; the rest: createdAt, or the
+            ObjectId creation time for records saved before createdAt)
+
+Appointment date/time and createdAt (datetime.now()) are local wall-clock
+times; they are converted from TIMELINE_TIMEZONE (an IANA name such as
+"Asia/Kolkata", or an offset like "+05:30"; default: the server's current
+UTC offset) so they order correctly against ObjectId times, which are UTC.
+
+Query string: ?types=appointment,prescription (default: all),
+?appointmentStatus= / ?prescriptionStatus= / ?labRequestStatus=,
+?from=YYYY-MM-DD / ?to=YYYY-MM-DD (inclusive, local days), ?limit= / ?cursor=.
+
+Each branch reads its student_* index in order (studentId, then its own
+date/createdAt and _id descending), bounded by the cursor and date range,
+and only then computes "at" and takes limit + 1, so no branch sorts in
+memory and the merge sorts at most types * (limit + 1) documents.
+"""
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from pagination import InvalidPageRequest, keyset_filter, decode_cursor, encode_cursor
+
+TIMELINE_TIMEZONE = os.getenv('TIMELINE_TIMEZONE') or time.strftime('%z')
+
+TIMELINE_SORT = [("at", -1), ("_id", -1)]
+
+_AT_FORMAT = "%Y-%m-%dT%H:%M:%S.%LZ" # $dateToString; Python parses it with %f
+_LOCAL_FORMAT = "%Y-%m-%dT%H:%M:%S.%L"
+_DAY = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_OFFSET = re.compile(r'^([+-])(\d{2}):?(\d{2})$')
+
+
+def _zone(name):
+    match = _OFFSET.match(name)
+    if match:
+        offset = timedelta(hours=int(match[2]), minutes=int(match[3]))
+        return timezone(-offset if match[1] == '-' else offset)
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(name)
+
+
+LOCAL_ZONE = _zone(TIMELINE_TIMEZONE)
+
+
+def _utc_at(date_expr):
+    return {"$dateToString": {"format": _AT_FORMAT, "date": date_expr}}
+
+
+def _appointment_at():
+    local = {"$concat": ["$date", "T", "$time"]} # null if either is missing
+    return _utc_at({"$dateFromString": {"dateString": local, "format": "%Y-%m-%dT%H:%M",
+                                        "timezone": TIMELINE_TIMEZONE, "onError": None, "onNull": None}})
+
+
+def _created_at():
+    local = {"$dateToString": {"format": _LOCAL_FORMAT, "date": "$createdAt"}}
+    return _utc_at({"$cond": [
+        {"$eq": [{"$type": "$createdAt"}, "date"]},
+        {"$dateFromString": {"dateString": local, "format": _LOCAL_FORMAT, "timezone": TIMELINE_TIMEZONE}},
+        {"$toDate": "$_id"},
+    ]})
+
+
+def _appointment_bounds(low, high):
+    # Whole local days: a superset, the exact "at" filter follows
+    bounds = {}
+    if low:
+        bounds["$gte"] = low.astimezone(LOCAL_ZONE).strftime("%Y-%m-%d")
+    if high:
+        bounds["$lte"] = high.astimezone(LOCAL_ZONE).strftime("%Y-%m-%d")
+    return {"date": bounds} if bounds else {}
+
+
+def _created_bounds(low, high):
+    # $not keeps records without createdAt (they sort last, by ObjectId time)
+    conditions = []
+    if low:
+        conditions.append({"createdAt": {"$not": {"$lt": low.astimezone(LOCAL_ZONE).replace(tzinfo=None)}}})
+    if high:
+        conditions.append({"createdAt": {"$not": {"$gt": high.astimezone(LOCAL_ZONE).replace(tzinfo=None)}}})
+    return {"$and": conditions} if conditions else {}
+
+
+_CREATED_SORT = {"createdAt": -1, "_id": -1}
+
+# type -> (collection, index order, "at" expression, native bounds, status filter parameter)
+SOURCES = {
+    "appointment": ("appointments", {"date": -1, "time": -1, "_id": -1}, _appointment_at(), _appointment_bounds, "appointmentStatus"),
+    "prescription": ("prescriptions", _CREATED_SORT, _created_at(), _created_bounds, "prescriptionStatus"),
+    "labRequest": ("lab_requests", _CREATED_SORT, _created_at(), _created_bounds, "labRequestStatus"),
+    "labReport": ("lab_reports", _CREATED_SORT, _created_at(), _created_bounds, None),
+}
+
+
+def timeline_options(args):
+    """Parse types / status / date range filters from the query string."""
+    types = [t.strip() for t in args.get('types', '').split(',') if t.strip()] or list(SOURCES)
+    unknown = [t for t in types if t not in SOURCES]
+    if unknown:
+        raise InvalidPageRequest(f"Unknown timeline types: {', '.join(unknown)}")
+
+    statuses = {}
+    for t in types:
+        param = SOURCES[t][4]
+        if param and args.get(param):
+            statuses[t] = args.get(param)
+
+    date_from, date_to = args.get('from'), args.get('to')
+    for value in (date_from, date_to):
+        if value and not _DAY.match(value):
+            raise InvalidPageRequest("from/to must be YYYY-MM-DD")
+    return {"types": types, "statuses": statuses, "date_from": date_from, "date_to": date_to}
+
+
+def _branch(source_type, student_id, status, low, high, at_filter, limit):
+    _, order, at_expr, native_bounds, _ = SOURCES[source_type]
+    match = {"studentId": student_id, **native_bounds(low, high)}
+    if status:
+        match["status"] = status
+    pipeline = [
+        {"$match": match},
+        {"$sort": order},
+        {"$addFields": {"type": source_type, "at": at_expr}},
+    ]
+    if at_filter:
+        pipeline.append({"$match": at_filter})
+    pipeline.append({"$limit": limit + 1})
+    return pipeline
+
+
+def _local_midnight(day):
+    return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=LOCAL_ZONE).astimezone(timezone.utc)
+
+
+def _at_string(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def timeline_pipeline(student_id, limit, cursor=None, types=None, statuses=None, date_from=None, date_to=None):
+    types = types or list(SOURCES)
+    statuses = statuses or {}
+
+    # low / high: UTC bounds each branch can apply to its own indexed field
+    conditions = []
+    low = high = None
+    if date_from:
+        low = _local_midnight(date_from)
+        conditions.append({"at": {"$gte": _at_string(low)}})
+    if date_to:
+        high = _local_midnight(date_to) + timedelta(days=1)
+        conditions.append({"at": {"$lt": _at_string(high)}})
+    if cursor:
+        values = decode_cursor(cursor, TIMELINE_SORT)
+        after = keyset_filter(TIMELINE_SORT, values)
+        if after is None:
+            return None
+        if values[0] is not None:
+            try:
+                last = datetime.strptime(values[0], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+            except (TypeError, ValueError):
+                raise InvalidPageRequest("Invalid cursor")
+            high = min(high, last) if high else last
+        conditions.append(after)
+    at_filter = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else None)
+
+    first, *rest = types
+    pipeline = _branch(first, student_id, statuses.get(first), low, high, at_filter, limit)
+    for source_type in rest:
+        pipeline.append({"$unionWith": {
+            "coll": SOURCES[source_type][0],
+            "pipeline": _branch(source_type, student_id, statuses.get(source_type), low, high, at_filter, limit)
+        }})
+    pipeline += [{"$sort": dict(TIMELINE_SORT)}, {"$limit": limit + 1}]
+    return SOURCES[first][0], pipeline
+
+
+def fetch_timeline(db, student_id, limit, cursor=None, **options):
+    """Returns (items, next_cursor) like pagination.fetch_page."""
+    built = timeline_pipeline(student_id, limit, cursor, **options)
+    if built is None:
+        return [], None
+    collection_name, pipeline = built
+    docs = list(db[collection_name].aggregate(pipeline))
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1], TIMELINE_SORT)
@@ -0,0 +1,46 @@
+"""
+Change versions for conditional GETs.
+
+Each student and doctor has a counter in the change_versions collection
+("student:<id>", "doctor:<id>") that every write touching their
+appointments, prescriptions or lab data increments. History routes derive
+their ETag from it, so an unchanged dashboard poll costs one _id lookup
+and a 304 instead of the list query and a full payload.
+"""
+import hashlib
+from bson import ObjectId
+from pymongo import UpdateOne
+
+
+def student_key(student_id):
+    return f"student:{student_id}"
+
+
+def doctor_key(doctor_id):
+    return f"doctor:{doctor_id}"
+
+
+class ChangeVersions:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def bump(self, *keys):
+        keys = [k for k in keys if k and not k.endswith(":None")]
+        if not keys:
+            return
+        # epoch tells a recreated counter apart from an old one with the same number
+        self.collection.bulk_write([
+            UpdateOne({"_id": k}, {"$inc": {"v": 1}, "$setOnInsert": {"epoch": str(ObjectId())}}, upsert=True)
+            for k in keys
+        ], ordered=False)
+
+    def get(self, key):
+        doc = self.collection.find_one({"_id": key})
+        if not doc:
+            return "0"
+        return f"{doc.get('epoch', '')}.{doc.get('v', 0)}"
+
+    def etag(self, key, variant=""):
+        """Strong validator for `key` at its current version; `variant` separates URLs/query strings."""
+        raw = f"{key}|{self.get(key)}|{variant}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()